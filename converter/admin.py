@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Currency, ExchangeRate
+from .models import Currency, ExchangeRate, RateHistory, RateTable
 
 
 @admin.register(Currency)
@@ -16,3 +16,18 @@ class ExchangeRateAdmin(admin.ModelAdmin):
     search_fields = ('base_currency__code', 'target_currency__code')
     ordering = ('-last_updated',)
     readonly_fields = ('last_updated',)
+
+
+@admin.register(RateTable)
+class RateTableAdmin(admin.ModelAdmin):
+    list_display = ('base_currency', 'refreshed_at', 'changed_at')
+    ordering = ('base_currency',)
+    readonly_fields = ('refreshed_at', 'changed_at')
+
+
+@admin.register(RateHistory)
+class RateHistoryAdmin(admin.ModelAdmin):
+    list_display = ('base_currency', 'captured_at')
+    list_filter = ('base_currency',)
+    ordering = ('-captured_at',)
+    readonly_fields = ('base_currency', 'captured_at', 'codes', 'rates')
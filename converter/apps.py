@@ -6,17 +6,6 @@ class ConverterConfig(AppConfig):
     name = 'converter'
     
     def ready(self):
-        """Initialize currencies when the app starts"""
+        """Connect signal receivers; startup does no database or network work"""
         # Import here to avoid AppRegistryNotReady error
-        from .services import CurrencyService
-        from .models import Currency
-        
-        # Only initialize if database is ready and no currencies exist
-        try:
-            if Currency.objects.count() == 0:
-                print("Initializing currencies...")
-                CurrencyService.initialize_currencies()
-                print("Currencies initialized successfully!")
-        except Exception as e:
-            # Database might not be ready yet (during migrations)
-            pass
+        from . import checks, history, payloads, ratecache, versions  # noqa: F401
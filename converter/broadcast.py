@@ -0,0 +1,188 @@
+import asyncio
+import logging
+from collections import deque
+from django.conf import settings
+from .models import ExchangeRate
+from .renderers import FastJSONRenderer
+from .crossrates import derive_table, pivot_for
+from .versions import RateVersion, aget_rate_changes, aget_rate_version
+
+logger = logging.getLogger(__name__)
+
+
+def sse_event(event, event_id, data):
+    """Encode one Server-Sent Event"""
+    body = FastJSONRenderer().render(data)
+    return b'event: %s\nid: %s\ndata: %s\n\n' % (event.encode(), event_id.encode(), body)
+
+
+class _Table:
+    """The latest known rate table of one base currency, plus its recent deltas"""
+
+    def __init__(self):
+        self.version = None
+        self.rates = {}
+        self.snapshot = None
+        # (version token, {code: rate changed}) for the last few versions, oldest first
+        self.deltas = deque(maxlen=settings.RATE_STREAM_DELTA_HISTORY)
+        self.lock = asyncio.Lock()
+        self.subscribers = set()
+
+
+class RateBroadcaster:
+    """
+    Per-process fan-out of rate changes to /rates/stream/ clients.
+
+    One task polls the shared rate version of every base that has listeners.
+    When a version changes its logged change set is applied (or, if that is
+    gone, the table is read once and diffed) and the encoded delta is queued
+    for every listener, so idle clients cost no queries and an update costs
+    at most one query per process.
+    """
+
+    def __init__(self):
+        self._tables = {}
+        self._loop = None
+        self._task = None
+
+    def _bind(self):
+        # Queues and locks belong to one event loop; start over on a new one
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            self._loop = loop
+            self._tables = {}
+            self._task = None
+        if self._task is None or self._task.done():
+            self._task = loop.create_task(self._run())
+
+    def subscribe(self, base_currency):
+        """Register a listener and return its queue of (version token, event bytes)"""
+        self._bind()
+        table = self._tables.setdefault(base_currency, _Table())
+        queue = asyncio.Queue(maxsize=settings.RATE_STREAM_QUEUE_SIZE)
+        table.subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, base_currency, queue):
+        table = self._tables.get(base_currency)
+        if table is not None:
+            table.subscribers.discard(queue)
+
+    async def catch_up(self, base_currency, last_event_id=None):
+        """
+        Return (version token, event bytes) bringing a client up to date, or None.
+
+        Clients whose last seen version is still in the delta history get only
+        the pairs changed since; everyone else gets the full table.
+        """
+        table = await self.refresh(base_currency)
+        if table.version is None or last_event_id == table.version.token:
+            return None
+
+        tokens = [token for token, _ in table.deltas]
+        if last_event_id in tokens:
+            changes = {}
+            for _, delta in list(table.deltas)[tokens.index(last_event_id) + 1:]:
+                changes.update(delta)
+            return table.version.token, sse_event(
+                'delta', table.version.token, self._delta_data(base_currency, table, changes)
+            )
+        return table.version.token, table.snapshot
+
+    async def refresh(self, base_currency):
+        """Bring this process's copy of a base's table up to the current version"""
+        table = self._tables.setdefault(base_currency, _Table())
+        async with table.lock:
+            pivot = pivot_for(base_currency)
+            if pivot is not None:
+                loaded = await self._load_derived(base_currency, pivot, table)
+            else:
+                loaded = await self._load(base_currency, table)
+            if loaded is None:
+                return table
+
+            version, rates, changes = loaded
+            first = table.version is None
+            table.version = version
+            table.rates = rates
+            table.snapshot = sse_event('snapshot', version.token, {
+                'base_currency': base_currency,
+                'version': version.token,
+                'updated_at': version.updated_at,
+                'rates': {code: '{:f}'.format(rate) for code, rate in sorted(rates.items())},
+            })
+            # The first version read is kept too, as a starting point to catch up from
+            table.deltas.append((version.token, {} if first else changes))
+            if first:
+                return table
+
+            event = (version.token, sse_event(
+                'delta', version.token, self._delta_data(base_currency, table, changes)
+            ))
+            for queue in list(table.subscribers):
+                try:
+                    queue.put_nowait(event)
+                except asyncio.QueueFull:
+                    # Too slow to keep up: end its stream so it reconnects and catches up
+                    table.subscribers.discard(queue)
+                    queue.get_nowait()
+                    queue.put_nowait(None)
+            return table
+
+    async def _load(self, base_currency, table):
+        """Return (version, rates, changes) if the stored table has moved on, else None"""
+        version = await aget_rate_version(base_currency)
+        if version is None or version == table.version:
+            return None
+
+        logged = None if table.version is None else await aget_rate_changes(version)
+        if logged is not None and logged[0] == table.version.token:
+            # One refresh on from ours: apply its logged change set, no query needed
+            changes = logged[1]
+            return version, {**table.rates, **changes}, changes
+
+        rates = {
+            code: rate async for code, rate in ExchangeRate.objects.filter(
+                base_currency_id=base_currency
+            ).values_list('target_currency_id', 'rate')
+        }
+        return version, rates, self._diff(table.rates, rates)
+
+    async def _load_derived(self, base_currency, pivot, table):
+        """_load for a base whose rates are derived from the pivot currency's"""
+        pivot_table = await self.refresh(pivot)
+        if pivot_table.version is None:
+            return None
+        version = RateVersion(base_currency, pivot_table.version.updated_at)
+        if version == table.version:
+            return None
+
+        rates = derive_table(base_currency, pivot_table.rates)
+        return version, rates, self._diff(table.rates, rates)
+
+    @staticmethod
+    def _diff(old, new):
+        return {code: rate for code, rate in new.items() if old.get(code) != rate}
+
+    @staticmethod
+    def _delta_data(base_currency, table, changes):
+        return {
+            'base_currency': base_currency,
+            'version': table.version.token,
+            'updated_at': table.version.updated_at,
+            'changes': {code: '{:f}'.format(rate) for code, rate in sorted(changes.items())},
+        }
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(settings.RATE_STREAM_POLL_INTERVAL)
+            for base_currency, table in list(self._tables.items()):
+                if not table.subscribers:
+                    continue
+                try:
+                    await self.refresh(base_currency)
+                except Exception:
+                    logger.exception("Could not poll %s rates for streaming", base_currency)
+
+
+rate_broadcaster = RateBroadcaster()
@@ -0,0 +1,48 @@
+import os
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Backends whose data lives inside one process
+PROCESS_LOCAL_CACHES = {
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+}
+
+HINT = "Set REDIS_URL to a Redis server shared by every worker."
+
+
+def _cache_is_process_local():
+    return settings.CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHES
+
+
+@register()
+def check_shared_cache(app_configs, **kwargs):
+    """
+    Refresh locks, job dedup, rate versions and payload invalidation all go
+    through the default cache, so several workers need a shared one. This
+    is a warning rather than an error so existing deployments keep starting.
+    """
+    try:
+        workers = int(os.environ.get('WEB_CONCURRENCY', '1'))
+    except ValueError:
+        workers = 1
+    if workers > 1 and _cache_is_process_local():
+        return [Warning(
+            f"WEB_CONCURRENCY is {workers} but the default cache is process-local, "
+            "so workers will not coalesce refreshes or see each other's rate versions.",
+            hint=HINT,
+            id='converter.W002',
+        )]
+    return []
+
+
+@register(deploy=True)
+def check_shared_cache_deploy(app_configs, **kwargs):
+    if not _cache_is_process_local():
+        return []
+    return [Warning(
+        "The default cache is process-local, so refreshes are only coalesced "
+        "within one process and run_rate_refresher's updates are not seen by web workers.",
+        hint=HINT,
+        id='converter.W001',
+    )]
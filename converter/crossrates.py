@@ -0,0 +1,45 @@
+from decimal import Context, DivisionByZero, InvalidOperation, ROUND_HALF_EVEN
+from django.conf import settings
+from .serializers import DECIMAL_CONTEXT, RATE_QUANTUM
+
+
+def pivot_for(base_currency):
+    """
+    Return the pivot currency a base's rates are derived from, or None when
+    they are quoted directly (triangulation off, the pivot itself, or a base
+    listed in RATE_EXACT_QUOTE_BASES).
+    """
+    pivot = settings.RATE_PIVOT_CURRENCY
+    if not pivot or base_currency == pivot or base_currency in settings.RATE_EXACT_QUOTE_BASES:
+        return None
+    return pivot
+
+
+def cross_rate(pivot_to_from, pivot_to_to):
+    """
+    Rate of from -> to given both currencies' rates against the pivot.
+
+    Divides at RATE_CROSS_PRECISION significant digits, then rounds to the
+    six decimal places stored rates have. Returns None if from has no usable
+    rate.
+    """
+    context = Context(prec=settings.RATE_CROSS_PRECISION, rounding=ROUND_HALF_EVEN)
+    try:
+        rate = context.divide(pivot_to_to, pivot_to_from)
+    except (DivisionByZero, InvalidOperation):
+        return None
+    return rate.quantize(RATE_QUANTUM, context=DECIMAL_CONTEXT)
+
+
+def derive_table(base_currency, pivot_rates):
+    """Derive base_currency's full table from the pivot's {code: rate} table"""
+    pivot_to_base = pivot_rates.get(base_currency)
+    if pivot_to_base is None:
+        return {}
+    derived = {}
+    for code, rate in pivot_rates.items():
+        cross = cross_rate(pivot_to_base, rate)
+        if cross is None:
+            return {}
+        derived[code] = cross
+    return derived
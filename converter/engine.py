@@ -0,0 +1,237 @@
+import fcntl
+import logging
+import os
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .models import ExchangeRate, RateTable
+from .snapshotfile import MappedRateSnapshot, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+
+class RateSnapshot:
+    """Immutable, array-backed matrix of exchange rates"""
+
+    def __init__(self, codes, rates, refreshed):
+        # Currency codes are indexed once; every rate lives at
+        # rates[base_index * size + target_index]
+        self.codes = tuple(codes)
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.size = len(self.codes)
+        self.rates = rates
+        # {base code: when its table was last refreshed}
+        self.refreshed = refreshed
+        self.loaded_at = time.monotonic()
+
+    @classmethod
+    def from_rows(cls, rows, refreshed=None):
+        """Build a snapshot from (base, target, rate, last_updated) rows"""
+        rows = list(rows)
+        codes = sorted({row[0] for row in rows} | {row[1] for row in rows})
+        size = len(codes)
+        index = {code: i for i, code in enumerate(codes)}
+        rates = [None] * (size * size)
+        # Bases without a RateTable row rewrote every rate on each refresh
+        latest = {}
+
+        for base, target, rate, last_updated in rows:
+            rates[index[base] * size + index[target]] = rate
+            if base not in latest or last_updated > latest[base]:
+                latest[base] = last_updated
+
+        latest.update(refreshed or {})
+        return cls(codes, rates, latest)
+
+    def lookup(self, from_currency, to_currency):
+        """Return (rate, refreshed_at) for a pair, or None if not loaded"""
+        i = self.index.get(from_currency)
+        j = self.index.get(to_currency)
+        if i is None or j is None:
+            return None
+
+        rate = self.rates[i * self.size + j]
+        if rate is None:
+            return None
+        return rate, self.refreshed[from_currency]
+
+    def apply(self, base_currency, changes, refreshed_at):
+        """
+        Return a new snapshot with a refresh's changes applied, or None when
+        they add currencies the matrix has no room for.
+        """
+        i = self.index.get(base_currency)
+        if i is None or any(code not in self.index for code in changes):
+            return None
+
+        rates = list(self.rates)
+        for code, rate in changes.items():
+            rates[i * self.size + self.index[code]] = rate
+        snapshot = RateSnapshot(self.codes, rates, dict(self.refreshed))
+        snapshot.refreshed[base_currency] = refreshed_at
+        snapshot.loaded_at = self.loaded_at
+        return snapshot
+
+
+class RateEngine:
+    """
+    Process-local rate matrix that serves lookups without touching the DB.
+
+    With RATE_SNAPSHOT_PATH set, the matrix is instead published as a snapshot
+    file that every worker on the host maps read-only. Refreshes write a new
+    file and rename it into place; workers notice within
+    RATE_SNAPSHOT_CHECK_INTERVAL seconds and swap their mapping.
+    """
+
+    def __init__(self):
+        self._snapshot = None
+        self._lock = threading.Lock()
+        self._next_check = 0
+
+    @property
+    def shared(self):
+        """Whether rates are served from the shared snapshot file"""
+        return bool(settings.RATE_SNAPSHOT_PATH)
+
+    def _is_expired(self, snapshot):
+        max_age = getattr(settings, 'RATE_ENGINE_RELOAD_INTERVAL', 60)
+        return time.monotonic() - snapshot.loaded_at > max_age
+
+    def snapshot(self):
+        """Return the current snapshot, loading it if missing or expired"""
+        if self.shared:
+            return self._mapped_snapshot()
+        snapshot = self._snapshot
+        if snapshot is None or self._is_expired(snapshot):
+            snapshot = self.reload()
+        return snapshot
+
+    def _read(self):
+        rows = ExchangeRate.objects.values_list(
+            'base_currency_id', 'target_currency_id', 'rate', 'last_updated'
+        )
+        refreshed = dict(RateTable.objects.values_list('base_currency_id', 'refreshed_at'))
+        return RateSnapshot.from_rows(rows, refreshed)
+
+    def reload(self):
+        """Rebuild the matrix from the database and swap it in atomically"""
+        with self._lock:
+            snapshot = self._read()
+            self._snapshot = snapshot
+        return snapshot
+
+    def _mapped_snapshot(self):
+        snapshot = self._snapshot
+        now = time.monotonic()
+        if snapshot is not None and now < self._next_check:
+            return snapshot
+        self._next_check = now + settings.RATE_SNAPSHOT_CHECK_INTERVAL
+
+        max_age = getattr(settings, 'RATE_ENGINE_RELOAD_INTERVAL', 60)
+        path = settings.RATE_SNAPSHOT_PATH
+        try:
+            stat = os.stat(path)
+            if not isinstance(snapshot, MappedRateSnapshot) or (
+                (stat.st_ino, stat.st_mtime_ns) != (snapshot.stat.st_ino, snapshot.stat.st_mtime_ns)
+            ):
+                snapshot = MappedRateSnapshot(path)
+                self._snapshot = snapshot
+            # Refreshes made on other hosts only reach this one through the database
+            if time.time() - snapshot.published_at > max_age:
+                snapshot = self.publish(max_age)
+            return snapshot
+        except (OSError, ValueError):
+            pass
+
+        try:
+            return self.publish(max_age)
+        except OSError:
+            logger.exception("Could not publish the rate snapshot to %s", path)
+            return self.reload()
+
+    def publish(self, max_age=None):
+        """
+        Rebuild the matrix from the database, publish it as the shared
+        snapshot file and map it.
+
+        Publishers on the host take turns. With max_age, a file another
+        worker published within that many seconds is mapped as is, so workers
+        that find the file missing or old at the same time rebuild it once.
+        """
+        path = settings.RATE_SNAPSHOT_PATH
+        with self._lock, open(f'{path}.lock', 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            if max_age is not None:
+                try:
+                    current = MappedRateSnapshot(path)
+                except (OSError, ValueError):
+                    current = None
+                if current is not None and time.time() - current.published_at <= max_age:
+                    self._snapshot = current
+                    return current
+
+            write_snapshot(path, self._read())
+            snapshot = MappedRateSnapshot(path)
+            self._snapshot = snapshot
+        return snapshot
+
+    async def asnapshot(self):
+        """Async counterpart of snapshot() that loads through the async ORM"""
+        if self.shared:
+            snapshot = self._snapshot
+            if snapshot is not None and time.monotonic() < self._next_check:
+                return snapshot
+            # Checking the file may mean rebuilding it from the database
+            return await sync_to_async(self.snapshot)()
+        snapshot = self._snapshot
+        if snapshot is None or self._is_expired(snapshot):
+            snapshot = await self.areload()
+        return snapshot
+
+    async def areload(self):
+        """Async counterpart of reload()"""
+        rows = [
+            row async for row in ExchangeRate.objects.values_list(
+                'base_currency_id', 'target_currency_id', 'rate', 'last_updated'
+            )
+        ]
+        refreshed = {
+            base: refreshed_at async for base, refreshed_at in
+            RateTable.objects.values_list('base_currency_id', 'refreshed_at')
+        }
+        snapshot = RateSnapshot.from_rows(rows, refreshed)
+        self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        """Drop the current snapshot so the next lookup reloads it"""
+        self._snapshot = None
+        self._next_check = 0
+
+    def apply(self, base_currency, changes, refreshed_at):
+        """Apply a committed refresh in place, reloading only if it cannot be"""
+        if self.shared:
+            try:
+                self.publish()
+            except OSError:
+                logger.exception("Could not publish the rate snapshot to %s", settings.RATE_SNAPSHOT_PATH)
+                self.invalidate()
+            return
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is not None:
+                snapshot = snapshot.apply(base_currency, changes, refreshed_at)
+            self._snapshot = snapshot
+
+    def lookup(self, from_currency, to_currency):
+        """Return (rate, refreshed_at) for a pair, or None if not loaded"""
+        return self.snapshot().lookup(from_currency, to_currency)
+
+    async def alookup(self, from_currency, to_currency):
+        """Async counterpart of lookup"""
+        return (await self.asnapshot()).lookup(from_currency, to_currency)
+
+
+rate_engine = RateEngine()
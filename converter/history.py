@@ -0,0 +1,122 @@
+import bisect
+import struct
+from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
+from django.db.models import F, Window
+from django.db.models.functions import Mod, RowNumber
+from django.dispatch import receiver
+from .models import RateHistory
+from .signals import rates_updated
+
+# Rates are stored as integer micro-units, matching ExchangeRate.rate's 6 decimal places
+RATE_SCALE = 6
+CODE_WIDTH = 3
+
+
+def pack_rates(rates):
+    """Pack {code: Decimal} into (codes, rates) byte strings sorted by code"""
+    codes = sorted(rates)
+    packed_codes = b''.join(code.encode('ascii').ljust(CODE_WIDTH) for code in codes)
+    packed_rates = struct.pack(
+        f'<{len(codes)}q',
+        *(
+            int(Decimal(rates[code]).scaleb(RATE_SCALE).to_integral_value(ROUND_HALF_UP))
+            for code in codes
+        )
+    )
+    return packed_codes, packed_rates
+
+
+def unpack_codes(packed_codes):
+    packed_codes = bytes(packed_codes)
+    return [
+        packed_codes[i:i + CODE_WIDTH].decode('ascii').rstrip()
+        for i in range(0, len(packed_codes), CODE_WIDTH)
+    ]
+
+
+def unpack_rates(packed_codes, packed_rates):
+    """Inverse of pack_rates"""
+    codes = unpack_codes(packed_codes)
+    values = struct.unpack(f'<{len(codes)}q', bytes(packed_rates))
+    return {code: Decimal(value).scaleb(-RATE_SCALE) for code, value in zip(codes, values)}
+
+
+def _rate_in(packed_codes, packed_rates, target_currency):
+    """Binary-search one target's rate in a packed snapshot without unpacking it all"""
+    codes = unpack_codes(packed_codes)
+    i = bisect.bisect_left(codes, target_currency)
+    if i == len(codes) or codes[i] != target_currency:
+        return None
+    (value,) = struct.unpack_from('<q', bytes(packed_rates), i * 8)
+    return Decimal(value).scaleb(-RATE_SCALE)
+
+
+def record_snapshot(base_currency, captured_at, rates):
+    """Append one snapshot of a base currency's rate table"""
+    codes, packed = pack_rates(rates)
+    return RateHistory.objects.create(
+        base_currency_id=base_currency,
+        captured_at=captured_at,
+        codes=codes,
+        rates=packed
+    )
+
+
+def rate_as_of(base_currency, target_currency, at):
+    """
+    Return (rate, captured_at) for a pair as it was at time `at`, or None.
+
+    Uses the (base_currency, captured_at) index to find the latest snapshot
+    taken at or before `at`.
+    """
+    snapshot = RateHistory.objects.filter(
+        base_currency_id=base_currency, captured_at__lte=at
+    ).order_by('-captured_at').values_list('captured_at', 'codes', 'rates').first()
+    if snapshot is None:
+        return None
+
+    captured_at, codes, rates = snapshot
+    rate = _rate_in(codes, rates, target_currency)
+    if rate is None:
+        return None
+    return rate, captured_at
+
+
+def rate_series(base_currency, target_currency, start=None, end=None, max_points=None):
+    """
+    Return [(captured_at, rate)] for a pair between start and end, oldest first.
+
+    When there are more than max_points snapshots the series is thinned by
+    keeping evenly spaced ones, so charts over years of history stay cheap.
+    """
+    snapshots = RateHistory.objects.filter(base_currency_id=base_currency)
+    if start is not None:
+        snapshots = snapshots.filter(captured_at__gte=start)
+    if end is not None:
+        snapshots = snapshots.filter(captured_at__lte=end)
+    snapshots = snapshots.order_by('captured_at')
+
+    max_points = max_points or settings.RATE_HISTORY_MAX_POINTS
+    total = snapshots.count()
+    step = max(1, -(-total // max_points))
+    if step > 1:
+        # Thin in SQL so only the kept snapshots' blobs are ever read
+        snapshots = snapshots.alias(
+            position=Window(RowNumber(), order_by=F('captured_at').asc())
+        ).alias(
+            offset=Mod(F('position') - 1, step)
+        ).filter(offset=0).order_by('captured_at')
+
+    series = []
+    for captured_at, codes, rates in snapshots.values_list('captured_at', 'codes', 'rates'):
+        rate = _rate_in(codes, rates, target_currency)
+        if rate is not None:
+            series.append((captured_at, rate))
+    return series
+
+
+@receiver(rates_updated)
+def record_refresh(sender, base_currency, updated_at, rates, **kwargs):
+    if settings.RATE_HISTORY_ENABLED:
+        record_snapshot(base_currency, updated_at, rates)
@@ -0,0 +1,139 @@
+import logging
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connections
+from django.utils import timezone
+from .crossrates import pivot_for
+from .services import CurrencyService
+
+logger = logging.getLogger(__name__)
+
+QUEUED = 'queued'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+
+def _job_key(job_id):
+    return f'refresh-jobs:{job_id}'
+
+
+def _base_key(base_currency):
+    return f'refresh-jobs:base:{base_currency}'
+
+
+class RefreshJobs:
+    """
+    Manual rate refreshes, run off the request path.
+
+    Each base currency gets at most one job per REFRESH_JOB_DEDUP_WINDOW
+    seconds across all workers; repeated requests in that window are handed
+    the existing job. Job state lives in the shared cache, so any worker can
+    report it. Jobs run on a small per-process thread pool, and once
+    REFRESH_JOB_QUEUE_SIZE of them are queued or running new ones are refused.
+    """
+
+    def __init__(self):
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def get(self, job_id):
+        """Return a job's state as a dict, or None if it is unknown or expired"""
+        return cache.get(_job_key(job_id))
+
+    def submit(self, base_currency):
+        """
+        Queue a refresh of base_currency, or join the one already queued.
+
+        Bases derived from the pivot currency refresh the pivot instead, so
+        the job's base_currency is the one actually fetched. Returns
+        (job, created). job is None when the pool is full.
+        """
+        base_code = base_currency.upper()
+        base_code = pivot_for(base_code) or base_code
+        existing = cache.get(_base_key(base_code))
+        if existing is not None:
+            job = self.get(existing)
+            if job is not None:
+                return job, False
+
+        job = {
+            'id': uuid.uuid4().hex,
+            'base_currency': base_code,
+            'status': QUEUED,
+            'created_at': timezone.now(),
+            'started_at': None,
+            'finished_at': None,
+            'stats': None,
+            'error': None,
+        }
+        self._save(job)
+        # Only one request per window gets to create the job; the rest join it
+        if not cache.add(_base_key(base_code), job['id'], settings.REFRESH_JOB_DEDUP_WINDOW):
+            cache.delete(_job_key(job['id']))
+            existing = self.get(cache.get(_base_key(base_code)))
+            if existing is not None:
+                return existing, False
+            cache.set(_base_key(base_code), job['id'], settings.REFRESH_JOB_DEDUP_WINDOW)
+            self._save(job)
+
+        with self._lock:
+            full = self._pending >= settings.REFRESH_JOB_QUEUE_SIZE
+            if not full:
+                self._pending += 1
+        if full:
+            cache.delete_many([_base_key(base_code), _job_key(job['id'])])
+            return None, False
+
+        self._start(job)
+        return job, True
+
+    def _start(self, job):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.REFRESH_JOB_WORKERS,
+                    thread_name_prefix='refresh-job'
+                )
+        self._executor.submit(self._work, job)
+
+    def _work(self, job):
+        try:
+            self.run(job)
+        finally:
+            with self._lock:
+                self._pending -= 1
+            # Pool threads outlive requests, so nothing else closes their connections
+            connections.close_all()
+
+    def run(self, job):
+        """Refresh the job's base currency and record the outcome"""
+        job = dict(job, status=RUNNING, started_at=timezone.now())
+        self._save(job)
+        try:
+            stats = CurrencyService.refresh_exchange_rates(job['base_currency'])
+            if stats is False:
+                job.update(status=FAILED, error='Failed to update exchange rates')
+            else:
+                # None means another worker refreshed the same base meanwhile
+                job.update(status=SUCCEEDED, stats=stats)
+        except Exception as e:
+            logger.exception("Refresh job for %s rates failed", job['base_currency'])
+            job.update(status=FAILED, error=str(e))
+        finally:
+            job['finished_at'] = timezone.now()
+            self._save(job)
+        if job['status'] == FAILED and cache.get(_base_key(job['base_currency'])) == job['id']:
+            # Let the next request retry straight away instead of joining a failure
+            cache.delete(_base_key(job['base_currency']))
+        return job
+
+    def _save(self, job):
+        cache.set(_job_key(job['id']), job, settings.REFRESH_JOB_TTL)
+
+
+refresh_jobs = RefreshJobs()
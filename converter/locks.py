@@ -0,0 +1,113 @@
+import asyncio
+import threading
+import time
+import uuid
+from django.conf import settings
+from django.core.cache import cache
+
+
+class _Call:
+    """An in-flight call that other threads in this process can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+_calls = {}
+_calls_lock = threading.Lock()
+_async_calls = {}
+
+
+def single_flight(key, func, *args, **kwargs):
+    """
+    Run func once per key across threads and worker processes.
+
+    Threads in this process that arrive while a call is in flight wait for it
+    and share its result. Across processes a lock in the shared cache elects
+    one leader; everyone else waits for the lock to be released and gets None,
+    meaning the work was done elsewhere and the caller should re-read.
+    """
+    with _calls_lock:
+        call = _calls.get(key)
+        leader = call is None
+        if leader:
+            call = _calls[key] = _Call()
+
+    if not leader:
+        call.done.wait(settings.SINGLE_FLIGHT_WAIT_TIMEOUT)
+        return call.result
+
+    try:
+        call.result = _run_with_cache_lock(key, func, *args, **kwargs)
+        return call.result
+    finally:
+        with _calls_lock:
+            del _calls[key]
+        call.done.set()
+
+
+def _run_with_cache_lock(key, func, *args, **kwargs):
+    """Run func while holding a cluster-wide lock, or wait for the current holder"""
+    lock_key = f'single-flight:{key}'
+    token = uuid.uuid4().hex
+
+    # cache.add only succeeds for the first writer, so it doubles as a lock
+    if cache.add(lock_key, token, settings.SINGLE_FLIGHT_LOCK_TIMEOUT):
+        try:
+            return func(*args, **kwargs)
+        finally:
+            if cache.get(lock_key) == token:
+                cache.delete(lock_key)
+
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+    while cache.get(lock_key) is not None and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return None
+
+
+async def asingle_flight(key, func, *args, **kwargs):
+    """
+    Await the coroutine function func once per key across tasks and worker processes.
+
+    The async counterpart of single_flight: tasks on this event loop share one
+    in-flight call, and the same cache lock coordinates with other processes.
+    """
+    loop = asyncio.get_running_loop()
+    call = _async_calls.get((loop, key))
+    if call is not None:
+        try:
+            return await asyncio.wait_for(
+                asyncio.shield(call), settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+            )
+        except asyncio.TimeoutError:
+            return None
+
+    call = _async_calls[(loop, key)] = loop.create_task(
+        _arun_with_cache_lock(key, func, *args, **kwargs)
+    )
+    try:
+        return await asyncio.shield(call)
+    finally:
+        if call.done():
+            del _async_calls[(loop, key)]
+        else:
+            call.add_done_callback(lambda _: _async_calls.pop((loop, key), None))
+
+
+async def _arun_with_cache_lock(key, func, *args, **kwargs):
+    """Await func while holding the cluster-wide lock, or wait for the current holder"""
+    lock_key = f'single-flight:{key}'
+    token = uuid.uuid4().hex
+
+    if await cache.aadd(lock_key, token, settings.SINGLE_FLIGHT_LOCK_TIMEOUT):
+        try:
+            return await func(*args, **kwargs)
+        finally:
+            if await cache.aget(lock_key) == token:
+                await cache.adelete(lock_key)
+
+    deadline = time.monotonic() + settings.SINGLE_FLIGHT_WAIT_TIMEOUT
+    while await cache.aget(lock_key) is not None and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+    return None
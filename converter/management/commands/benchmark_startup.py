@@ -0,0 +1,88 @@
+import json
+import os
+import statistics
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# Run in a fresh interpreter each time so nothing is already imported or cached
+BOOT_SCRIPT = """
+import time
+started = time.perf_counter()
+import django
+from django.conf import settings
+settings.INSTALLED_APPS
+imported = time.perf_counter()
+django.setup()
+from {module} import application
+booted = time.perf_counter()
+print((imported - started) * 1000, (booted - started) * 1000)
+"""
+
+
+class Command(BaseCommand):
+    help = "Measure how long a fresh worker process takes to import and boot the Django app"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--runs', type=int, default=5,
+            help="Number of fresh processes to time (default: 5)"
+        )
+        parser.add_argument(
+            '--entrypoint', choices=['wsgi', 'asgi'], default='wsgi',
+            help="Application module to load (default: wsgi)"
+        )
+        parser.add_argument(
+            '--budget-ms', type=float, default=None,
+            help="Fail if the median boot time exceeds this many milliseconds"
+        )
+        parser.add_argument(
+            '--json', dest='json_path', default=None,
+            help="Write the results as JSON to this path"
+        )
+
+    def handle(self, *args, **options):
+        module = f"currency_converter.{options['entrypoint']}"
+        script = BOOT_SCRIPT.format(module=module)
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            'DJANGO_SETTINGS_MODULE', 'currency_converter.settings'
+        ))
+
+        settings_ms = []
+        boot_ms = []
+        for _ in range(options['runs']):
+            result = subprocess.run(
+                [sys.executable, '-c', script],
+                cwd=settings.BASE_DIR, env=env, capture_output=True, text=True
+            )
+            if result.returncode != 0:
+                raise CommandError(f"Boot failed:\n{result.stderr}")
+            imported, booted = (float(value) for value in result.stdout.split()[-2:])
+            settings_ms.append(imported)
+            boot_ms.append(booted)
+
+        results = {
+            'entrypoint': module,
+            'runs': options['runs'],
+            'settings_ms': round(statistics.median(settings_ms), 1),
+            'boot_ms_median': round(statistics.median(boot_ms), 1),
+            'boot_ms_max': round(max(boot_ms), 1),
+            'budget_ms': options['budget_ms'],
+        }
+
+        self.stdout.write(
+            f"{module}: settings {results['settings_ms']} ms, "
+            f"boot median {results['boot_ms_median']} ms, max {results['boot_ms_max']} ms "
+            f"over {options['runs']} runs"
+        )
+
+        if options['json_path']:
+            with open(options['json_path'], 'w') as f:
+                json.dump(results, f, indent=2)
+
+        if options['budget_ms'] is not None and results['boot_ms_median'] > options['budget_ms']:
+            raise CommandError(
+                f"Median boot time {results['boot_ms_median']} ms exceeds "
+                f"budget of {options['budget_ms']} ms"
+            )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from converter.seeding import export_rates
+
+
+class Command(BaseCommand):
+    help = "Dump currencies, exchange rates and rate history to a seed archive for import_rates"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Archive to write (a zip of CSV files)")
+
+    def handle(self, *args, **options):
+        counts = export_rates(options['path'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {', '.join(f'{count} rows of {name}' for name, count in counts.items())}"
+        ))
@@ -0,0 +1,19 @@
+import zipfile
+from django.core.management.base import BaseCommand, CommandError
+from converter.seeding import import_rates
+
+
+class Command(BaseCommand):
+    help = "Load a seed archive written by export_rates in one transaction, without network access"
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Archive written by export_rates")
+
+    def handle(self, *args, **options):
+        try:
+            counts = import_rates(options['path'])
+        except (OSError, ValueError, KeyError, zipfile.BadZipFile) as e:
+            raise CommandError(f"Could not import {options['path']}: {e}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {', '.join(f'{count} rows of {name}' for name, count in counts.items())}"
+        ))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from converter.models import Currency
+from converter.services import CurrencyService
+
+
+class Command(BaseCommand):
+    help = "Create all world currencies and the initial USD rates (safe to run repeatedly)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--if-empty', action='store_true',
+            help="Do nothing if any currencies already exist"
+        )
+
+    def handle(self, *args, **options):
+        if options['if_empty'] and Currency.objects.exists():
+            self.stdout.write("Currencies already initialized, skipping")
+            return
+
+        CurrencyService.initialize_currencies()
+        self.stdout.write(self.style.SUCCESS(
+            f"{Currency.objects.count()} currencies available"
+        ))
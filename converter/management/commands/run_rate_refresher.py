@@ -0,0 +1,129 @@
+import logging
+import time
+from datetime import timedelta
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections
+from django.db.models import Max
+from django.utils import timezone
+from converter import metrics
+from converter.crossrates import pivot_for
+from converter.models import ExchangeRate, RateTable
+from converter.services import CurrencyService
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Keep exchange rates fresh in the background so requests never refresh inline"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--base', action='append', dest='bases', metavar='CODE[:SECONDS]',
+            help="Base currency to refresh, optionally with its interval "
+                 "(defaults to RATE_REFRESH_SCHEDULE). May be repeated."
+        )
+        parser.add_argument(
+            '--tick', type=float, default=30,
+            help="Seconds between schedule checks (default: 30)"
+        )
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Refresh every due base currency once and exit"
+        )
+
+    def handle(self, *args, **options):
+        schedule = self.pivot_schedule(self.parse_schedule(options['bases']))
+        max_age = CurrencyService.max_rate_age()
+
+        for base, interval in schedule.items():
+            if interval >= max_age:
+                self.stderr.write(self.style.WARNING(
+                    f"{base} refresh interval ({interval}) is not shorter than the "
+                    f"rate max age ({max_age}); requests may see expired rates"
+                ))
+
+        next_due = self.initial_schedule(schedule)
+
+        while True:
+            # A long-lived process gets no request cycle to recycle dead or expired connections
+            close_old_connections()
+            now = timezone.now()
+            for base, due in next_due.items():
+                if due > now:
+                    continue
+
+                try:
+                    stats = CurrencyService.refresh_exchange_rates(base)
+                except Exception:
+                    # A database error or a malformed payload must not stop the daemon
+                    logger.exception("Refreshing %s rates failed", base)
+                    stats = False
+
+                if stats is None:
+                    next_due[base] = timezone.now() + schedule[base]
+                    self.stdout.write(f"{base} rates were refreshed by another worker")
+                elif stats:
+                    next_due[base] = timezone.now() + schedule[base]
+                    self.stdout.write(
+                        f"Refreshed {stats['rates']} {base} rates ({stats['changed']} changed) "
+                        f"in {stats['duration_ms']} ms ({stats['queries']} queries)"
+                    )
+                else:
+                    # Retry on the next tick instead of waiting a full interval
+                    self.stderr.write(self.style.ERROR(f"Failed to refresh {base} rates"))
+
+            metrics.flush(force=True)
+            if options['once']:
+                return
+
+            time.sleep(options['tick'])
+
+    def parse_schedule(self, bases):
+        """Build a {base: interval} schedule from --base options or settings"""
+        if not bases:
+            return {
+                code: timedelta(seconds=seconds)
+                for code, seconds in settings.RATE_REFRESH_SCHEDULE.items()
+            }
+
+        default_interval = CurrencyService.max_rate_age() / 2
+        schedule = {}
+        for entry in bases:
+            code, _, seconds = entry.partition(':')
+            try:
+                interval = timedelta(seconds=int(seconds)) if seconds else default_interval
+            except ValueError:
+                raise CommandError(f"Invalid refresh interval in '{entry}'")
+            schedule[code.strip().upper()] = interval
+        return schedule
+
+    def pivot_schedule(self, schedule):
+        """Refresh the pivot in place of bases derived from it, at the shortest interval asked for"""
+        fetched = {}
+        for base, interval in schedule.items():
+            pivot = pivot_for(base)
+            if pivot is not None:
+                self.stdout.write(f"{base} rates are derived from {pivot}; refreshing {pivot} instead")
+                base = pivot
+            fetched[base] = min(interval, fetched.get(base, interval))
+        return fetched
+
+    def initial_schedule(self, schedule):
+        """Work out when each base is next due from the rates already stored"""
+        latest = dict(
+            ExchangeRate.objects.filter(base_currency_id__in=schedule)
+            .values('base_currency_id')
+            .annotate(latest=Max('last_updated'))
+            .values_list('base_currency_id', 'latest')
+        )
+        # Unchanged rows keep their old last_updated; RateTable knows the real refresh time
+        latest.update(
+            RateTable.objects.filter(base_currency_id__in=schedule)
+            .values_list('base_currency_id', 'refreshed_at')
+        )
+        now = timezone.now()
+        return {
+            base: latest[base] + interval if base in latest else now
+            for base, interval in schedule.items()
+        }
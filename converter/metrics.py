@@ -0,0 +1,340 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import ExitStack
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Seconds, tuned for a service whose requests mostly finish in a few milliseconds
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Counter:
+    """A monotonically increasing count, one per combination of label values"""
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def dump(self):
+        with self._lock:
+            return {json.dumps(key): value for key, value in self.values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        return (total or 0) + value
+
+    def render(self, samples):
+        for key, value in sorted(samples.items()):
+            yield f'{self.name}{_labels(self.labels, json.loads(key))} {_number(value)}'
+
+
+class Histogram:
+    """Observations counted into cumulative buckets, with their sum and count"""
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets)
+        # {label values: [count per bucket..., +Inf count, sum]}
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts = self.values.get(label_values)
+            if counts is None:
+                counts = self.values[label_values] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            counts[-2] += 1
+            counts[-1] += value
+
+    def time(self, *label_values):
+        return _Timer(self, label_values)
+
+    def dump(self):
+        with self._lock:
+            return {json.dumps(key): list(counts) for key, counts in self.values.items()}
+
+    @staticmethod
+    def merge(total, value):
+        if total is None:
+            return list(value)
+        return [a + b for a, b in zip(total, value)]
+
+    def render(self, samples):
+        for key, counts in sorted(samples.items()):
+            values = json.loads(key)
+            for bound, count in zip(self.buckets + ('+Inf',), counts):
+                labels = _labels(self.labels + ('le',), values + [_number(bound)])
+                yield f'{self.name}_bucket{labels} {count}'
+            labels = _labels(self.labels, values)
+            yield f'{self.name}_sum{labels} {_number(counts[-1])}'
+            yield f'{self.name}_count{labels} {counts[-2]}'
+
+
+class _Timer:
+    def __init__(self, histogram, label_values):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.histogram.observe(time.perf_counter() - self._started, *self.label_values)
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(value) if value != int(value) else str(int(value))
+    return str(value)
+
+
+def _labels(names, values):
+    if not names:
+        return ''
+    pairs = (
+        '{}="{}"'.format(
+            name,
+            str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        )
+        for name, value in zip(names, values)
+    )
+    return '{' + ','.join(pairs) + '}'
+
+
+REGISTRY = {}
+
+
+def _register(metric):
+    REGISTRY[metric.name] = metric
+    return metric
+
+
+request_duration = _register(Histogram(
+    'converter_http_request_duration_seconds', "Request latency by view",
+    labels=('view', 'method')
+))
+requests_total = _register(Counter(
+    'converter_http_requests_total', "Requests by view and response status",
+    labels=('view', 'method', 'status')
+))
+request_queries = _register(Histogram(
+    'converter_db_queries_per_request', "Database queries run by one request",
+    labels=('view',), buckets=QUERY_COUNT_BUCKETS
+))
+request_query_duration = _register(Histogram(
+    'converter_db_query_duration_seconds_per_request', "Time one request spent in the database",
+    labels=('view',)
+))
+upstream_duration = _register(Histogram(
+    'converter_upstream_fetch_duration_seconds', "Latency of rate table fetches by provider",
+    labels=('provider',)
+))
+upstream_fetches = _register(Counter(
+    'converter_upstream_fetches_total', "Rate table fetches by provider and outcome",
+    labels=('provider', 'outcome')
+))
+refresh_duration = _register(Histogram(
+    'converter_rate_refresh_duration_seconds', "Time to fetch and store a base currency's rates",
+    labels=('base_currency',)
+))
+refreshes = _register(Counter(
+    'converter_rate_refreshes_total', "Rate refreshes by base currency and outcome",
+    labels=('base_currency', 'outcome')
+))
+rate_cache_lookups = _register(Counter(
+    'converter_rate_cache_lookups_total',
+    "In-memory rate lookups: hit, stale (served while revalidating) or miss",
+    labels=('result',)
+))
+rate_cache_requests = _register(Counter(
+    'converter_rate_cache_requests_total', "Pair lookups in the two-tier rate cache by tier",
+    labels=('tier', 'result')
+))
+rate_cache_evictions = _register(Counter(
+    'converter_rate_cache_evictions_total', "Pairs evicted from the per-process rate cache"
+))
+payload_cache_lookups = _register(Counter(
+    'converter_payload_cache_lookups_total', "Precomputed response payload lookups",
+    labels=('payload', 'result')
+))
+
+
+# Gunicorn runs several worker processes and a scrape reaches only one of
+# them, so each process periodically writes its samples to METRICS_DIR and
+# the scraped worker sums every file. Files of exited workers are kept so
+# their counts never go backwards; clear the directory when the server starts.
+_started = int(time.time())
+_last_flush = 0.0
+_flush_lock = threading.Lock()
+
+
+def _process_file():
+    return os.path.join(settings.METRICS_DIR, f'{os.getpid()}-{_started}.json')
+
+
+def dump():
+    """This process's samples as {metric name: {label key: value}}"""
+    return {name: metric.dump() for name, metric in REGISTRY.items()}
+
+
+def flush_due():
+    """Whether a flush() now would write anything"""
+    return bool(settings.METRICS_DIR) and (
+        time.monotonic() - _last_flush >= settings.METRICS_FLUSH_INTERVAL
+    )
+
+
+def flush(force=False):
+    """Write this process's samples to METRICS_DIR, at most once per flush interval"""
+    global _last_flush
+    if not settings.METRICS_DIR:
+        return
+    now = time.monotonic()
+    if not force and not flush_due():
+        return
+    if not _flush_lock.acquire(blocking=force):
+        return
+    try:
+        _last_flush = now
+        os.makedirs(settings.METRICS_DIR, exist_ok=True)
+        path = _process_file()
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(dump(), f)
+        os.replace(temp_path, path)
+    except OSError:
+        logger.exception("Could not write metrics to %s", settings.METRICS_DIR)
+    finally:
+        _flush_lock.release()
+
+
+atexit.register(flush, force=True)
+
+
+def collect():
+    """Samples summed over every process sharing METRICS_DIR (or just this one)"""
+    if not settings.METRICS_DIR:
+        return dump()
+
+    flush(force=True)
+    totals = {name: {} for name in REGISTRY}
+    for filename in os.listdir(settings.METRICS_DIR):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(settings.METRICS_DIR, filename)) as f:
+                samples = json.load(f)
+        except (OSError, ValueError):
+            continue
+        for name, values in samples.items():
+            metric = REGISTRY.get(name)
+            if metric is None:
+                continue
+            for key, value in values.items():
+                totals[name][key] = metric.merge(totals[name].get(key), value)
+    return totals
+
+
+def render():
+    """Every metric in the Prometheus text exposition format"""
+    lines = []
+    for name, samples in collect().items():
+        metric = REGISTRY[name]
+        lines.append(f'# HELP {name} {metric.documentation}')
+        lines.append(f'# TYPE {name} {metric.kind}')
+        lines.extend(metric.render(samples))
+    return '\n'.join(lines) + '\n'
+
+
+class _QueryTimer:
+    """execute_wrapper that counts and times the queries of one request"""
+
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.duration += time.perf_counter() - started
+
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    if match is None:
+        return 'unmatched'
+    return match.url_name or match.view_name or 'unnamed'
+
+
+class MetricsMiddleware:
+    """
+    Record latency and status of every request, per view.
+
+    Sync requests also record their database query count and time. Async
+    views run their queries on other threads, so only latency is recorded.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+
+        started = time.perf_counter()
+        timer = _QueryTimer()
+        with ExitStack() as stack:
+            # Replica reads count too
+            for conn in connections.all():
+                stack.enter_context(conn.execute_wrapper(timer))
+            response = self.get_response(request)
+        view = self.record(request, response, started)
+        request_queries.observe(timer.queries, view)
+        request_query_duration.observe(timer.duration, view)
+        flush()
+        return response
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        response = await self.get_response(request)
+        self.record(request, response, started)
+        if flush_due():
+            # File writes would stall every request on the event loop
+            await sync_to_async(flush, thread_sensitive=False)()
+        return response
+
+    def record(self, request, response, started):
+        view = _view_name(request)
+        request_duration.observe(time.perf_counter() - started, view, request.method)
+        requests_total.inc(view, request.method, str(response.status_code))
+        return view
@@ -37,3 +37,44 @@ class ExchangeRate(models.Model):
     
     def __str__(self):
         return f"{self.base_currency.code} -> {self.target_currency.code}: {self.rate}"
+
+
+class RateTable(models.Model):
+    """Freshness and version of one base currency's rate table"""
+    base_currency = models.OneToOneField(
+        Currency, 
+        on_delete=models.CASCADE, 
+        primary_key=True,
+        related_name='rate_table'
+    )
+    # Last time the provider confirmed the table, whether or not anything changed
+    refreshed_at = models.DateTimeField()
+    # Last time any of its rates changed; this identifies the table's version
+    changed_at = models.DateTimeField()
+    
+    def __str__(self):
+        return f"{self.base_currency_id} refreshed {self.refreshed_at:%Y-%m-%d %H:%M}"
+
+
+class RateHistory(models.Model):
+    """Append-only snapshot of one base currency's full rate table"""
+    base_currency = models.ForeignKey(
+        Currency, 
+        on_delete=models.CASCADE, 
+        related_name='rate_history'
+    )
+    captured_at = models.DateTimeField()
+    # Sorted target codes as fixed-width 3-byte ASCII, and their rates as
+    # little-endian int64 micro-units (the ExchangeRate precision), in the same order
+    codes = models.BinaryField()
+    rates = models.BinaryField()
+    
+    class Meta:
+        verbose_name_plural = "Rate history"
+        ordering = ['base_currency', '-captured_at']
+        indexes = [
+            models.Index(fields=['base_currency', 'captured_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.base_currency_id} @ {self.captured_at:%Y-%m-%d %H:%M}"
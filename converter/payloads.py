@@ -0,0 +1,274 @@
+import gzip
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from django.utils.http import http_date
+from . import metrics
+from .crossrates import cross_rate, pivot_for
+from .renderers import FastJSONRenderer
+from .models import Currency, ExchangeRate
+from .services import CurrencyService
+from .serializers import CurrencySerializer
+from .signals import currencies_changed, rates_updated
+from .versions import RateVersion, get_rate_version
+
+try:
+    import brotli
+except ImportError:
+    # Optional: without it payloads are precompressed with gzip only
+    brotli = None
+
+
+def format_global_rates(base_currency, rates):
+    """Format exchange rates from a base currency for table display"""
+    rates_data = [
+        {
+            'currency_code': rate.target_currency.code,
+            'currency_name': rate.target_currency.name,
+            'symbol': rate.target_currency.symbol,
+            'rate': float(rate.rate),
+            'last_updated': rate.last_updated
+        }
+        for rate in rates
+    ]
+
+    return {
+        'base_currency': base_currency,
+        'rates': rates_data,
+        'total_currencies': len(rates_data)
+    }
+
+
+class Payload:
+    """A response body serialized once and served as-is until its data changes"""
+
+    def __init__(self, body, etag, last_modified=None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        # {content coding: compressed body}, built once along with the body
+        self.encoded = compress(body)
+
+    @classmethod
+    def for_rates(cls, version, body):
+        return cls(
+            body,
+            etag=f'"{version.base_currency}-{version.token}"',
+            last_modified=http_date(version.updated_at.timestamp())
+        )
+
+    @property
+    def inline(self):
+        """The body as text that is safe to embed in a <script> element"""
+        return self.body.decode('utf-8').translate(_SCRIPT_ESCAPES)
+
+    def etag_for(self, encoding):
+        """ETag of one encoding; each representation needs its own"""
+        if encoding is None:
+            return self.etag
+        return f'{self.etag[:-1]}-{encoding}"'
+
+    def negotiate(self, accept_encoding):
+        """Return (content coding or None, body) best matching an Accept-Encoding header"""
+        encoding = choose_encoding(accept_encoding, self.encoded)
+        if encoding is None:
+            return None, self.body
+        return encoding, self.encoded[encoding]
+
+
+def compress(body):
+    """Compress a payload body with every supported coding that makes it smaller"""
+    encoded = {}
+    if len(body) < settings.PAYLOAD_COMPRESS_MIN_SIZE:
+        return encoded
+    # mtime=0 keeps the output identical across workers and rebuilds
+    encoded['gzip'] = gzip.compress(body, compresslevel=9, mtime=0)
+    if brotli is not None:
+        encoded['br'] = brotli.compress(body, mode=brotli.MODE_TEXT, quality=11)
+    return {coding: data for coding, data in encoded.items() if len(data) < len(body)}
+
+
+# Preferred first when a client accepts several equally
+_CODINGS = ('br', 'gzip')
+
+
+def choose_encoding(accept_encoding, available):
+    """Pick the coding to send for an Accept-Encoding header, or None for identity"""
+    if not accept_encoding or not available:
+        return None
+
+    qualities = {}
+    for item in accept_encoding.split(','):
+        coding, _, params = item.strip().partition(';')
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[coding.strip().lower()] = quality
+
+    best, best_quality = None, 0.0
+    for coding in _CODINGS:
+        if coding not in available:
+            continue
+        quality = qualities.get(coding, qualities.get('*', 0.0))
+        if quality > best_quality:
+            best, best_quality = coding, quality
+    return best
+
+
+# Same escapes as django.utils.html.json_script
+_SCRIPT_ESCAPES = {
+    ord('>'): '\\u003E',
+    ord('<'): '\\u003C',
+    ord('&'): '\\u0026',
+}
+
+
+def global_rates_key(version):
+    return f'rates:global:{version.base_currency}:{version.token}'
+
+
+def rates_queryset(base_currency):
+    return ExchangeRate.objects.filter(
+        base_currency__code=base_currency
+    ).select_related('target_currency').order_by('target_currency__code')
+
+
+def build_global_rates(base_currency, rates=None):
+    """Serialize the global rates table for a base currency and cache it by version"""
+    if rates is None:
+        rates = list(rates_queryset(base_currency))
+    if not rates:
+        return None
+
+    version = RateVersion(base_currency, max(rate.last_updated for rate in rates))
+    body = FastJSONRenderer().render(format_global_rates(base_currency, rates))
+    payload = Payload.for_rates(version, body)
+    cache.set(global_rates_key(version), payload, settings.RATE_PAYLOAD_CACHE_TIMEOUT)
+    return payload
+
+
+def build_cross_global_rates(base_currency, pivot):
+    """Derive a base currency's global rates table from the pivot's and cache it"""
+    pivot_rates = list(rates_queryset(pivot))
+    pivot_to_base = next(
+        (rate.rate for rate in pivot_rates if rate.target_currency_id == base_currency), None
+    )
+    if pivot_to_base is None:
+        return None
+
+    rates = []
+    for pivot_rate in pivot_rates:
+        rate = cross_rate(pivot_to_base, pivot_rate.rate)
+        if rate is None:
+            return None
+        rates.append(ExchangeRate(
+            base_currency_id=base_currency,
+            target_currency=pivot_rate.target_currency,
+            rate=rate,
+            last_updated=pivot_rate.last_updated
+        ))
+
+    # Derived tables change exactly when the pivot's does, so share its version
+    version = RateVersion(base_currency, max(rate.last_updated for rate in pivot_rates))
+    body = FastJSONRenderer().render(format_global_rates(base_currency, rates))
+    payload = Payload.for_rates(version, body)
+    cache.set(global_rates_key(version), payload, settings.RATE_PAYLOAD_CACHE_TIMEOUT)
+    return payload
+
+
+def get_global_rates(base_currency):
+    """
+    Return the Payload for a base currency's global rates table.
+
+    Raises Currency.DoesNotExist for unknown currencies. A base that exists
+    but has no rates yet is refreshed first; None means none could be fetched.
+    Bases derived through a pivot currency are built from the pivot's table.
+    """
+    pivot = pivot_for(base_currency)
+    if pivot is not None:
+        return get_cross_global_rates(base_currency, pivot)
+
+    version = get_rate_version(base_currency)
+    if version is not None:
+        payload = cache.get(global_rates_key(version))
+        if payload is not None:
+            metrics.payload_cache_lookups.inc('global_rates', 'hit')
+            return payload
+        metrics.payload_cache_lookups.inc('global_rates', 'miss')
+        payload = build_global_rates(base_currency)
+        if payload is not None:
+            return payload
+
+    if not Currency.objects.filter(code=base_currency).exists():
+        raise Currency.DoesNotExist(f'Currency {base_currency} not found')
+
+    CurrencyService.refresh_exchange_rates(base_currency)
+    return build_global_rates(base_currency)
+
+
+def get_cross_global_rates(base_currency, pivot):
+    """get_global_rates for a base derived through the pivot currency"""
+    pivot_version = get_rate_version(pivot)
+    if pivot_version is not None:
+        version = RateVersion(base_currency, pivot_version.updated_at)
+        payload = cache.get(global_rates_key(version))
+        if payload is not None:
+            metrics.payload_cache_lookups.inc('global_rates', 'hit')
+            return payload
+        metrics.payload_cache_lookups.inc('global_rates', 'miss')
+
+    if not Currency.objects.filter(code=base_currency).exists():
+        raise Currency.DoesNotExist(f'Currency {base_currency} not found')
+
+    if pivot_version is None:
+        CurrencyService.refresh_exchange_rates(pivot)
+    return build_cross_global_rates(base_currency, pivot)
+
+
+CURRENCY_CATALOG_KEY = 'currencies:catalog'
+
+
+def get_currency_catalog():
+    """
+    Return the Payload listing every currency, built once and cached.
+
+    The ETag is a hash of the body, so it changes exactly when the catalog does.
+    """
+    payload = cache.get(CURRENCY_CATALOG_KEY)
+    metrics.payload_cache_lookups.inc('currency_catalog', 'miss' if payload is None else 'hit')
+    if payload is None:
+        currencies = CurrencySerializer(Currency.objects.all(), many=True).data
+        body = FastJSONRenderer().render(currencies)
+        payload = Payload(body, etag=f'"{hashlib.sha1(body).hexdigest()[:16]}"')
+        cache.set(CURRENCY_CATALOG_KEY, payload, settings.CURRENCY_CATALOG_CACHE_TIMEOUT)
+    return payload
+
+
+@receiver(currencies_changed)
+@receiver(post_save, sender=Currency)
+@receiver(post_delete, sender=Currency)
+def invalidate_currency_catalog(sender, **kwargs):
+    cache.delete(CURRENCY_CATALOG_KEY)
+
+
+def not_modified(request, payload, encoding=None):
+    """Whether the client's conditional GET headers match the payload"""
+    if_none_match = request.headers.get('If-None-Match')
+    if if_none_match is not None:
+        etags = [etag.strip() for etag in if_none_match.split(',')]
+        return payload.etag_for(encoding) in etags or '*' in etags
+    if payload.last_modified is None:
+        return False
+    return request.headers.get('If-Modified-Since') == payload.last_modified
+
+
+@receiver(rates_updated)
+def precompute_global_rates(sender, base_currency, **kwargs):
+    """Serialize each refreshed table once, up front, instead of on the next request"""
+    build_global_rates(base_currency)
@@ -0,0 +1,149 @@
+import threading
+import time
+from collections import OrderedDict
+from django.conf import settings
+from django.core.cache import cache
+from django.dispatch import receiver
+from . import metrics
+from .models import ExchangeRate
+from .signals import rates_refreshed
+from .versions import aget_rate_version, get_rate_version
+
+
+class LRUCache:
+    """Bounded, thread-safe mapping whose entries expire after ttl seconds"""
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + self.ttl)
+            self._entries.move_to_end(key)
+            evicted = 0
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                evicted += 1
+        if evicted:
+            metrics.rate_cache_evictions.inc(amount=evicted)
+
+    def discard_where(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def pair_key(version, to_currency):
+    return f'rates:pair:{version.base_currency}:{to_currency}:{version.token}'
+
+
+class RateCache:
+    """
+    Two-tier cache of single currency pairs the rate engine has not loaded.
+
+    L1 is a small per-process LRU, so hot pairs cost no I/O at all. L2 is the
+    shared Django cache, keyed by the base currency's rate version, so one
+    worker's database read serves every other worker until the next refresh
+    bumps the version. L1 entries are dropped when this process commits a
+    refresh and otherwise live for RATE_CACHE_L1_TTL seconds.
+    """
+
+    def __init__(self):
+        self.local = LRUCache(settings.RATE_CACHE_L1_SIZE, settings.RATE_CACHE_L1_TTL)
+
+    def get(self, from_currency, to_currency):
+        """Return (rate, refreshed_at) for a pair, or None if it has no rate"""
+        key = (from_currency, to_currency)
+        cached = self.local.get(key)
+        if cached is not None:
+            metrics.rate_cache_requests.inc('l1', 'hit')
+            return cached
+        metrics.rate_cache_requests.inc('l1', 'miss')
+
+        version = get_rate_version(from_currency)
+        if version is None:
+            return None
+
+        rate = cache.get(pair_key(version, to_currency))
+        if rate is not None:
+            metrics.rate_cache_requests.inc('l2', 'hit')
+        else:
+            metrics.rate_cache_requests.inc('l2', 'miss')
+            rate = ExchangeRate.objects.filter(
+                base_currency_id=from_currency, target_currency_id=to_currency
+            ).values_list('rate', flat=True).first()
+            if rate is None:
+                return None
+            cache.set(pair_key(version, to_currency), rate, settings.RATE_CACHE_L2_TIMEOUT)
+
+        # Rates are shared per version; freshness comes with the version itself
+        cached = (rate, version.refreshed_at)
+        self.local.set(key, cached)
+        return cached
+
+    async def aget(self, from_currency, to_currency):
+        """Async counterpart of get"""
+        key = (from_currency, to_currency)
+        cached = self.local.get(key)
+        if cached is not None:
+            metrics.rate_cache_requests.inc('l1', 'hit')
+            return cached
+        metrics.rate_cache_requests.inc('l1', 'miss')
+
+        version = await aget_rate_version(from_currency)
+        if version is None:
+            return None
+
+        rate = await cache.aget(pair_key(version, to_currency))
+        if rate is not None:
+            metrics.rate_cache_requests.inc('l2', 'hit')
+        else:
+            metrics.rate_cache_requests.inc('l2', 'miss')
+            rate = await ExchangeRate.objects.filter(
+                base_currency_id=from_currency, target_currency_id=to_currency
+            ).values_list('rate', flat=True).afirst()
+            if rate is None:
+                return None
+            await cache.aset(pair_key(version, to_currency), rate, settings.RATE_CACHE_L2_TIMEOUT)
+
+        cached = (rate, version.refreshed_at)
+        self.local.set(key, cached)
+        return cached
+
+    def invalidate(self, base_currency):
+        """Drop this process's L1 entries for one base currency"""
+        self.local.discard_where(lambda key: key[0] == base_currency)
+
+    def clear(self):
+        self.local.clear()
+
+
+rate_cache = RateCache()
+
+
+@receiver(rates_refreshed)
+def invalidate_rate_cache(sender, base_currency, **kwargs):
+    # L2 needs no work: its keys carry the version, which changes with any rate
+    rate_cache.invalidate(base_currency)
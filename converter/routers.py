@@ -0,0 +1,56 @@
+import random
+import time
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+# Wall-clock time until which this process reads from the primary
+_primary_until = 0.0
+
+
+def pin_primary(written_at=None):
+    """
+    Send this process's reads to the primary until replicas have caught up
+    with a write made at written_at (an aware datetime; now if omitted).
+    """
+    global _primary_until
+    written = written_at.timestamp() if written_at is not None else time.time()
+    until = written + settings.DATABASE_REPLICATION_LAG
+    if until > _primary_until:
+        _primary_until = until
+
+
+def reset_pin():
+    global _primary_until
+    _primary_until = 0.0
+
+
+class PrimaryReplicaRouter:
+    """
+    Writes go to the primary, reads to a random replica in DATABASE_REPLICAS.
+
+    Reads stay on the primary inside transactions on it, and for
+    DATABASE_REPLICATION_LAG seconds after this process writes or sees a rate
+    table refreshed by another, so nobody reads rows a replica has not
+    received yet. With no replicas configured everything uses the primary.
+    """
+
+    def db_for_read(self, model, **hints):
+        replicas = settings.DATABASE_REPLICAS
+        if (
+            not replicas
+            or time.time() < _primary_until
+            or connections[DEFAULT_DB_ALIAS].in_atomic_block
+        ):
+            return DEFAULT_DB_ALIAS
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        pin_primary()
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same data as the primary
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db == DEFAULT_DB_ALIAS
@@ -0,0 +1,187 @@
+import csv
+import io
+import json
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from django.db import connection, transaction
+from django.utils.dateparse import parse_datetime
+from .engine import rate_engine
+from .models import Currency, ExchangeRate, RateHistory, RateTable
+from .signals import currencies_changed, rates_refreshed, send_robust
+
+# A seed archive is a zip of one headed CSV per table, plus a manifest
+FORMAT = 1
+MANIFEST = 'manifest.json'
+TABLES = [
+    ('currencies.csv', Currency, ['code', 'name', 'symbol']),
+    ('exchange_rates.csv', ExchangeRate, ['base_currency', 'target_currency', 'rate', 'last_updated']),
+    ('rate_tables.csv', RateTable, ['base_currency', 'refreshed_at', 'changed_at']),
+    ('rate_history.csv', RateHistory, ['base_currency', 'captured_at', 'codes', 'rates']),
+]
+INSERT_BATCH_SIZE = 2000
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return '{:f}'.format(value)
+    if isinstance(value, (bytes, memoryview)):
+        return bytes(value).hex()
+    return value
+
+
+_DECODERS = {
+    'DecimalField': Decimal,
+    'DateTimeField': parse_datetime,
+    'BinaryField': bytes.fromhex,
+}
+
+
+def _decoder(field):
+    return _DECODERS.get(field.get_internal_type(), str)
+
+
+def export_rates(path):
+    """
+    Write every currency, rate table and history snapshot to a seed archive.
+
+    Returns {file name: rows written}.
+    """
+    counts = {}
+    with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, model, fields in TABLES:
+            columns = [model._meta.get_field(field).attname for field in fields]
+            with archive.open(name, 'w') as raw:
+                out = io.TextIOWrapper(raw, encoding='utf-8', newline='')
+                writer = csv.writer(out)
+                writer.writerow(fields)
+                count = 0
+                for row in model.objects.order_by().values_list(*columns).iterator(chunk_size=INSERT_BATCH_SIZE):
+                    writer.writerow([_encode(value) for value in row])
+                    count += 1
+                out.flush()
+                out.detach()
+            counts[name] = count
+
+        archive.writestr(MANIFEST, json.dumps({'format': FORMAT, 'counts': counts}))
+    return counts
+
+
+def _read_table(archive, name, model, fields):
+    with archive.open(name) as raw:
+        reader = csv.reader(io.TextIOWrapper(raw, encoding='utf-8', newline=''))
+        if next(reader, None) != fields:
+            raise ValueError(f"{name} does not have the columns {', '.join(fields)}")
+        decoders = [_decoder(model._meta.get_field(field)) for field in fields]
+        return [
+            [decode(value) for decode, value in zip(decoders, row)]
+            for row in reader
+        ]
+
+
+def _insert(model, fields, rows):
+    """Insert raw rows in bulk, bypassing auto_now so exported timestamps survive"""
+    if not rows:
+        return
+    model_fields = [model._meta.get_field(field) for field in fields]
+    table = connection.ops.quote_name(model._meta.db_table)
+    columns = ', '.join(connection.ops.quote_name(field.column) for field in model_fields)
+
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            # COPY streams every row in one round trip
+            buffer = io.StringIO()
+            # bytea takes hex input with a \x prefix
+            csv.writer(buffer).writerows(
+                ['\\x' + value.hex() if isinstance(value, bytes) else _encode(value) for value in row]
+                for row in rows
+            )
+            buffer.seek(0)
+            cursor.copy_expert(f'COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)', buffer)
+            return
+
+        placeholders = ', '.join(['%s'] * len(model_fields))
+        sql = f'INSERT INTO {table} ({columns}) VALUES ({placeholders})'
+        prepared = [
+            [field.get_db_prep_save(value, connection) for field, value in zip(model_fields, row)]
+            for row in rows
+        ]
+        for start in range(0, len(prepared), INSERT_BATCH_SIZE):
+            cursor.executemany(sql, prepared[start:start + INSERT_BATCH_SIZE])
+
+
+def import_rates(path):
+    """
+    Load a seed archive in a single transaction.
+
+    Currencies are created or updated. Each base currency in the archive has
+    its stored rates and RateTable replaced by the archived ones; history
+    snapshots are added unless one already exists for the same moment.
+    Returns {file name: rows loaded}.
+    """
+    with zipfile.ZipFile(path) as archive:
+        manifest = json.loads(archive.read(MANIFEST))
+        if manifest.get('format') != FORMAT:
+            raise ValueError(f"Unsupported seed archive format {manifest.get('format')}")
+        tables = {
+            name: _read_table(archive, name, model, fields)
+            for name, model, fields in TABLES
+        }
+
+    currencies = tables['currencies.csv']
+    rates = tables['exchange_rates.csv']
+    rate_tables = tables['rate_tables.csv']
+    bases = {row[0] for row in rates} | {row[0] for row in rate_tables}
+
+    with transaction.atomic():
+        Currency.objects.bulk_create(
+            [Currency(code=code, name=name, symbol=symbol) for code, name, symbol in currencies],
+            update_conflicts=True,
+            unique_fields=['code'],
+            update_fields=['name', 'symbol']
+        )
+
+        ExchangeRate.objects.filter(base_currency_id__in=bases).delete()
+        RateTable.objects.filter(base_currency_id__in=bases).delete()
+        _insert(ExchangeRate, ['base_currency', 'target_currency', 'rate', 'last_updated'], rates)
+        _insert(RateTable, ['base_currency', 'refreshed_at', 'changed_at'], rate_tables)
+
+        history = tables['rate_history.csv']
+        existing = set(RateHistory.objects.filter(
+            base_currency_id__in={row[0] for row in history}
+        ).values_list('base_currency_id', 'captured_at'))
+        history = [row for row in history if (row[0], row[1]) not in existing]
+        _insert(RateHistory, ['base_currency', 'captured_at', 'codes', 'rates'], history)
+
+        transaction.on_commit(lambda: _announce(rate_tables, rates))
+
+    counts = {name: len(rows) for name, rows in tables.items()}
+    counts['rate_history.csv'] = len(history)
+    return counts
+
+
+def _announce(rate_tables, rates):
+    """Let the caches and in-memory rate matrices know what was loaded"""
+    send_robust(currencies_changed, import_rates)
+    announced = set()
+    for base, refreshed_at, changed_at in rate_tables:
+        send_robust(
+            rates_refreshed, import_rates, base_currency=base, refreshed_at=refreshed_at, updated_at=changed_at
+        )
+        announced.add(base)
+    # Tables exported before RateTable existed are versioned by their rows
+    latest = {}
+    for base, _, _, last_updated in rates:
+        if base not in announced and (base not in latest or last_updated > latest[base]):
+            latest[base] = last_updated
+    for base, last_updated in latest.items():
+        send_robust(
+            rates_refreshed, import_rates, base_currency=base, refreshed_at=last_updated, updated_at=last_updated
+        )
+
+    if rate_engine.shared:
+        rate_engine.publish()
+    else:
+        rate_engine.invalidate()
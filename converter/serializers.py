@@ -1,3 +1,4 @@
+from decimal import Context, Decimal, InvalidOperation, ROUND_HALF_EVEN
 from rest_framework import serializers
 from .models import Currency, ExchangeRate
 
@@ -33,3 +34,102 @@ class ConversionResponseSerializer(serializers.Serializer):
     converted_amount = serializers.DecimalField(max_digits=20, decimal_places=2)
     exchange_rate = serializers.DecimalField(max_digits=20, decimal_places=6)
     last_updated = serializers.DateTimeField()
+
+
+# Quantization used by ConversionResponseSerializer's DecimalFields, applied
+# directly so large batches skip per-field serializer overhead
+DECIMAL_CONTEXT = Context(prec=20, rounding=ROUND_HALF_EVEN)
+AMOUNT_QUANTUM = Decimal('0.01')
+RATE_QUANTUM = Decimal('0.000001')
+OVERFLOW_ERROR = 'Converted amount has more than 20 digits'
+
+
+def validate_conversion_item(item):
+    """
+    Validate one {from_currency, to_currency, amount} item with the same rules
+    as ConversionRequestSerializer, returning (from_currency, to_currency, amount).
+    """
+    if not isinstance(item, dict):
+        raise serializers.ValidationError({'non_field_errors': ['Expected an object.']})
+    
+    errors = {}
+    codes = []
+    for field in ('from_currency', 'to_currency'):
+        value = item.get(field)
+        if not isinstance(value, str) or not value.strip():
+            errors[field] = ['This field is required.']
+        elif len(value.strip()) > 3:
+            errors[field] = ['Ensure this field has no more than 3 characters.']
+        codes.append(value.strip() if isinstance(value, str) else value)
+    
+    amount = item.get('amount')
+    try:
+        if isinstance(amount, bool) or amount is None:
+            raise InvalidOperation
+        amount = Decimal(str(amount).strip())
+        if not amount.is_finite():
+            raise InvalidOperation
+    except (InvalidOperation, ValueError):
+        errors['amount'] = ['A valid number is required.']
+    else:
+        _, digits, exponent = amount.as_tuple()
+        if exponent >= 0:
+            total_digits = whole_digits = len(digits) + exponent
+            decimal_places = 0
+        else:
+            decimal_places = -exponent
+            total_digits = max(len(digits), decimal_places)
+            whole_digits = total_digits - decimal_places
+        
+        if total_digits > 20:
+            errors['amount'] = ['Ensure that there are no more than 20 digits in total.']
+        elif decimal_places > 2:
+            errors['amount'] = ['Ensure that there are no more than 2 decimal places.']
+        elif whole_digits > 18:
+            errors['amount'] = ['Ensure that there are no more than 18 digits before the decimal point.']
+    
+    if errors:
+        raise serializers.ValidationError(errors)
+    return codes[0], codes[1], amount
+
+
+def represent_conversions(results):
+    """
+    Render conversion results exactly as ConversionResponseSerializer would.
+    
+    A result too large for the serializer's 20 digits is rendered as an
+    error entry instead, so it cannot fail the others.
+    """
+    datetime_field = serializers.DateTimeField()
+    timestamps = {}
+    rendered = []
+    
+    for result in results:
+        if 'error' in result:
+            rendered.append(result)
+            continue
+        
+        try:
+            amount, converted_amount, exchange_rate = (
+                result['amount'].quantize(AMOUNT_QUANTUM, context=DECIMAL_CONTEXT),
+                result['converted_amount'].quantize(AMOUNT_QUANTUM, context=DECIMAL_CONTEXT),
+                result['exchange_rate'].quantize(RATE_QUANTUM, context=DECIMAL_CONTEXT),
+            )
+        except InvalidOperation:
+            rendered.append({'error': OVERFLOW_ERROR})
+            continue
+        
+        last_updated = result['last_updated']
+        if last_updated not in timestamps:
+            timestamps[last_updated] = datetime_field.to_representation(last_updated)
+        
+        rendered.append({
+            'from_currency': result['from_currency'],
+            'to_currency': result['to_currency'],
+            'amount': '{:f}'.format(amount),
+            'converted_amount': '{:f}'.format(converted_amount),
+            'exchange_rate': '{:f}'.format(exchange_rate),
+            'last_updated': timestamps[last_updated],
+        })
+    
+    return rendered
@@ -1,9 +1,321 @@
-import requests
+import asyncio
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+from contextlib import ExitStack
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from asgiref.sync import sync_to_async
 from decimal import Decimal
 from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import connections, transaction
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
 from django.utils import timezone
 from datetime import timedelta
-from .models import Currency, ExchangeRate
+from . import metrics
+from .crossrates import cross_rate, pivot_for
+from .engine import rate_engine
+from .locks import asingle_flight, single_flight
+from .models import Currency, ExchangeRate, RateTable
+from .ratecache import rate_cache
+from .serializers import DECIMAL_CONTEXT, RATE_QUANTUM
+from .signals import currencies_changed, rates_refreshed, rates_updated, send_robust
+from .upstream import UpstreamClient, UpstreamError
+
+logger = logging.getLogger(__name__)
+
+# Base currencies with a stale-while-revalidate refresh in flight
+_revalidating = set()
+_revalidating_lock = threading.Lock()
+_background_tasks = set()
+
+
+class QueryCounter:
+    """Context manager that counts queries and wall time across every database connection"""
+    
+    def __init__(self):
+        self.queries = 0
+        self.duration_ms = 0.0
+    
+    def __call__(self, execute, sql, params, many, context):
+        self.queries += 1
+        return execute(sql, params, many, context)
+    
+    def __enter__(self):
+        self._started = time.perf_counter()
+        self._wrappers = ExitStack()
+        for conn in connections.all():
+            self._wrappers.enter_context(conn.execute_wrapper(self))
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._wrappers.__exit__(*exc_info)
+        self.duration_ms = (time.perf_counter() - self._started) * 1000
+
+
+class ProviderStats:
+    """Rolling latency and error statistics for one rate provider"""
+    
+    def __init__(self, window=100):
+        self.latencies = deque(maxlen=window)
+        self.outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+    
+    def record(self, latency, ok):
+        with self._lock:
+            self.outcomes.append(ok)
+            if ok:
+                self.latencies.append(latency)
+    
+    @property
+    def error_rate(self):
+        with self._lock:
+            if not self.outcomes:
+                return 0.0
+            return self.outcomes.count(False) / len(self.outcomes)
+    
+    @property
+    def p95(self):
+        """95th percentile latency in seconds, or None until enough samples exist"""
+        with self._lock:
+            if len(self.latencies) < 20:
+                return None
+            return statistics.quantiles(self.latencies, n=20)[-1]
+    
+    def as_dict(self):
+        return {
+            'samples': len(self.outcomes),
+            'error_rate': round(self.error_rate, 3),
+            'p95_ms': round(self.p95 * 1000, 1) if self.p95 is not None else None,
+        }
+
+
+class RateProvider:
+    """A source of exchange rate tables; subclasses implement fetch_rates"""
+    
+    def __init__(self, name):
+        self.name = name
+        self.stats = ProviderStats()
+    
+    def fetch_rates(self, base_currency):
+        """Return {code: rate} for base_currency or raise UpstreamError"""
+        raise NotImplementedError
+    
+    async def afetch_rates(self, base_currency):
+        """Async counterpart of fetch_rates; runs the sync version in a thread by default"""
+        return await sync_to_async(self.fetch_rates, thread_sensitive=False)(base_currency)
+
+
+class HTTPRateProvider(RateProvider):
+    """Provider serving exchangerate-api style JSON ({"rates": {...}}) at url + base code"""
+    
+    def __init__(self, name, url):
+        super().__init__(name)
+        self.client = UpstreamClient(url)
+    
+    def fetch_rates(self, base_currency):
+        return self.client.fetch_rates(base_currency)
+    
+    async def afetch_rates(self, base_currency):
+        return await self.client.afetch_rates(base_currency)
+
+
+class StaticRateProvider(RateProvider):
+    """Local stand-in provider serving fixed tables, for tests and offline development"""
+    
+    def __init__(self, name, rates, delay=0, fail=False):
+        super().__init__(name)
+        # {base: {code: rate}}
+        self.rates = rates
+        self.delay = delay
+        self.fail = fail
+    
+    def _table(self, base_currency):
+        if self.fail or base_currency not in self.rates:
+            raise UpstreamError(f"{self.name} has no {base_currency} rates")
+        return dict(self.rates[base_currency])
+    
+    def fetch_rates(self, base_currency):
+        if self.delay:
+            time.sleep(self.delay)
+        return self._table(base_currency)
+    
+    async def afetch_rates(self, base_currency):
+        if self.delay:
+            await asyncio.sleep(self.delay)
+        return self._table(base_currency)
+
+
+class ProviderPool:
+    """
+    Fetch rates from several providers with hedged requests.
+    
+    Providers are tried fastest and healthiest first. If the current one has
+    not answered within its p95 latency (or EXCHANGE_RATE_HEDGE_DELAY until
+    enough samples exist), or fails, the next one is fired as well. The first
+    valid answer wins and the others are cancelled.
+    """
+    
+    def __init__(self, providers):
+        self.providers = list(providers)
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(2, 2 * len(self.providers)),
+            thread_name_prefix='rate-provider'
+        )
+    
+    @classmethod
+    def from_settings(cls):
+        providers = []
+        for config in settings.EXCHANGE_RATE_PROVIDERS:
+            backend = import_string(config['BACKEND'])
+            providers.append(backend(config['NAME'], **config.get('OPTIONS', {})))
+        return cls(providers)
+    
+    def ordered(self):
+        """Providers sorted by expected latency, penalised by their error rate"""
+        default = settings.EXCHANGE_RATE_HEDGE_DELAY
+        
+        def score(provider):
+            p95 = provider.stats.p95 or default
+            return p95 * (1 + 10 * provider.stats.error_rate)
+        
+        return sorted(self.providers, key=score)
+    
+    def hedge_delay(self, provider):
+        return provider.stats.p95 or settings.EXCHANGE_RATE_HEDGE_DELAY
+    
+    @staticmethod
+    def _record(provider, started, ok):
+        latency = time.perf_counter() - started
+        provider.stats.record(latency, ok=ok)
+        metrics.upstream_duration.observe(latency, provider.name)
+        metrics.upstream_fetches.inc(provider.name, 'ok' if ok else 'error')
+    
+    @staticmethod
+    def _timed_fetch(provider, base_currency):
+        started = time.perf_counter()
+        try:
+            rates = provider.fetch_rates(base_currency)
+        except Exception:
+            ProviderPool._record(provider, started, ok=False)
+            raise
+        ProviderPool._record(provider, started, ok=True)
+        return rates
+    
+    @staticmethod
+    async def _atimed_fetch(provider, base_currency):
+        started = time.perf_counter()
+        try:
+            rates = await provider.afetch_rates(base_currency)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            ProviderPool._record(provider, started, ok=False)
+            raise
+        ProviderPool._record(provider, started, ok=True)
+        return rates
+    
+    def fetch_rates(self, base_currency):
+        """Return the first valid rate table from any provider"""
+        if len(self.providers) == 1:
+            return self._timed_fetch(self.providers[0], base_currency)
+        
+        queue = self.ordered()
+        pending = {}
+        errors = []
+        
+        def launch():
+            provider = queue.pop(0)
+            pending[self._executor.submit(self._timed_fetch, provider, base_currency)] = provider
+            return provider
+        
+        latest = launch()
+        while pending:
+            timeout = self.hedge_delay(latest) if queue else None
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            
+            if not done:
+                # Too slow: hedge with the next provider
+                latest = launch()
+                continue
+            
+            for future in done:
+                provider = pending.pop(future)
+                try:
+                    rates = future.result()
+                except Exception as e:
+                    errors.append(f"{provider.name}: {e}")
+                    if queue:
+                        latest = launch()
+                    continue
+                
+                # Queued requests are cancelled; ones already running are left to finish
+                for other in pending:
+                    other.cancel()
+                return rates
+        
+        raise UpstreamError("All rate providers failed: " + "; ".join(errors))
+    
+    async def afetch_rates(self, base_currency):
+        """Async counterpart of fetch_rates; losing requests are cancelled outright"""
+        queue = self.ordered()
+        pending = {}
+        errors = []
+        
+        def launch():
+            provider = queue.pop(0)
+            task = asyncio.ensure_future(self._atimed_fetch(provider, base_currency))
+            pending[task] = provider
+            return provider
+        
+        latest = launch()
+        try:
+            while pending:
+                timeout = self.hedge_delay(latest) if queue else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+                
+                if not done:
+                    latest = launch()
+                    continue
+                
+                for task in done:
+                    provider = pending.pop(task)
+                    try:
+                        return task.result()
+                    except Exception as e:
+                        errors.append(f"{provider.name}: {e}")
+                        if queue:
+                            latest = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+        
+        raise UpstreamError("All rate providers failed: " + "; ".join(errors))
+
+
+_provider_pool = None
+_provider_pool_lock = threading.Lock()
+
+
+def get_provider_pool():
+    """Return the process-wide ProviderPool built from EXCHANGE_RATE_PROVIDERS"""
+    global _provider_pool
+    if _provider_pool is None:
+        with _provider_pool_lock:
+            if _provider_pool is None:
+                _provider_pool = ProviderPool.from_settings()
+    return _provider_pool
+
+
+@receiver(setting_changed)
+def reset_provider_pool(setting, **kwargs):
+    """Rebuild the pool when tests override EXCHANGE_RATE_PROVIDERS"""
+    global _provider_pool
+    if setting == 'EXCHANGE_RATE_PROVIDERS':
+        _provider_pool = None
 
 
 class CurrencyService:
@@ -22,38 +334,253 @@ class CurrencyService:
     def fetch_exchange_rates(base_currency='USD'):
         """Fetch exchange rates from external API"""
         try:
-            url = f"{settings.EXCHANGE_RATE_API_URL}{base_currency}"
-            response = requests.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            
-            if 'rates' in data:
-                return data['rates']
+            return get_provider_pool().fetch_rates(base_currency)
+        except UpstreamError as e:
+            logger.warning("Error fetching exchange rates: %s", e)
             return None
-        except Exception as e:
-            print(f"Error fetching exchange rates: {e}")
+    
+    @staticmethod
+    async def afetch_exchange_rates(base_currency='USD'):
+        """Fetch exchange rates over the shared async HTTP client"""
+        try:
+            return await get_provider_pool().afetch_rates(base_currency)
+        except UpstreamError as e:
+            logger.warning("Error fetching exchange rates: %s", e)
             return None
     
     @staticmethod
-    def update_exchange_rates(base_currency='USD'):
-        """Update exchange rates in database"""
-        rates = CurrencyService.fetch_exchange_rates(base_currency)
-        
-        if not rates:
-            return False
+    def store_exchange_rates(base_currency, rates):
+        """
+        Store a full rate table for one base currency, writing only what changed.
         
-        base_curr = CurrencyService.get_or_create_currency(base_currency)
+        Rates are diffed against the stored table; unchanged rows keep their
+        last_updated, and freshness is recorded once on the base's RateTable.
+        """
+        base_code = base_currency.upper()
+        codes = {base_code} | {code.upper() for code in rates}
+        incoming = {
+            code.upper(): Decimal(str(rate)).quantize(RATE_QUANTUM, context=DECIMAL_CONTEXT)
+            for code, rate in rates.items()
+        }
         
-        for currency_code, rate in rates.items():
-            target_curr = CurrencyService.get_or_create_currency(currency_code)
+        with QueryCounter() as counter, transaction.atomic():
+            # Resolve every currency in one query and create the missing ones together
+            existing = set(
+                Currency.objects.filter(code__in=codes).values_list('code', flat=True)
+            )
+            missing = codes - existing
+            if missing:
+                Currency.objects.bulk_create(
+                    [Currency(code=code, name='', symbol='') for code in sorted(missing)],
+                    ignore_conflicts=True
+                )
+                transaction.on_commit(lambda: send_robust(currencies_changed, CurrencyService))
+            
+            # Diff against the stored table and upsert only the rates that moved
+            current = {}
+            previous_updated_at = None
+            for code, rate, last_updated in ExchangeRate.objects.filter(
+                base_currency_id=base_code
+            ).values_list('target_currency_id', 'rate', 'last_updated'):
+                current[code] = rate
+                if previous_updated_at is None or last_updated > previous_updated_at:
+                    previous_updated_at = last_updated
             
-            ExchangeRate.objects.update_or_create(
-                base_currency=base_curr,
-                target_currency=target_curr,
-                defaults={'rate': Decimal(str(rate))}
+            changes = {
+                code: rate for code, rate in incoming.items() if current.get(code) != rate
+            }
+            if changes:
+                exchange_rates = [
+                    ExchangeRate(base_currency_id=base_code, target_currency_id=code, rate=rate)
+                    for code, rate in changes.items()
+                ]
+                ExchangeRate.objects.bulk_create(
+                    exchange_rates,
+                    update_conflicts=True,
+                    unique_fields=['base_currency', 'target_currency'],
+                    update_fields=['rate', 'last_updated']
+                )
+                # last_updated is auto_now, so take the value actually written
+                updated_at = max(rate.last_updated for rate in exchange_rates)
+            else:
+                updated_at = previous_updated_at
+            
+            refreshed_at = timezone.now()
+            RateTable.objects.bulk_create(
+                [RateTable(base_currency_id=base_code, refreshed_at=refreshed_at, changed_at=updated_at)],
+                update_conflicts=True,
+                unique_fields=['base_currency'],
+                update_fields=['refreshed_at', 'changed_at']
             )
+            
+            # Patch the in-memory rate matrix once the new rates are visible
+            transaction.on_commit(lambda: rate_engine.apply(base_code, changes, refreshed_at), robust=True)
+            # The version bump and cache invalidation hang off rates_refreshed,
+            # so it goes before the optional work on rates_updated
+            transaction.on_commit(lambda: send_robust(
+                rates_refreshed,
+                CurrencyService,
+                base_currency=base_code,
+                updated_at=updated_at,
+                refreshed_at=refreshed_at,
+                previous_updated_at=previous_updated_at,
+                changes=changes
+            ))
+            if changes:
+                transaction.on_commit(lambda: send_robust(
+                    rates_updated,
+                    CurrencyService,
+                    base_currency=base_code,
+                    updated_at=updated_at,
+                    previous_updated_at=previous_updated_at,
+                    rates={**current, **changes},
+                    changes=changes
+                ))
         
-        return True
+        stats = {
+            'base_currency': base_code,
+            'rates': len(rates),
+            'changed': len(changes),
+            'created_currencies': len(missing),
+            'queries': counter.queries,
+            'duration_ms': round(counter.duration_ms, 2),
+        }
+        logger.info(
+            "Stored %(rates)d %(base_currency)s rates (%(changed)d changed) in "
+            "%(queries)d queries (%(duration_ms).2f ms)", stats
+        )
+        return stats
+    
+    @staticmethod
+    def update_exchange_rates(base_currency='USD'):
+        """Update exchange rates in database, returning refresh stats"""
+        base_code = base_currency.upper()
+        with metrics.refresh_duration.time(base_code):
+            rates = CurrencyService.fetch_exchange_rates(base_currency)
+            
+            if not rates:
+                metrics.refreshes.inc(base_code, 'failed')
+                return False
+            
+            stats = CurrencyService.store_exchange_rates(base_currency, rates)
+        metrics.refreshes.inc(base_code, 'ok')
+        return stats
+    
+    @staticmethod
+    async def aupdate_exchange_rates(base_currency='USD'):
+        """Async counterpart of update_exchange_rates"""
+        base_code = base_currency.upper()
+        with metrics.refresh_duration.time(base_code):
+            rates = await CurrencyService.afetch_exchange_rates(base_currency)
+            
+            if not rates:
+                metrics.refreshes.inc(base_code, 'failed')
+                return False
+            
+            stats = await sync_to_async(CurrencyService.store_exchange_rates)(base_currency, rates)
+        metrics.refreshes.inc(base_code, 'ok')
+        return stats
+    
+    @staticmethod
+    def refresh_exchange_rates(base_currency='USD'):
+        """
+        Update exchange rates, coalescing concurrent refreshes of the same base.
+        
+        Returns refresh stats, False if the refresh failed, or None if another
+        worker process performed it.
+        """
+        base_code = base_currency.upper()
+        stats = single_flight(
+            f'refresh-rates:{base_code}',
+            CurrencyService.update_exchange_rates,
+            base_code
+        )
+        if stats is None:
+            # Another process wrote the rates, so the local caches are out of date
+            rate_engine.invalidate()
+            rate_cache.invalidate(base_code)
+        return stats
+    
+    @staticmethod
+    async def arefresh_exchange_rates(base_currency='USD'):
+        """Async counterpart of refresh_exchange_rates"""
+        base_code = base_currency.upper()
+        stats = await asingle_flight(
+            f'refresh-rates:{base_code}',
+            CurrencyService.aupdate_exchange_rates,
+            base_code
+        )
+        if stats is None:
+            rate_engine.invalidate()
+            rate_cache.invalidate(base_code)
+        return stats
+    
+    @staticmethod
+    def max_rate_age():
+        """How long an exchange rate is considered fresh"""
+        return timedelta(seconds=settings.EXCHANGE_RATE_MAX_AGE)
+    
+    @staticmethod
+    def stale_rate_ttl():
+        """How long past expiry a stale rate is still served without an inline refresh"""
+        return timedelta(seconds=settings.EXCHANGE_RATE_STALE_TTL)
+    
+    @staticmethod
+    def is_servable(last_updated, now=None):
+        """Whether a rate is fresh, or stale but still within the stale-serve window"""
+        age = (now or timezone.now()) - last_updated
+        return age <= CurrencyService.max_rate_age() + CurrencyService.stale_rate_ttl()
+    
+    @staticmethod
+    def is_revalidatable(last_updated, now=None):
+        """Whether a stale rate may be served while it is refreshed in the background"""
+        age = (now or timezone.now()) - last_updated
+        return age <= (
+            CurrencyService.max_rate_age()
+            + CurrencyService.stale_rate_ttl()
+            + timedelta(seconds=settings.EXCHANGE_RATE_STALE_WHILE_REVALIDATE)
+        )
+    
+    @staticmethod
+    def revalidate_in_background(base_currency):
+        """Refresh a base currency on a background thread, at most once at a time"""
+        base_code = base_currency.upper()
+        with _revalidating_lock:
+            if base_code in _revalidating:
+                return
+            _revalidating.add(base_code)
+        
+        def revalidate():
+            try:
+                CurrencyService.refresh_exchange_rates(base_code)
+            except Exception:
+                logger.exception("Background refresh of %s rates failed", base_code)
+            finally:
+                with _revalidating_lock:
+                    _revalidating.discard(base_code)
+                connections.close_all()
+        
+        threading.Thread(target=revalidate, daemon=True).start()
+    
+    @staticmethod
+    def arevalidate_in_background(base_currency):
+        """Async counterpart of revalidate_in_background, run as a task on the current loop"""
+        base_code = base_currency.upper()
+        if base_code in _revalidating:
+            return
+        _revalidating.add(base_code)
+        
+        async def revalidate():
+            try:
+                await CurrencyService.arefresh_exchange_rates(base_code)
+            except Exception:
+                logger.exception("Background refresh of %s rates failed", base_code)
+            finally:
+                _revalidating.discard(base_code)
+        
+        task = asyncio.get_running_loop().create_task(revalidate())
+        _background_tasks.add(task)
+        task.add_done_callback(_background_tasks.discard)
     
     @staticmethod
     def get_exchange_rate(from_currency, to_currency):
@@ -65,45 +592,260 @@ class CurrencyService:
         if from_curr == to_curr:
             return Decimal('1.0'), timezone.now()
         
+        # Derive the pair from the pivot's table instead of fetching from_curr's own
+        pivot = pivot_for(from_curr)
+        if pivot is not None:
+            return CurrencyService.get_cross_rate(from_curr, to_curr, pivot)
+        
+        # Look up the pair in the rate engine, falling back to the pair cache
+        cached = CurrencyService.lookup_rate(from_curr, to_curr)
+        
+        if cached is not None:
+            rate, last_updated = cached
+            
+            # Serve fresh rates, and stale ones while the refresher catches up
+            if CurrencyService.is_servable(last_updated):
+                metrics.rate_cache_lookups.inc('hit')
+                return rate, last_updated
+            
+            # Serve the last good rate instantly and refresh behind the caller
+            if CurrencyService.is_revalidatable(last_updated):
+                metrics.rate_cache_lookups.inc('stale')
+                CurrencyService.revalidate_in_background(from_curr)
+                return rate, last_updated
+        
+        # Rate is stale or missing, fetch new rates (or wait for whoever already is)
+        metrics.rate_cache_lookups.inc('miss')
+        CurrencyService.refresh_exchange_rates(from_curr)
+        
+        cached = CurrencyService.lookup_rate(from_curr, to_curr)
+        if cached is None:
+            raise ValueError(f"Exchange rate not available for {from_curr} to {to_curr}")
+        return cached
+    
+    @staticmethod
+    async def aget_exchange_rate(from_currency, to_currency):
+        """Async counterpart of get_exchange_rate"""
+        from_curr = from_currency.upper()
+        to_curr = to_currency.upper()
+        
+        if from_curr == to_curr:
+            return Decimal('1.0'), timezone.now()
+        
+        pivot = pivot_for(from_curr)
+        if pivot is not None:
+            return await CurrencyService.aget_cross_rate(from_curr, to_curr, pivot)
+        
+        cached = await CurrencyService.alookup_rate(from_curr, to_curr)
+        if cached is not None:
+            if CurrencyService.is_servable(cached[1]):
+                metrics.rate_cache_lookups.inc('hit')
+                return cached
+            if CurrencyService.is_revalidatable(cached[1]):
+                metrics.rate_cache_lookups.inc('stale')
+                CurrencyService.arevalidate_in_background(from_curr)
+                return cached
+        
+        metrics.rate_cache_lookups.inc('miss')
+        await CurrencyService.arefresh_exchange_rates(from_curr)
+        
+        cached = await CurrencyService.alookup_rate(from_curr, to_curr)
+        if cached is None:
+            raise ValueError(f"Exchange rate not available for {from_curr} to {to_curr}")
+        return cached
+    
+    @staticmethod
+    def lookup_rate(from_curr, to_curr):
+        """
+        Return (rate, refreshed_at) for a directly quoted pair, or None if not stored.
+        
+        The rate engine is authoritative, as for batches and streams. The pair
+        cache only covers pairs its matrix does not have yet, such as a base
+        first stored by another worker since the matrix was loaded.
+        """
+        cached = rate_engine.lookup(from_curr, to_curr)
+        if cached is None:
+            cached = rate_cache.get(from_curr, to_curr)
+        return cached
+    
+    @staticmethod
+    async def alookup_rate(from_curr, to_curr):
+        """Async counterpart of lookup_rate"""
+        cached = await rate_engine.alookup(from_curr, to_curr)
+        if cached is None:
+            cached = await rate_cache.aget(from_curr, to_curr)
+        return cached
+    
+    @staticmethod
+    def get_cross_rate(from_currency, to_currency, pivot):
+        """Derive from -> to as rate(pivot -> to) / rate(pivot -> from)"""
         try:
-            # Try to get from database
-            exchange_rate = ExchangeRate.objects.get(
-                base_currency__code=from_curr,
-                target_currency__code=to_curr
-            )
+            pivot_to_from, from_refreshed = CurrencyService.get_exchange_rate(pivot, from_currency)
+            pivot_to_to, to_refreshed = CurrencyService.get_exchange_rate(pivot, to_currency)
+        except ValueError:
+            raise ValueError(f"Exchange rate not available for {from_currency} to {to_currency}")
+        
+        rate = cross_rate(pivot_to_from, pivot_to_to)
+        if rate is None:
+            raise ValueError(f"Exchange rate not available for {from_currency} to {to_currency}")
+        return rate, min(from_refreshed, to_refreshed)
+    
+    @staticmethod
+    async def aget_cross_rate(from_currency, to_currency, pivot):
+        """Async counterpart of get_cross_rate"""
+        try:
+            pivot_to_from, from_refreshed = await CurrencyService.aget_exchange_rate(pivot, from_currency)
+            pivot_to_to, to_refreshed = await CurrencyService.aget_exchange_rate(pivot, to_currency)
+        except ValueError:
+            raise ValueError(f"Exchange rate not available for {from_currency} to {to_currency}")
+        
+        rate = cross_rate(pivot_to_from, pivot_to_to)
+        if rate is None:
+            raise ValueError(f"Exchange rate not available for {from_currency} to {to_currency}")
+        return rate, min(from_refreshed, to_refreshed)
+    
+    @staticmethod
+    def get_exchange_rates(pairs):
+        """
+        Resolve many currency pairs at once.
+        
+        Returns {(from, to): (rate, last_updated)} for every pair that has a
+        rate. Each base currency that is stale or missing is refreshed once,
+        however many pairs use it. Pairs derived through a pivot currency are
+        resolved from the pivot's table.
+        """
+        pairs = {(from_curr.upper(), to_curr.upper()) for from_curr, to_curr in pairs}
+        crossed = {}
+        for from_curr, to_curr in pairs:
+            pivot = pivot_for(from_curr) if from_curr != to_curr else None
+            if pivot is not None:
+                crossed[(from_curr, to_curr)] = pivot
+        
+        # Resolve the pivot legs of every derived pair along with the direct pairs
+        direct = pairs - crossed.keys()
+        for (from_curr, to_curr), pivot in crossed.items():
+            direct.add((pivot, from_curr))
+            direct.add((pivot, to_curr))
+        resolved = CurrencyService._get_direct_rates(direct)
+        
+        rates = {pair: resolved[pair] for pair in pairs - crossed.keys() if pair in resolved}
+        for (from_curr, to_curr), pivot in crossed.items():
+            from_leg = resolved.get((pivot, from_curr))
+            to_leg = resolved.get((pivot, to_curr))
+            if from_leg is None or to_leg is None:
+                continue
+            rate = cross_rate(from_leg[0], to_leg[0])
+            if rate is not None:
+                rates[(from_curr, to_curr)] = (rate, min(from_leg[1], to_leg[1]))
+        return rates
+    
+    @staticmethod
+    def _get_direct_rates(pairs):
+        """get_exchange_rates for pairs that are quoted directly"""
+        now = timezone.now()
+        snapshot = rate_engine.snapshot()
+        resolved = {}
+        refresh_bases = set()
+        stale = missed = 0
+        
+        for pair in pairs:
+            from_curr, to_curr = pair
+            if from_curr == to_curr:
+                resolved[pair] = (Decimal('1.0'), now)
+                continue
             
-            # Check if rate is older than 24 hours
-            if timezone.now() - exchange_rate.last_updated > timedelta(hours=24):
-                # Update rates
-                CurrencyService.update_exchange_rates(from_curr)
-                exchange_rate.refresh_from_db()
+            cached = snapshot.lookup(from_curr, to_curr)
+            if cached is not None and CurrencyService.is_servable(cached[1], now):
+                resolved[pair] = cached
+            elif cached is not None and CurrencyService.is_revalidatable(cached[1], now):
+                CurrencyService.revalidate_in_background(from_curr)
+                resolved[pair] = cached
+                stale += 1
+            else:
+                refresh_bases.add(from_curr)
+                missed += 1
+        
+        # Counted once per batch rather than per pair to keep the loop tight
+        metrics.rate_cache_lookups.inc('hit', amount=len(resolved) - stale)
+        metrics.rate_cache_lookups.inc('stale', amount=stale)
+        metrics.rate_cache_lookups.inc('miss', amount=missed)
+        
+        if refresh_bases:
+            for base in sorted(refresh_bases):
+                CurrencyService.refresh_exchange_rates(base)
             
-            return exchange_rate.rate, exchange_rate.last_updated
+            snapshot = rate_engine.snapshot()
+            for pair in pairs - resolved.keys():
+                cached = snapshot.lookup(*pair)
+                if cached is not None:
+                    resolved[pair] = cached
+        
+        return resolved
+    
+    @staticmethod
+    def convert_batch(items):
+        """
+        Convert many (from_currency, to_currency, amount) items in one pass.
+        
+        Returns one result per item, in order. Items whose rate is unavailable
+        get an 'error' entry instead of failing the whole batch.
+        """
+        rates = CurrencyService.get_exchange_rates(
+            (from_curr, to_curr) for from_curr, to_curr, _ in items
+        )
+        results = []
+        
+        for from_currency, to_currency, amount in items:
+            from_curr = from_currency.upper()
+            to_curr = to_currency.upper()
+            pair_rate = rates.get((from_curr, to_curr))
             
-        except ExchangeRate.DoesNotExist:
-            # Fetch new rates
-            CurrencyService.update_exchange_rates(from_curr)
+            if pair_rate is None:
+                results.append({
+                    'error': f"Exchange rate not available for {from_curr} to {to_curr}"
+                })
+                continue
             
-            try:
-                exchange_rate = ExchangeRate.objects.get(
-                    base_currency__code=from_curr,
-                    target_currency__code=to_curr
-                )
-                return exchange_rate.rate, exchange_rate.last_updated
-            except ExchangeRate.DoesNotExist:
-                raise ValueError(f"Exchange rate not available for {from_curr} to {to_curr}")
+            rate, last_updated = pair_rate
+            results.append({
+                'from_currency': from_curr,
+                'to_currency': to_curr,
+                'amount': amount,
+                'converted_amount': amount * rate,
+                'exchange_rate': rate,
+                'last_updated': last_updated
+            })
+        
+        return results
     
     @staticmethod
     def convert_currency(from_currency, to_currency, amount):
         """Convert amount from one currency to another"""
         rate, last_updated = CurrencyService.get_exchange_rate(from_currency, to_currency)
-        converted_amount = Decimal(str(amount)) * rate
+        if not isinstance(amount, Decimal):
+            amount = Decimal(str(amount))
         
         return {
             'from_currency': from_currency.upper(),
             'to_currency': to_currency.upper(),
-            'amount': Decimal(str(amount)),
-            'converted_amount': converted_amount,
+            'amount': amount,
+            'converted_amount': amount * rate,
+            'exchange_rate': rate,
+            'last_updated': last_updated
+        }
+    
+    @staticmethod
+    async def aconvert_currency(from_currency, to_currency, amount):
+        """Async counterpart of convert_currency"""
+        rate, last_updated = await CurrencyService.aget_exchange_rate(from_currency, to_currency)
+        if not isinstance(amount, Decimal):
+            amount = Decimal(str(amount))
+        
+        return {
+            'from_currency': from_currency.upper(),
+            'to_currency': to_currency.upper(),
+            'amount': amount,
+            'converted_amount': amount * rate,
             'exchange_rate': rate,
             'last_updated': last_updated
         }
@@ -171,9 +913,16 @@ class CurrencyService:
             'LBP': ('Lebanese Pound', 'ل.ل'), 'SYP': ('Syrian Pound', '£'), 'YER': ('Yemeni Rial', '﷼'),
         }
         
-        # Create currency entries for ALL currencies returned by the API
-        currency_count = 0
-        for currency_code in rates.keys():
+        # Create currency entries for ALL currencies returned by the API, and
+        # fill in names for any that a rate refresh created without one
+        codes = {code.upper() for code in rates}
+        existing = {
+            currency.code: currency
+            for currency in Currency.objects.filter(code__in=codes)
+        }
+        to_create = []
+        to_update = []
+        for currency_code in sorted(codes):
             if currency_code in currency_info:
                 name, symbol = currency_info[currency_code]
             else:
@@ -181,11 +930,22 @@ class CurrencyService:
                 name = currency_code
                 symbol = currency_code
             
-            CurrencyService.get_or_create_currency(currency_code, name, symbol)
-            currency_count += 1
+            currency = existing.get(currency_code)
+            if currency is None:
+                to_create.append(Currency(code=currency_code, name=name, symbol=symbol))
+            elif not currency.name:
+                currency.name, currency.symbol = name, symbol
+                to_update.append(currency)
+        
+        with transaction.atomic():
+            Currency.objects.bulk_create(to_create, ignore_conflicts=True)
+            Currency.objects.bulk_update(to_update, ['name', 'symbol'])
+            if to_create or to_update:
+                transaction.on_commit(lambda: send_robust(currencies_changed, CurrencyService))
         
-        print(f"Initialized {currency_count} currencies from API")
+        print(f"Initialized {len(codes)} currencies from API "
+              f"({len(to_create)} created, {len(to_update)} updated)")
         
-        # Fetch and store initial exchange rates
-        CurrencyService.update_exchange_rates('USD')
+        # Store the USD rates that were just fetched instead of fetching them again
+        CurrencyService.store_exchange_rates('USD', rates)
         print("Exchange rates updated successfully!")
@@ -0,0 +1,30 @@
+import logging
+from django.dispatch import Signal
+
+logger = logging.getLogger(__name__)
+
+# Sent once a refresh that changed at least one rate has been committed.
+# Receivers get base_currency (code), updated_at (when the rates changed, i.e.
+# the new version), previous_updated_at (the version it replaces, or None),
+# rates (the full table, {target code: Decimal}) and changes (just the
+# targets whose rate changed, in the same form).
+rates_updated = Signal()
+
+# Sent after every successful refresh, changed or not, and before
+# rates_updated. Receivers get base_currency, refreshed_at (when the table was
+# confirmed) and updated_at, plus previous_updated_at and changes when the
+# refresh changed rates.
+rates_refreshed = Signal()
+
+# Sent when currencies are added without model save signals (e.g. bulk_create)
+currencies_changed = Signal()
+
+
+def send_robust(signal, sender, **kwargs):
+    """Send a signal to every receiver, logging the ones that fail instead of stopping"""
+    for receiver, response in signal.send_robust(sender=sender, **kwargs):
+        if isinstance(response, Exception):
+            logger.error(
+                "Signal receiver %s.%s failed", receiver.__module__, receiver.__qualname__,
+                exc_info=response
+            )
@@ -0,0 +1,124 @@
+import mmap
+import os
+import struct
+import time
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from .serializers import DECIMAL_CONTEXT, RATE_QUANTUM
+
+# Layout, all little-endian:
+#   header   magic, format, code width, currency count, published at (us since epoch)
+#   codes    count fixed-width ASCII codes, NUL padded
+#   tables   count int64 refresh times (us since epoch), MISSING if the base has none
+#   rates    count * count int64 rates in millionths, one packed vector per base
+MAGIC = b'RATESNAP'
+FORMAT = 1
+CODE_WIDTH = 8
+HEADER = struct.Struct('<8sHHIq')
+MISSING = -2 ** 63
+SCALE = 6
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _micros(value):
+    return (value - _EPOCH) // timedelta(microseconds=1)
+
+
+def _datetime(micros):
+    return _EPOCH + timedelta(microseconds=micros)
+
+
+def encode_snapshot(snapshot):
+    """Serialize a RateSnapshot to the shared snapshot file format"""
+    size = snapshot.size
+    published_at = int(time.time() * 1_000_000)
+    packed = struct.Struct(f'<{size}q')
+
+    codes = b''.join(code.encode('ascii').ljust(CODE_WIDTH, b'\0') for code in snapshot.codes)
+    refreshed = packed.pack(*(
+        _micros(snapshot.refreshed[code]) if code in snapshot.refreshed else MISSING
+        for code in snapshot.codes
+    ))
+    rates = [
+        MISSING if rate is None else
+        int(rate.quantize(RATE_QUANTUM, context=DECIMAL_CONTEXT).scaleb(SCALE))
+        for rate in snapshot.rates
+    ]
+    return b''.join([
+        HEADER.pack(MAGIC, FORMAT, CODE_WIDTH, size, published_at),
+        codes,
+        refreshed,
+        struct.pack(f'<{size * size}q', *rates),
+    ])
+
+
+def write_snapshot(path, snapshot):
+    """
+    Publish a snapshot at path.
+
+    The file is written beside the old one and renamed over it, so readers
+    see either the previous version or the new one, never a partial write.
+    Mappings of the old file stay valid until their readers drop them.
+    """
+    tmp_path = f'{path}.{os.getpid()}.tmp'
+    with open(tmp_path, 'wb') as f:
+        f.write(encode_snapshot(snapshot))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class MappedRateSnapshot:
+    """
+    Read-only RateSnapshot backed by a memory-mapped snapshot file.
+
+    Codes and refresh times are decoded when the file is opened; rates are
+    read straight from the mapping, which every process on the host shares
+    through the page cache.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.stat = os.fstat(f.fileno())
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, file_format, code_width, size, published_at = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or file_format != FORMAT:
+            raise ValueError(f'{path} is not a version {FORMAT} rate snapshot')
+        expected = HEADER.size + size * code_width + size * 8 + size * size * 8
+        if len(self._map) != expected:
+            raise ValueError(f'{path} is truncated')
+
+        offset = HEADER.size
+        self.codes = tuple(
+            self._map[offset + i * code_width:offset + (i + 1) * code_width].rstrip(b'\0').decode('ascii')
+            for i in range(size)
+        )
+        self.index = {code: i for i, code in enumerate(self.codes)}
+        self.size = size
+        offset += size * code_width
+
+        refreshed = struct.unpack_from(f'<{size}q', self._map, offset)
+        self.refreshed = {
+            code: _datetime(micros) for code, micros in zip(self.codes, refreshed) if micros != MISSING
+        }
+        self._rates_offset = offset + size * 8
+        self.published_at = published_at / 1_000_000
+        self.loaded_at = time.monotonic()
+
+    def lookup(self, from_currency, to_currency):
+        """Return (rate, refreshed_at) for a pair, or None if not loaded"""
+        i = self.index.get(from_currency)
+        j = self.index.get(to_currency)
+        if i is None or j is None:
+            return None
+
+        value, = struct.unpack_from('<q', self._map, self._rates_offset + (i * self.size + j) * 8)
+        if value == MISSING:
+            return None
+        return Decimal(value).scaleb(-SCALE), self.refreshed[from_currency]
+
+    def apply(self, base_currency, changes, refreshed_at):
+        # The file is immutable; refreshes publish a new one instead
+        return None
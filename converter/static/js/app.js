@@ -36,6 +36,14 @@ function setupEventListeners() {
 // Load available currencies
 async function loadCurrencies() {
     try {
+        // Use the catalog embedded in the page when the server inlined it
+        const inlineCatalog = document.getElementById('currency-catalog');
+        if (inlineCatalog) {
+            currencies = JSON.parse(inlineCatalog.textContent);
+            populateCurrencySelects();
+            return;
+        }
+
         const response = await fetch('/currencies/');
 
         if (!response.ok) {
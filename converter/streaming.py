@@ -0,0 +1,155 @@
+import codecs
+import csv
+import io
+import json
+import logging
+import time
+from itertools import islice
+from django.conf import settings
+from rest_framework import serializers
+from .serializers import represent_conversions, validate_conversion_item
+from .services import CurrencyService
+
+logger = logging.getLogger(__name__)
+
+RESULT_FIELDS = ['converted_amount', 'exchange_rate', 'last_updated', 'error']
+
+
+class PinnedRates:
+    """Rates resolved once per pair and reused for the rest of a stream"""
+
+    def __init__(self):
+        self.rates = {}
+
+    def resolve(self, pairs):
+        missing = {pair for pair in pairs if pair not in self.rates}
+        if missing:
+            resolved = CurrencyService.get_exchange_rates(missing)
+            for pair in missing:
+                self.rates[pair] = resolved.get(pair)
+        return self.rates
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def convert_rows(rows, rates):
+    """Convert one chunk of row dicts, returning (row, result) pairs"""
+    parsed = []
+    for row in rows:
+        try:
+            parsed.append(validate_conversion_item(row))
+        except serializers.ValidationError as e:
+            parsed.append(e.detail)
+
+    pairs = {
+        (item[0].upper(), item[1].upper())
+        for item in parsed if isinstance(item, tuple)
+    }
+    pinned = rates.resolve(pairs)
+
+    results = []
+    for item in parsed:
+        if not isinstance(item, tuple):
+            results.append({'error': item})
+            continue
+
+        from_currency, to_currency, amount = item
+        pair_rate = pinned.get((from_currency.upper(), to_currency.upper()))
+        if pair_rate is None:
+            results.append({
+                'error': f"Exchange rate not available for "
+                         f"{from_currency.upper()} to {to_currency.upper()}"
+            })
+            continue
+
+        rate, last_updated = pair_rate
+        results.append({
+            'from_currency': from_currency.upper(),
+            'to_currency': to_currency.upper(),
+            'amount': amount,
+            'converted_amount': amount * rate,
+            'exchange_rate': rate,
+            'last_updated': last_updated
+        })
+
+    return zip(rows, represent_conversions(results))
+
+
+class StreamConverter:
+    """Convert a CSV or NDJSON byte stream chunk by chunk with bounded memory"""
+
+    def __init__(self, lines, input_format, chunk_size=None):
+        self.lines = codecs.iterdecode(lines, 'utf-8')
+        self.input_format = input_format
+        self.chunk_size = chunk_size or settings.CONVERSION_STREAM_CHUNK_SIZE
+        self.rates = PinnedRates()
+        self.rows = 0
+
+    def __iter__(self):
+        started = time.perf_counter()
+        try:
+            if self.input_format == 'csv':
+                yield from self._convert_csv()
+            else:
+                yield from self._convert_ndjson()
+        finally:
+            elapsed = time.perf_counter() - started
+            logger.info(
+                "Streamed %d %s rows in %.2f s (%.0f rows/sec)",
+                self.rows, self.input_format, elapsed,
+                self.rows / elapsed if elapsed else 0
+            )
+
+    def _convert_csv(self):
+        reader = csv.DictReader(self.lines)
+        fieldnames = list(reader.fieldnames or [])
+        output_fields = fieldnames + [f for f in RESULT_FIELDS if f not in fieldnames]
+        buffer = io.StringIO()
+        writer = csv.DictWriter(buffer, fieldnames=output_fields, extrasaction='ignore')
+
+        writer.writeheader()
+        yield self._drain(buffer)
+
+        for chunk in _chunks(reader, self.chunk_size):
+            for row, result in convert_rows(chunk, self.rates):
+                if 'error' in result:
+                    error = result['error']
+                    row['error'] = error if isinstance(error, str) else json.dumps(error)
+                else:
+                    row.update(result)
+                writer.writerow(row)
+            self.rows += len(chunk)
+            yield self._drain(buffer)
+
+    def _convert_ndjson(self):
+        records = (line for line in self.lines if line.strip())
+
+        for chunk in _chunks(records, self.chunk_size):
+            rows = []
+            for line in chunk:
+                try:
+                    rows.append(json.loads(line))
+                except ValueError:
+                    rows.append(None)
+
+            output = []
+            for row, result in convert_rows(rows, self.rates):
+                if row is None:
+                    result = {'error': 'Invalid JSON'}
+                output.append(json.dumps(result))
+            self.rows += len(chunk)
+            yield ('\n'.join(output) + '\n').encode('utf-8')
+
+    @staticmethod
+    def _drain(buffer):
+        data = buffer.getvalue().encode('utf-8')
+        buffer.seek(0)
+        buffer.truncate()
+        return data
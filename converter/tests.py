@@ -1,3 +1,1583 @@
-from django.test import TestCase
+import asyncio
+import csv
+import gzip
+import io
+import json
+import os
+import statistics
+import tempfile
+import threading
+import time
+from asgiref.sync import sync_to_async
+from datetime import datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import product
+from unittest import mock
+from string import ascii_uppercase
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import OperationalError, connection, connections
+from django.http import HttpResponse
+from django.test import AsyncClient, AsyncRequestFactory, RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from . import metrics, views
+from .engine import RateEngine, rate_engine
+from .history import rate_as_of, rate_series, record_snapshot
+from .checks import check_shared_cache
+from .jobs import refresh_jobs
+from .locks import _run_with_cache_lock
+from .management.commands.run_rate_refresher import Command as RateRefresherCommand
+from .models import Currency, ExchangeRate, RateHistory, RateTable
+from .ratecache import LRUCache, rate_cache
+from .routers import PrimaryReplicaRouter, reset_pin
+from .payloads import choose_encoding, global_rates_key
+from .renderers import FastJSONRenderer
+from .serializers import (
+    ConversionRequestSerializer,
+    ConversionResponseSerializer,
+    represent_conversions,
+    validate_conversion_item
+)
+from .services import CurrencyService, ProviderPool, QueryCounter, StaticRateProvider
+from .signals import currencies_changed, rates_updated
+from .upstream import CircuitBreaker, CircuitOpenError, UpstreamClient, UpstreamError
+from .versions import get_rate_changes, get_rate_version, set_rate_version
 
-# Create your tests here.
+# ~160 currencies, like the real provider returns
+STUB_CODES = sorted(
+    {'USD', 'EUR', 'GBP', 'BDT', 'JPY'}
+    | {''.join(letters) for letters in list(product(ascii_uppercase, repeat=3))[:155]}
+)
+STUB_RATES = {
+    code: {target: 1 + (i * 7 + j * 3) % 997 / 100 for j, target in enumerate(STUB_CODES)}
+    for i, code in enumerate(STUB_CODES)
+}
+STUB_PROVIDERS = [
+    {
+        'NAME': 'stub',
+        'BACKEND': 'converter.services.StaticRateProvider',
+        'OPTIONS': {'rates': STUB_RATES},
+    },
+]
+
+# Per-benchmark budgets: exact query count, and p95 latency in milliseconds.
+# Latency budgets are deliberately loose so they catch regressions, not noise.
+BUDGETS = {
+    'convert_currency': {'queries': 0, 'p95_ms': 2},
+    'update_exchange_rates': {'queries': 5, 'p95_ms': 250},
+    'conversions_view': {'queries': 0, 'p95_ms': 15},
+    'global_rates_view': {'queries': 0, 'p95_ms': 15},
+    'global_rates_view_not_modified': {'queries': 0, 'p95_ms': 10},
+    'currencies_view': {'queries': 0, 'p95_ms': 15},
+    'conversion_serialization_drf': {'queries': 0, 'p95_ms': 5},
+    'conversion_serialization_fast': {'queries': 0, 'p95_ms': 1},
+}
+
+# Set BENCHMARK_OUTPUT to a path to save results as JSON for comparing commits
+BENCHMARK_OUTPUT = os.environ.get('BENCHMARK_OUTPUT')
+# Query budgets are always enforced. Latency budgets depend on the machine, so
+# they are only checked when BENCHMARK_LATENCY=1, on a quiet dedicated runner
+BENCHMARK_LATENCY = os.environ.get('BENCHMARK_LATENCY') == '1'
+
+
+@override_settings(
+    EXCHANGE_RATE_PROVIDERS=STUB_PROVIDERS,
+    RATE_HISTORY_ENABLED=False,
+    ALLOWED_HOSTS=['testserver'],
+)
+class StubRatesTestCase(TestCase):
+    """
+    Tests against the stub provider, starting from empty caches and, unless
+    seed_rates is off, a freshly stored USD table.
+    """
+    client_class = APIClient
+    seed_rates = True
+
+    def setUp(self):
+        cache.clear()
+        rate_engine.invalidate()
+        rate_cache.clear()
+        if self.seed_rates:
+            self.refresh_rates('USD')
+
+    def refresh_rates(self, base_currency):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CurrencyService.update_exchange_rates(base_currency)
+
+
+class HotPathBenchmarks(StubRatesTestCase):
+    """Latency, throughput and query-count budgets for the hot paths"""
+    iterations = 200
+    results = {}
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        if BENCHMARK_OUTPUT and cls.results:
+            with open(BENCHMARK_OUTPUT, 'w') as f:
+                json.dump({'benchmarks': cls.results}, f, indent=2, sort_keys=True)
+
+    def benchmark(self, name, func, iterations=None):
+        """Run func once to count queries, then time it and check the budgets"""
+        iterations = iterations or self.iterations
+        budget = BUDGETS[name]
+
+        with CaptureQueriesContext(connection) as queries:
+            func()
+        query_count = len(queries.captured_queries)
+
+        timings = []
+        started = time.perf_counter()
+        for _ in range(iterations):
+            call_started = time.perf_counter()
+            func()
+            timings.append((time.perf_counter() - call_started) * 1000)
+        elapsed = time.perf_counter() - started
+
+        result = {
+            'queries': query_count,
+            'iterations': iterations,
+            'median_ms': round(statistics.median(timings), 3),
+            'p95_ms': round(statistics.quantiles(timings, n=20)[-1], 3),
+            'ops_per_sec': round(iterations / elapsed, 1),
+            'budget': budget,
+        }
+        self.results[name] = result
+
+        self.assertEqual(
+            query_count, budget['queries'],
+            f"{name} ran {query_count} queries, budget is {budget['queries']}:\n"
+            + "\n".join(query['sql'][:200] for query in queries.captured_queries)
+        )
+        if BENCHMARK_LATENCY:
+            self.assertLessEqual(
+                result['p95_ms'], budget['p95_ms'],
+                f"{name} p95 {result['p95_ms']} ms exceeds budget of {budget['p95_ms']} ms"
+            )
+        return result
+
+    def test_convert_currency(self):
+        result = CurrencyService.convert_currency('USD', 'EUR', Decimal('100'))
+        self.assertEqual(result['exchange_rate'], Decimal(str(STUB_RATES['USD']['EUR'])))
+
+        self.benchmark(
+            'convert_currency',
+            lambda: CurrencyService.convert_currency('USD', 'EUR', Decimal('100'))
+        )
+
+    def test_update_exchange_rates(self):
+        def refresh():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.assertTrue(CurrencyService.update_exchange_rates('USD'))
+
+        self.benchmark('update_exchange_rates', refresh, iterations=20)
+        self.assertEqual(Currency.objects.count(), len(STUB_CODES))
+
+    def test_conversions_view(self):
+        body = {'from_currency': 'USD', 'to_currency': 'BDT', 'amount': '250.00'}
+        response = self.client.post('/conversions/', body, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.benchmark(
+            'conversions_view',
+            lambda: self.client.post('/conversions/', body, format='json')
+        )
+
+    def test_conversion_serialization(self):
+        body = {'from_currency': 'USD', 'to_currency': 'BDT', 'amount': '250.00'}
+
+        def drf():
+            serializer = ConversionRequestSerializer(data=body)
+            serializer.is_valid(raise_exception=True)
+            result = CurrencyService.convert_currency(**serializer.validated_data)
+            return JSONRenderer().render(ConversionResponseSerializer(result).data)
+
+        def fast():
+            from_currency, to_currency, amount = validate_conversion_item(body)
+            result = CurrencyService.convert_currency(from_currency, to_currency, amount)
+            return FastJSONRenderer().render(represent_conversions([result])[0])
+
+        self.assertEqual(json.loads(fast()), json.loads(drf()))
+
+        slow = self.benchmark('conversion_serialization_drf', drf)
+        quick = self.benchmark('conversion_serialization_fast', fast)
+        self.results['conversion_serialization_fast']['saved_us'] = round(
+            (slow['median_ms'] - quick['median_ms']) * 1000, 1
+        )
+        if BENCHMARK_LATENCY:
+            self.assertLess(quick['median_ms'], slow['median_ms'])
+
+    def test_global_rates_view(self):
+        response = self.client.get('/rates/global/', {'base': 'USD'})
+        self.assertEqual(response.status_code, 200)
+        body = json.loads(response.content)
+        self.assertEqual(body['total_currencies'], len(STUB_CODES))
+        # Rates stay JSON numbers, as the endpoint has always returned them
+        eur = next(row for row in body['rates'] if row['currency_code'] == 'EUR')
+        self.assertEqual(eur['rate'], STUB_RATES['USD']['EUR'])
+
+        self.benchmark(
+            'global_rates_view',
+            lambda: self.client.get('/rates/global/', {'base': 'USD'})
+        )
+
+        etag = response['ETag']
+        response = self.client.get('/rates/global/', {'base': 'USD'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        self.benchmark(
+            'global_rates_view_not_modified',
+            lambda: self.client.get('/rates/global/', {'base': 'USD'}, HTTP_IF_NONE_MATCH=etag)
+        )
+
+    def test_currencies_view(self):
+        response = self.client.get('/currencies/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(json.loads(response.content)), len(STUB_CODES))
+
+        self.benchmark('currencies_view', lambda: self.client.get('/currencies/'))
+
+
+class MetricsTests(StubRatesTestCase):
+    seed_rates = False
+
+    def sample(self, text, line_start):
+        for line in text.splitlines():
+            if line.startswith(line_start + ' '):
+                return float(line.rsplit(' ', 1)[1])
+        return 0.0
+
+    def test_hot_paths_are_instrumented(self):
+        before = self.client.get('/metrics').content.decode()
+
+        self.refresh_rates('USD')
+        body = {'from_currency': 'USD', 'to_currency': 'EUR', 'amount': '10'}
+        self.client.post('/conversions/', body, format='json')
+
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        after = response.content.decode()
+
+        for line_start in (
+            'converter_http_request_duration_seconds_count{view="convert_currency",method="POST"}',
+            'converter_http_requests_total{view="convert_currency",method="POST",status="200"}',
+            'converter_db_queries_per_request_count{view="convert_currency"}',
+            'converter_upstream_fetches_total{provider="stub",outcome="ok"}',
+            'converter_rate_refresh_duration_seconds_count{base_currency="USD"}',
+            'converter_rate_refreshes_total{base_currency="USD",outcome="ok"}',
+            'converter_rate_cache_lookups_total{result="hit"}',
+        ):
+            self.assertEqual(
+                self.sample(after, line_start) - self.sample(before, line_start), 1, line_start
+            )
+
+    def test_queries_on_every_database_are_counted(self):
+        replica = mock.MagicMock()
+
+        def query_replica():
+            # Run a query through whatever wrapper was installed on the replica
+            wrapper = replica.execute_wrapper.call_args.args[0]
+            wrapper(lambda *args: None, 'SELECT 1', None, False, {})
+
+        def get_response(request):
+            Currency.objects.count()
+            query_replica()
+            return HttpResponse()
+
+        with mock.patch.object(connections, 'all', return_value=[connection, replica]):
+            with mock.patch.object(metrics.request_queries, 'observe') as observe:
+                metrics.MetricsMiddleware(get_response)(RequestFactory().get('/'))
+            observe.assert_called_once_with(2, 'unmatched')
+
+            with QueryCounter() as counter:
+                Currency.objects.count()
+                query_replica()
+            self.assertEqual(counter.queries, 2)
+
+    async def test_async_requests_flush_off_the_event_loop(self):
+        loop_thread = threading.get_ident()
+        flushed_on = []
+
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            with override_settings(METRICS_DIR=metrics_dir, METRICS_FLUSH_INTERVAL=0), \
+                    mock.patch.object(metrics, 'flush', side_effect=lambda: flushed_on.append(threading.get_ident())):
+                middleware = metrics.MetricsMiddleware(sync_to_async(lambda request: HttpResponse()))
+                await middleware(AsyncRequestFactory().get('/'))
+
+        self.assertEqual(len(flushed_on), 1)
+        self.assertNotEqual(flushed_on[0], loop_thread)
+
+    def test_metrics_are_summed_across_processes(self):
+        with tempfile.TemporaryDirectory() as metrics_dir:
+            with override_settings(METRICS_DIR=metrics_dir):
+                local = metrics.collect()
+                key = json.dumps(['miss'])
+                local_misses = local[metrics.rate_cache_lookups.name].get(key, 0)
+
+                # Another worker's samples, as it would have flushed them
+                with open(os.path.join(metrics_dir, '99999-0.json'), 'w') as f:
+                    json.dump({metrics.rate_cache_lookups.name: {key: 5}}, f)
+
+                text = metrics.render()
+
+        self.assertEqual(
+            self.sample(text, 'converter_rate_cache_lookups_total{result="miss"}'),
+            local_misses + 5
+        )
+
+
+class RateCacheTests(StubRatesTestCase):
+    def test_shared_tier_serves_other_processes(self):
+        with self.assertNumQueries(1):
+            rate, _ = rate_cache.get('USD', 'EUR')
+        self.assertEqual(rate, Decimal(str(STUB_RATES['USD']['EUR'])))
+
+        # Another worker starts with an empty L1 but finds the pair in L2
+        rate_cache.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(rate_cache.get('USD', 'EUR')[0], rate)
+
+    def test_refresh_bumps_version(self):
+        rate_cache.get('USD', 'EUR')
+        rates = {code: rate * 2 for code, rate in STUB_RATES['USD'].items()}
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyService.store_exchange_rates('USD', rates)
+
+        self.assertEqual(
+            rate_cache.get('USD', 'EUR')[0],
+            Decimal(str(rates['EUR'])).quantize(Decimal('0.000001'))
+        )
+
+    def test_engine_is_consulted_before_the_pair_cache(self):
+        rate_engine.invalidate()
+        with mock.patch.object(rate_cache, 'get', wraps=rate_cache.get) as pair_get:
+            rate, _ = CurrencyService.lookup_rate('USD', 'EUR')
+            self.assertEqual(rate, rate_engine.lookup('USD', 'EUR')[0])
+            pair_get.assert_not_called()
+
+            # A base stored elsewhere after the matrix was loaded
+            with mock.patch.object(rate_engine, 'lookup', return_value=None):
+                self.assertEqual(CurrencyService.lookup_rate('USD', 'EUR')[0], rate)
+            pair_get.assert_called_once_with('USD', 'EUR')
+
+    def test_lru_is_bounded(self):
+        lru = LRUCache(maxsize=2, ttl=60)
+        evictions = metrics.rate_cache_evictions.values.get((), 0)
+        lru.set('a', 1)
+        lru.set('b', 2)
+        lru.get('a')
+        lru.set('c', 3)
+
+        self.assertEqual((lru.get('a'), lru.get('b'), lru.get('c')), (1, None, 3))
+        self.assertEqual(metrics.rate_cache_evictions.values[()], evictions + 1)
+
+
+class ChangeOnlyRefreshTests(StubRatesTestCase):
+    def refresh(self, rates):
+        updates = []
+
+        def receiver(sender, **kwargs):
+            updates.append(kwargs)
+        rates_updated.connect(receiver)
+        try:
+            with self.captureOnCommitCallbacks(execute=True):
+                stats = CurrencyService.store_exchange_rates('USD', rates)
+        finally:
+            rates_updated.disconnect(receiver)
+        return stats, updates
+
+    def test_unchanged_refresh_only_moves_freshness(self):
+        version = get_rate_version('USD')
+        last_updated = ExchangeRate.objects.get(base_currency='USD', target_currency='EUR').last_updated
+
+        stats, updates = self.refresh(STUB_RATES['USD'])
+
+        self.assertEqual((stats['changed'], updates), (0, []))
+        self.assertEqual(get_rate_version('USD'), version)
+        self.assertGreater(get_rate_version('USD').refreshed_at, version.refreshed_at)
+        self.assertEqual(
+            ExchangeRate.objects.get(base_currency='USD', target_currency='EUR').last_updated,
+            last_updated
+        )
+        self.assertEqual(
+            CurrencyService.get_exchange_rate('USD', 'EUR')[1],
+            RateTable.objects.get(base_currency='USD').refreshed_at
+        )
+
+    def test_failing_receivers_do_not_stop_the_others(self):
+        version = get_rate_version('USD')
+        rate_engine.snapshot()
+        rates = dict(STUB_RATES['USD'], EUR=2.5)
+
+        with override_settings(RATE_HISTORY_ENABLED=True), \
+                mock.patch('converter.history.record_snapshot', side_effect=RuntimeError('disk full')) as record, \
+                mock.patch('converter.payloads.build_global_rates', side_effect=RuntimeError('boom')) as build, \
+                self.assertLogs('converter.signals', 'ERROR') as logs:
+            with self.captureOnCommitCallbacks(execute=True):
+                CurrencyService.store_exchange_rates('USD', rates)
+
+        record.assert_called_once()
+        build.assert_called_once()
+        self.assertEqual(len(logs.records), 2)
+        new_version = get_rate_version('USD')
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(get_rate_changes(new_version), (version.token, {'EUR': Decimal('2.500000')}))
+        self.assertEqual(rate_engine.lookup('USD', 'EUR')[0], Decimal('2.500000'))
+        self.assertEqual(CurrencyService.get_exchange_rate('USD', 'EUR')[0], Decimal('2.500000'))
+
+    def test_changed_refresh_emits_change_set(self):
+        version = get_rate_version('USD')
+        rate_engine.snapshot()
+        rates = dict(STUB_RATES['USD'], EUR=2.5, GBP=0.5)
+
+        stats, updates = self.refresh(rates)
+
+        changes = {'EUR': Decimal('2.500000'), 'GBP': Decimal('0.500000')}
+        self.assertEqual(stats['changed'], 2)
+        self.assertEqual(updates[0]['changes'], changes)
+        self.assertEqual(get_rate_changes(get_rate_version('USD')), (version.token, changes))
+        # The in-memory matrix is patched rather than reloaded
+        with self.assertNumQueries(0):
+            self.assertEqual(rate_engine.lookup('USD', 'EUR')[0], Decimal('2.500000'))
+
+
+@override_settings(RATE_PIVOT_CURRENCY='USD', RATE_EXACT_QUOTE_BASES={'GBP'})
+class TriangulationTests(StubRatesTestCase):
+    def expected(self, from_currency, to_currency):
+        usd = STUB_RATES['USD']
+        quantum = Decimal('0.000001')
+        from_rate = Decimal(str(usd[from_currency])).quantize(quantum)
+        to_rate = Decimal(str(usd[to_currency])).quantize(quantum)
+        return (to_rate / from_rate).quantize(quantum)
+
+    def test_pairs_are_derived_from_the_pivot(self):
+        rate, _ = CurrencyService.get_exchange_rate('EUR', 'BDT')
+
+        self.assertEqual(rate, self.expected('EUR', 'BDT'))
+        self.assertEqual(
+            CurrencyService.get_exchange_rates([('JPY', 'EUR')])[('JPY', 'EUR')][0],
+            self.expected('JPY', 'EUR')
+        )
+        # Only the pivot's table was fetched and stored
+        self.assertEqual(set(ExchangeRate.objects.values_list('base_currency', flat=True)), {'USD'})
+
+    def test_refresh_jobs_for_derived_bases_refresh_the_pivot(self):
+        with mock.patch.object(refresh_jobs, '_start') as start, \
+                mock.patch.object(refresh_jobs, '_pending', 0):
+            job, created = refresh_jobs.submit('eur')
+            joined, joined_created = refresh_jobs.submit('JPY')
+            exact, _ = refresh_jobs.submit('GBP')
+
+        self.assertEqual((job['base_currency'], created), ('USD', True))
+        self.assertEqual((joined['id'], joined_created), (job['id'], False))
+        self.assertEqual(exact['base_currency'], 'GBP')
+        self.assertEqual(start.call_count, 2)
+
+    def test_refresher_schedules_the_pivot_for_derived_bases(self):
+        command = RateRefresherCommand(stdout=io.StringIO())
+        schedule = command.pivot_schedule({
+            'EUR': timedelta(seconds=60),
+            'USD': timedelta(seconds=600),
+            'GBP': timedelta(seconds=300),
+        })
+
+        self.assertEqual(schedule, {'USD': timedelta(seconds=60), 'GBP': timedelta(seconds=300)})
+        self.assertIn('EUR rates are derived from USD', command.stdout.getvalue())
+
+    def test_exact_quote_bases_are_fetched(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            rate, _ = CurrencyService.get_exchange_rate('GBP', 'EUR')
+
+        self.assertEqual(rate, Decimal(str(STUB_RATES['GBP']['EUR'])).quantize(Decimal('0.000001')))
+
+    def test_global_rates_are_derived(self):
+        response = self.client.get('/rates/global/', {'base': 'EUR'})
+
+        self.assertEqual(response.status_code, 200, response.content)
+        rates = {row['currency_code']: row['rate'] for row in json.loads(response.content)['rates']}
+        self.assertEqual(rates['BDT'], float(self.expected('EUR', 'BDT')))
+        self.assertEqual(rates['EUR'], 1.0)
+
+
+@override_settings(RATE_SNAPSHOT_CHECK_INTERVAL=0)
+class SharedSnapshotTests(StubRatesTestCase):
+    seed_rates = False
+
+    def setUp(self):
+        super().setUp()
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        self.path = os.path.join(snapshot_dir.name, 'rates.snapshot')
+        settings_override = override_settings(RATE_SNAPSHOT_PATH=self.path)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        self.addCleanup(rate_engine.invalidate)
+        self.refresh_rates('USD')
+
+    def test_workers_map_the_published_file(self):
+        self.assertTrue(os.path.exists(self.path))
+
+        # A worker that never touched the database serves every pair from the file
+        worker = RateEngine()
+        with self.assertNumQueries(0):
+            rate, refreshed_at = worker.lookup('USD', 'EUR')
+            self.assertIsNone(worker.lookup('EUR', 'USD'))
+        self.assertEqual(rate, Decimal(str(STUB_RATES['USD']['EUR'])))
+        self.assertEqual(refreshed_at, RateTable.objects.get(base_currency='USD').refreshed_at)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(CurrencyService.get_exchange_rate('USD', 'EUR')[0], rate)
+
+    def test_refresh_replaces_the_file(self):
+        worker = RateEngine()
+        worker.snapshot()
+        inode = os.stat(self.path).st_ino
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyService.store_exchange_rates('USD', dict(STUB_RATES['USD'], EUR=2.5))
+
+        self.assertNotEqual(os.stat(self.path).st_ino, inode)
+        with self.assertNumQueries(0):
+            self.assertEqual(worker.lookup('USD', 'EUR')[0], Decimal('2.500000'))
+
+
+@override_settings(RATE_HISTORY_ENABLED=True)
+class SeedArchiveTests(StubRatesTestCase):
+    def test_export_then_import_round_trips(self):
+        tables = {
+            model: list(model.objects.order_by('pk').values())
+            for model in (Currency, ExchangeRate, RateTable, RateHistory)
+        }
+        self.assertEqual(len(tables[RateHistory]), 1)
+
+        with tempfile.TemporaryDirectory() as seed_dir:
+            path = os.path.join(seed_dir, 'rates.zip')
+            call_command('export_rates', path, stdout=io.StringIO())
+            Currency.objects.all().delete()
+            cache.clear()
+
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('import_rates', path, stdout=io.StringIO())
+
+        for model, rows in tables.items():
+            loaded = list(model.objects.order_by('pk').values())
+            if model is not Currency:
+                # Auto primary keys are reassigned on load
+                for row in rows + loaded:
+                    row.pop('id', None)
+            self.assertEqual(loaded, rows, model.__name__)
+
+        rate, refreshed_at = CurrencyService.get_exchange_rate('USD', 'EUR')
+        self.assertEqual(rate, Decimal(str(STUB_RATES['USD']['EUR'])))
+        self.assertEqual(refreshed_at, tables[RateTable][0]['refreshed_at'])
+
+    def test_import_rejects_other_files(self):
+        with tempfile.NamedTemporaryFile(suffix='.zip') as seed:
+            seed.write(b'not an archive')
+            seed.flush()
+            with self.assertRaises(CommandError):
+                call_command('import_rates', seed.name, stdout=io.StringIO())
+
+
+@override_settings(REFRESH_JOB_QUEUE_SIZE=2)
+class RefreshJobTests(StubRatesTestCase):
+    seed_rates = False
+
+    def setUp(self):
+        super().setUp()
+        # Run queued jobs by hand instead of on the pool's threads
+        patcher = mock.patch.object(refresh_jobs, '_start')
+        self.start = patcher.start()
+        self.addCleanup(patcher.stop)
+        pending = mock.patch.object(refresh_jobs, '_pending', 0)
+        pending.start()
+        self.addCleanup(pending.stop)
+        for code in ('USD', 'EUR', 'GBP'):
+            Currency.objects.create(code=code, name=code)
+
+    def test_refresh_is_queued_and_deduplicated(self):
+        response = self.client.post('/rates/refresh/', {'base_currency': 'usd'}, format='json')
+        self.assertEqual(response.status_code, 202)
+        job = response.json()
+        self.assertEqual((job['base_currency'], job['status']), ('USD', 'queued'))
+        self.assertEqual(response['Location'], f"/rates/refresh/{job['id']}/")
+        self.assertFalse(ExchangeRate.objects.exists())
+
+        again = self.client.post('/rates/refresh/', {'base_currency': 'USD'}, format='json')
+        self.assertEqual(again.json()['id'], job['id'])
+        self.assertEqual(self.start.call_count, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            refresh_jobs.run(self.start.call_args.args[0])
+
+        status = self.client.get(response['Location']).json()
+        self.assertEqual(status['status'], 'succeeded')
+        self.assertEqual(status['stats']['rates'], len(STUB_CODES))
+        self.assertTrue(ExchangeRate.objects.filter(base_currency='USD').exists())
+
+    def test_pool_is_bounded(self):
+        for base in ('USD', 'EUR'):
+            self.assertEqual(self.client.post('/rates/refresh/', {'base_currency': base}, format='json').status_code, 202)
+
+        response = self.client.post('/rates/refresh/', {'base_currency': 'GBP'}, format='json')
+        self.assertEqual(response.status_code, 503)
+        self.assertIsNone(cache.get('refresh-jobs:base:GBP'))
+
+    def test_unknown_currency_is_refused(self):
+        for data in ({'base_currency': 'ZZZ'}, {'base_currency': ''}, {'base_currency': 5}):
+            response = self.client.post('/rates/refresh/', data, format='json')
+            self.assertEqual(response.status_code, 400)
+        self.start.assert_not_called()
+
+    def test_unknown_job(self):
+        self.assertEqual(self.client.get('/rates/refresh/missing/').status_code, 404)
+
+
+@override_settings(DATABASE_REPLICAS=['replica1', 'replica2'], DATABASE_REPLICATION_LAG=5)
+class DatabaseRoutingTests(SimpleTestCase):
+    router = PrimaryReplicaRouter()
+
+    def setUp(self):
+        cache.clear()
+        reset_pin()
+        self.addCleanup(reset_pin)
+
+    def test_reads_go_to_replicas_and_writes_to_primary(self):
+        self.assertIn(self.router.db_for_read(ExchangeRate), {'replica1', 'replica2'})
+        self.assertEqual(self.router.db_for_write(ExchangeRate), 'default')
+        # Until the replicas have caught up, this process reads its own writes from the primary
+        self.assertEqual(self.router.db_for_read(ExchangeRate), 'default')
+
+    def test_recent_refresh_elsewhere_pins_reads(self):
+        now = timezone.now()
+        set_rate_version('EUR', now - timedelta(hours=1))
+        get_rate_version('EUR')
+        self.assertIn(self.router.db_for_read(ExchangeRate), {'replica1', 'replica2'})
+
+        set_rate_version('USD', now - timedelta(hours=1), now)
+        get_rate_version('USD')
+        self.assertEqual(self.router.db_for_read(ExchangeRate), 'default')
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        self.assertEqual(self.router.db_for_read(ExchangeRate), 'default')
+
+
+class PayloadCompressionTests(StubRatesTestCase):
+    def test_gzip_variant_is_served_to_clients_that_accept_it(self):
+        for url in ('/rates/global/?base=USD', '/currencies/'):
+            plain = self.client.get(url)
+            compressed = self.client.get(url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+
+            self.assertNotIn('Content-Encoding', plain)
+            self.assertEqual(compressed['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(compressed.content), plain.content)
+            self.assertLess(len(compressed.content), len(plain.content))
+            for response in (plain, compressed):
+                self.assertIn('Accept-Encoding', response['Vary'])
+
+            # Each representation has its own ETag, and conditional GETs still match
+            self.assertEqual(compressed['ETag'], plain['ETag'][:-1] + '-gzip"')
+            not_modified = self.client.get(
+                url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=compressed['ETag']
+            )
+            self.assertEqual(not_modified.status_code, 304)
+
+    def test_choose_encoding(self):
+        available = {'gzip': b'', 'br': b''}
+        self.assertEqual(choose_encoding('gzip;q=0, br;q=0, identity', available), None)
+        self.assertEqual(choose_encoding('*', {'gzip': b''}), 'gzip')
+        self.assertEqual(choose_encoding('br;q=0.5, gzip', available), 'gzip')
+        self.assertEqual(choose_encoding('gzip, br', available), 'br')
+        self.assertEqual(choose_encoding('', available), None)
+
+
+@override_settings(RATE_STREAM_POLL_INTERVAL=0.01)
+class RatesStreamTests(StubRatesTestCase):
+    def parse(self, event):
+        fields = dict(line.split(': ', 1) for line in event.decode().strip().split('\n'))
+        return fields['event'], fields['id'], json.loads(fields['data'])
+
+    async def test_snapshot_then_deltas(self):
+        response = await AsyncClient().get('/rates/stream/', {'base': 'USD'})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        events = response.streaming_content.__aiter__()
+
+        kind, version, data = self.parse(await events.__anext__())
+        self.assertEqual(kind, 'snapshot')
+        self.assertEqual(len(data['rates']), len(STUB_CODES))
+
+        rates = dict(STUB_RATES['USD'], EUR=STUB_RATES['USD']['EUR'] + 1)
+
+        @sync_to_async
+        def refresh():
+            with self.captureOnCommitCallbacks(execute=True):
+                CurrencyService.store_exchange_rates('USD', rates)
+
+        await refresh()
+
+        kind, new_version, data = self.parse(
+            await asyncio.wait_for(events.__anext__(), timeout=5)
+        )
+        await events.aclose()
+        self.assertEqual(kind, 'delta')
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(data['changes'], {'EUR': '{:f}'.format(
+            Decimal(str(rates['EUR'])).quantize(Decimal('0.000001'))
+        )})
+
+        # A client reconnecting from the first version gets just the change
+        response = await AsyncClient().get(
+            '/rates/stream/', {'base': 'USD'}, headers={'Last-Event-ID': version}
+        )
+        events = response.streaming_content.__aiter__()
+        kind, _, data = self.parse(await events.__anext__())
+        await events.aclose()
+        self.assertEqual((kind, list(data['changes'])), ('delta', ['EUR']))
+
+    def test_requires_asgi(self):
+        response = self.client.get('/rates/stream/', {'base': 'USD'})
+        self.assertEqual(response.status_code, 501)
+
+
+class StubRateServer:
+    """
+    Local HTTP server standing in for the rate provider.
+
+    responses maps a base code to a list of (status, body) served in turn;
+    the last one repeats. Every requested path is recorded in requests, and
+    the client address of each connection in connections.
+    """
+
+    def __init__(self, responses):
+        self.responses = {code: list(items) for code, items in responses.items()}
+        self.requests = []
+        self.connections = []
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # Keep connections open between requests, as the real provider does
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                server.connections.append(self.client_address)
+
+            def do_GET(self):
+                code = self.path.rsplit('/', 1)[-1]
+                server.requests.append(code)
+                queue = server.responses.get(code) or [(404, {'result': 'error'})]
+                status, body = queue.pop(0) if len(queue) > 1 else queue[0]
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.httpd = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.httpd.server_port}/latest/'
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+OK = (200, {'rates': {'USD': 1, 'EUR': 0.92}})
+DOWN = (503, {'result': 'error'})
+UNKNOWN = (404, {'result': 'error', 'error-type': 'unsupported-code'})
+
+
+@override_settings(
+    EXCHANGE_RATE_API_RETRIES=2,
+    EXCHANGE_RATE_API_BACKOFF=0.2,
+    EXCHANGE_RATE_API_FAILURE_THRESHOLD=3,
+    EXCHANGE_RATE_API_RESET_TIMEOUT=30,
+)
+class UpstreamClientTests(SimpleTestCase):
+    def setUp(self):
+        # Record backoff delays instead of sleeping through them
+        patcher = mock.patch('converter.upstream.time.sleep')
+        self.sleep = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_transient_errors_are_retried_with_backoff(self):
+        with StubRateServer({'USD': [DOWN, DOWN, OK]}) as server:
+            rates = UpstreamClient(server.url).fetch_rates('USD')
+
+        self.assertEqual(rates, {'USD': 1, 'EUR': 0.92})
+        self.assertEqual(server.requests, ['USD'] * 3)
+        delays = [call.args[0] for call in self.sleep.call_args_list]
+        self.assertEqual(len(delays), 2)
+        # Full jitter: each delay is drawn from [0, backoff * 2 ** attempt]
+        self.assertTrue(0 <= delays[0] <= 0.2 and 0 <= delays[1] <= 0.4, delays)
+
+    def test_failures_open_the_circuit(self):
+        with StubRateServer({'USD': [DOWN]}) as server:
+            client = UpstreamClient(server.url)
+            with self.assertRaises(UpstreamError):
+                client.fetch_rates('USD')
+            self.assertEqual(client.breaker.state, 'open')
+
+            with self.assertRaises(CircuitOpenError):
+                client.fetch_rates('USD')
+        # The open circuit rejected the second fetch without calling upstream
+        self.assertEqual(len(server.requests), 3)
+
+    def test_half_open_trial_closes_the_circuit(self):
+        with StubRateServer({'USD': [DOWN, DOWN, DOWN, OK]}) as server:
+            client = UpstreamClient(server.url)
+            with self.assertRaises(UpstreamError):
+                client.fetch_rates('USD')
+
+            with mock.patch('converter.upstream.time.monotonic', return_value=time.monotonic() + 31):
+                self.assertEqual(client.breaker.state, 'half-open')
+                self.assertEqual(client.fetch_rates('USD')['EUR'], 0.92)
+            self.assertEqual(client.breaker.state, 'closed')
+
+    def test_connections_are_pooled_and_reused(self):
+        with StubRateServer({'USD': [OK]}) as server:
+            client = UpstreamClient(server.url)
+            session = client.session
+            for _ in range(3):
+                client.fetch_rates('USD')
+
+            async def fetch_twice():
+                await client.afetch_rates('USD')
+                async_client = client.get_async_client()
+                await client.afetch_rates('USD')
+                self.assertIs(client.get_async_client(), async_client)
+                await async_client.aclose()
+
+            asyncio.run(fetch_twice())
+
+        self.assertIs(client.session, session)
+        self.assertEqual(len(server.requests), 5)
+        # One keep-alive connection for the session, one for the async client
+        self.assertEqual(len(server.connections), 2)
+
+    def test_breaker_transitions(self):
+        breaker = CircuitBreaker(failure_threshold=2, reset_timeout=30)
+        now = time.monotonic()
+
+        breaker.before_call()
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'closed')
+        breaker.record_failure()
+        self.assertEqual(breaker.state, 'open')
+        with self.assertRaises(CircuitOpenError):
+            breaker.before_call()
+
+        with mock.patch('converter.upstream.time.monotonic', return_value=now + 31):
+            self.assertEqual(breaker.state, 'half-open')
+            # Exactly one trial call is let through
+            breaker.before_call()
+            with self.assertRaises(CircuitOpenError):
+                breaker.before_call()
+            # A failed trial reopens the circuit for another reset_timeout
+            breaker.record_failure()
+            self.assertEqual(breaker.state, 'open')
+
+        with mock.patch('converter.upstream.time.monotonic', return_value=now + 62):
+            breaker.before_call()
+            breaker.record_success()
+        self.assertEqual((breaker.state, breaker.failures), ('closed', 0))
+
+    def test_client_errors_are_not_retried_or_counted(self):
+        with StubRateServer({'USD': [OK], 'ZZZ': [UNKNOWN]}) as server:
+            client = UpstreamClient(server.url)
+            for _ in range(5):
+                with self.assertRaises(UpstreamError):
+                    client.fetch_rates('ZZZ')
+
+            self.assertEqual(server.requests, ['ZZZ'] * 5)
+            self.assertEqual(client.breaker.state, 'closed')
+            self.assertEqual(client.fetch_rates('USD')['EUR'], 0.92)
+
+    def test_async_client_errors_are_not_counted(self):
+        async def fetch(client):
+            for _ in range(5):
+                with self.assertRaises(UpstreamError):
+                    await client.afetch_rates('ZZZ')
+            return await client.afetch_rates('USD')
+
+        with StubRateServer({'USD': [OK], 'ZZZ': [UNKNOWN]}) as server:
+            client = UpstreamClient(server.url)
+            self.assertEqual(asyncio.run(fetch(client))['EUR'], 0.92)
+        self.assertEqual(client.breaker.state, 'closed')
+
+
+class RateRefresherTests(TestCase):
+    def setUp(self):
+        # Closing connections would end the test's transaction
+        patcher = mock.patch('converter.management.commands.run_rate_refresher.close_old_connections')
+        self.close_old_connections = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_one_failing_base_does_not_stop_the_others(self):
+        stats = {'rates': 2, 'changed': 1, 'duration_ms': 1.0, 'queries': 3}
+        with mock.patch.object(
+            CurrencyService, 'refresh_exchange_rates',
+            side_effect=[OperationalError('connection lost'), stats]
+        ) as refresh, self.assertLogs('converter.management.commands.run_rate_refresher', 'ERROR'):
+            out, err = io.StringIO(), io.StringIO()
+            call_command(
+                'run_rate_refresher', '--base', 'USD:60', '--base', 'EUR:60', '--once',
+                stdout=out, stderr=err
+            )
+
+        self.assertEqual([call.args[0] for call in refresh.call_args_list], ['USD', 'EUR'])
+        self.assertIn('Failed to refresh USD rates', err.getvalue())
+        self.assertIn('Refreshed 2 EUR rates', out.getvalue())
+        self.close_old_connections.assert_called()
+
+
+@override_settings(RATE_HISTORY_ENABLED=False)
+class SingleFlightTests(TransactionTestCase):
+    callers = 8
+
+    def setUp(self):
+        cache.clear()
+        rate_engine.invalidate()
+        rate_cache.clear()
+        self.fetches = 0
+        self.fetch_lock = threading.Lock()
+
+    def slow_fetch(self, base_currency='USD'):
+        with self.fetch_lock:
+            self.fetches += 1
+        time.sleep(0.3)
+        return STUB_RATES['USD']
+
+    def run_concurrently(self, func):
+        results = [None] * self.callers
+        barrier = threading.Barrier(self.callers)
+
+        def call(index):
+            barrier.wait()
+            try:
+                results[index] = func()
+            finally:
+                connections.close_all()
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(self.callers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return results
+
+    def test_concurrent_callers_on_a_stale_base_fetch_once(self):
+        with mock.patch.object(CurrencyService, 'fetch_exchange_rates', side_effect=self.slow_fetch):
+            results = self.run_concurrently(lambda: CurrencyService.get_exchange_rate('USD', 'EUR')[0])
+
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(results, [Decimal(str(STUB_RATES['USD']['EUR']))] * self.callers)
+
+    def test_cache_lock_coordinates_separate_processes(self):
+        # Each thread skips the in-process coalescing, as separate workers would
+        results = self.run_concurrently(lambda: _run_with_cache_lock('refresh-rates:USD', self.slow_fetch))
+
+        self.assertEqual(self.fetches, 1)
+        self.assertEqual(sum(result is not None for result in results), 1)
+
+
+class SharedCacheCheckTests(SimpleTestCase):
+    @override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_several_workers_on_a_local_cache_are_warned(self):
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '4'}):
+            messages = check_shared_cache(None)
+        self.assertEqual([message.id for message in messages], ['converter.W002'])
+        # A warning, so management commands still run for existing deployments
+        self.assertFalse(any(message.is_serious() for message in messages))
+
+        with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': '1'}):
+            self.assertEqual(check_shared_cache(None), [])
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379/0',
+    }})
+    def test_several_workers_on_a_shared_cache_pass(self):
+        for workers in ('1', '4'):
+            with mock.patch.dict(os.environ, {'WEB_CONCURRENCY': workers}):
+                self.assertEqual(check_shared_cache(None), [])
+
+
+@override_settings(ALLOWED_HOSTS=['testserver'])
+class RateHistoryTests(TestCase):
+    def setUp(self):
+        Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+        self.day = datetime(2026, 10, 17, tzinfo=dt_timezone.utc)
+        # Hourly snapshots over one day, EUR moving by 0.01 an hour
+        for hour in range(24):
+            record_snapshot(
+                'USD', self.day + timedelta(hours=hour),
+                {'EUR': Decimal('0.90') + Decimal(hour) / 100, 'GBP': Decimal('0.75')}
+            )
+
+    def test_rate_as_of_uses_latest_snapshot_before(self):
+        rate, captured_at = rate_as_of('USD', 'EUR', self.day + timedelta(hours=5, minutes=30))
+        self.assertEqual(rate, Decimal('0.95'))
+        self.assertEqual(captured_at, self.day + timedelta(hours=5))
+
+        self.assertIsNone(rate_as_of('USD', 'EUR', self.day - timedelta(seconds=1)))
+        self.assertIsNone(rate_as_of('USD', 'JPY', self.day + timedelta(hours=5)))
+
+    def test_rate_series_is_bounded_and_ordered(self):
+        series = rate_series('USD', 'EUR', start=self.day + timedelta(hours=2), end=self.day + timedelta(hours=4))
+        self.assertEqual(series, [
+            (self.day + timedelta(hours=hour), Decimal('0.90') + Decimal(hour) / 100)
+            for hour in (2, 3, 4)
+        ])
+
+    def test_rate_series_thins_evenly(self):
+        series = rate_series('USD', 'EUR', max_points=5)
+
+        # 24 snapshots in at most 5 points means every 5th one, from the first
+        self.assertEqual([captured_at.hour for captured_at, _ in series], [0, 5, 10, 15, 20])
+        self.assertEqual(series[1][1], Decimal('0.95'))
+
+    def test_rate_series_loads_only_kept_snapshots(self):
+        with CaptureQueriesContext(connection) as queries:
+            rate_series('USD', 'EUR', max_points=5)
+
+        self.assertEqual(len(queries), 2)
+        self.assertIn('ROW_NUMBER', queries[1]['sql'].upper())
+
+    def test_date_only_end_covers_the_whole_day(self):
+        response = self.client.get('/rates/history/', {'target': 'EUR', 'end': '2026-10-17'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['points']), 24)
+
+        response = self.client.get('/rates/history/', {'target': 'EUR', 'start': '2026-10-17T12:00:00Z'})
+        self.assertEqual(len(response.json()['points']), 12)
+
+    def test_date_only_at_means_end_of_day(self):
+        response = self.client.get('/rates/history/', {'target': 'EUR', 'at': '2026-10-17'})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(Decimal(str(response.json()['rate'])), Decimal('1.13'))
+
+    def test_endpoint_errors(self):
+        response = self.client.get('/rates/history/', {'at': '2026-10-17'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/rates/history/', {'target': 'EUR', 'at': 'yesterday'})
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.get('/rates/history/', {'target': 'EUR', 'at': '2026-10-16'})
+        self.assertEqual(response.status_code, 404)
+
+
+@override_settings(EXCHANGE_RATE_HEDGE_DELAY=0.05)
+class ProviderPoolTests(SimpleTestCase):
+    def make_pool(self, primary, secondary):
+        return ProviderPool([
+            StaticRateProvider('primary', {'USD': {'EUR': 1}}, **primary),
+            StaticRateProvider('secondary', {'USD': {'EUR': 2}}, **secondary),
+        ])
+
+    def test_hedge_beats_slow_primary(self):
+        pool = self.make_pool({'delay': 0.5}, {})
+
+        started = time.perf_counter()
+        self.assertEqual(pool.fetch_rates('USD'), {'EUR': 2})
+        self.assertLess(time.perf_counter() - started, 0.4)
+
+        started = time.perf_counter()
+        self.assertEqual(asyncio.run(pool.afetch_rates('USD')), {'EUR': 2})
+        self.assertLess(time.perf_counter() - started, 0.4)
+
+    def test_failing_primary_falls_over(self):
+        pool = self.make_pool({'fail': True}, {})
+
+        self.assertEqual(pool.fetch_rates('USD'), {'EUR': 2})
+        self.assertEqual(asyncio.run(pool.afetch_rates('USD')), {'EUR': 2})
+        self.assertEqual(pool.providers[0].stats.error_rate, 1.0)
+
+    def test_all_providers_failing_raises(self):
+        pool = self.make_pool({'fail': True}, {'fail': True})
+
+        with self.assertRaisesMessage(UpstreamError, 'primary'):
+            pool.fetch_rates('USD')
+        with self.assertRaisesMessage(UpstreamError, 'secondary'):
+            asyncio.run(pool.afetch_rates('USD'))
+
+    def test_ranking_follows_recorded_stats(self):
+        pool = self.make_pool({}, {})
+        primary, secondary = pool.providers
+        self.assertEqual(pool.ordered(), [primary, secondary])
+
+        # A provider with a measured p95 under the default delay moves ahead
+        for _ in range(20):
+            secondary.stats.record(0.01, ok=True)
+        self.assertEqual(pool.ordered(), [secondary, primary])
+        self.assertAlmostEqual(pool.hedge_delay(secondary), 0.01)
+
+        # Errors push it back behind an unmeasured one
+        for _ in range(20):
+            secondary.stats.record(0.01, ok=False)
+        self.assertEqual(pool.ordered(), [primary, secondary])
+
+    def test_fastest_provider_is_tried_first(self):
+        pool = self.make_pool({}, {})
+        for _ in range(20):
+            pool.providers[1].stats.record(0.01, ok=True)
+
+        with mock.patch.object(pool.providers[0], 'fetch_rates') as primary_fetch:
+            self.assertEqual(pool.fetch_rates('USD'), {'EUR': 2})
+        primary_fetch.assert_not_called()
+
+
+class BatchConversionTests(StubRatesTestCase):
+    def test_items_succeed_or_fail_individually(self):
+        valid = {'from_currency': 'usd', 'to_currency': 'EUR', 'amount': '12.50'}
+        items = [
+            valid,
+            {'from_currency': 'USD', 'amount': '1'},
+            {'from_currency': 'USD', 'to_currency': 'EUR', 'amount': 'lots'},
+            'USD to EUR',
+            {'from_currency': 'USD', 'to_currency': 'ZZZ', 'amount': '1'},
+        ]
+        response = self.client.post('/conversions/batch/', items, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        body = response.json()
+        self.assertEqual((body['total'], body['errors']), (5, 4))
+        results = body['results']
+
+        # A valid item converts exactly as the single-item endpoint would
+        single = self.client.post('/conversions/', valid, format='json').json()
+        self.assertEqual(results[0], single)
+        self.assertEqual(results[1]['error'], {'to_currency': ['This field is required.']})
+        self.assertEqual(results[2]['error'], {'amount': ['A valid number is required.']})
+        self.assertEqual(results[3]['error'], {'non_field_errors': ['Expected an object.']})
+        self.assertEqual(results[4]['error'], 'Exchange rate not available for USD to ZZZ')
+
+    def test_overflowing_item_fails_alone(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyService.store_exchange_rates('USD', dict(STUB_RATES['USD'], JPY=150000.5))
+        items = [
+            {'from_currency': 'USD', 'to_currency': 'EUR', 'amount': '1'},
+            {'from_currency': 'USD', 'to_currency': 'JPY', 'amount': '999999999999999999'},
+            {'from_currency': 'USD', 'to_currency': 'JPY', 'amount': '2'},
+        ]
+        response = self.client.post('/conversions/batch/', items, format='json')
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()['results']
+        self.assertEqual(results[1], {'error': 'Converted amount has more than 20 digits'})
+        self.assertEqual(results[2]['converted_amount'], '300001.00')
+        self.assertNotIn('error', results[0])
+
+        response = self.client.post('/conversions/', items[1], format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_wrapped_list_is_accepted(self):
+        items = [{'from_currency': 'USD', 'to_currency': 'BDT', 'amount': 1}] * 3
+        response = self.client.post('/conversions/batch/', {'conversions': items}, format='json')
+
+        self.assertEqual(response.json()['total'], 3)
+        self.assertEqual(response.json()['errors'], 0)
+
+    @override_settings(CONVERSION_BATCH_MAX_ITEMS=2)
+    def test_batch_must_be_a_bounded_list(self):
+        item = {'from_currency': 'USD', 'to_currency': 'EUR', 'amount': '1'}
+
+        response = self.client.post('/conversions/batch/', [item] * 3, format='json')
+        self.assertEqual(response.status_code, 400)
+
+        response = self.client.post('/conversions/batch/', item, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(CONVERSION_STREAM_CHUNK_SIZE=2)
+class ConversionStreamTests(StubRatesTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rate = Decimal(str(STUB_RATES['USD']['EUR']))
+
+    def stream(self, body, **extra):
+        response = self.client.post('/conversions/stream/', body, **extra)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_rows_keep_their_columns(self):
+        body = (
+            'id,from_currency,to_currency,amount\n'
+            '1,USD,EUR,10\n'
+            '2,usd,eur,2.5\n'
+            '3,USD,,1\n'
+            '4,USD,ZZZ,1\n'
+        )
+        response, content = self.stream(body, content_type='text/csv')
+
+        self.assertEqual(response['Content-Type'], 'text/csv; charset=utf-8')
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(
+            list(rows[0]),
+            ['id', 'from_currency', 'to_currency', 'amount',
+             'converted_amount', 'exchange_rate', 'last_updated', 'error']
+        )
+        self.assertEqual([row['id'] for row in rows], ['1', '2', '3', '4'])
+        self.assertEqual(Decimal(rows[0]['converted_amount']), Decimal('10') * self.rate)
+        self.assertEqual(rows[1]['to_currency'], 'EUR')
+        self.assertEqual(rows[1]['error'], '')
+        self.assertEqual(json.loads(rows[2]['error']), {'to_currency': ['This field is required.']})
+        self.assertEqual(rows[3]['error'], 'Exchange rate not available for USD to ZZZ')
+
+    def test_ndjson_upload_gives_one_result_per_line(self):
+        lines = [
+            json.dumps({'from_currency': 'USD', 'to_currency': 'EUR', 'amount': '4'}),
+            '',
+            'not json',
+            json.dumps({'from_currency': 'USD', 'to_currency': 'EURO', 'amount': 1}),
+        ]
+        upload = io.BytesIO('\n'.join(lines).encode())
+        upload.name = 'ledger.ndjson'
+        response, content = self.stream({'file': upload})
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson; charset=utf-8')
+        results = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(results), 3)
+        self.assertEqual(Decimal(results[0]['converted_amount']), Decimal('4') * self.rate)
+        self.assertEqual(results[1], {'error': 'Invalid JSON'})
+        self.assertEqual(
+            results[2]['error'], {'to_currency': ['Ensure this field has no more than 3 characters.']}
+        )
+
+    def test_overflowing_row_reports_an_error(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyService.store_exchange_rates('USD', dict(STUB_RATES['USD'], JPY=150000.5))
+        body = (
+            'from_currency,to_currency,amount\n'
+            'USD,JPY,999999999999999999\n'
+            'USD,JPY,2\n'
+            'USD,EUR,1\n'
+        )
+        _, content = self.stream(body, content_type='text/csv')
+
+        rows = list(csv.DictReader(io.StringIO(content)))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[0]['error'], 'Converted amount has more than 20 digits')
+        self.assertEqual(rows[0]['converted_amount'], '')
+        self.assertEqual(rows[1]['converted_amount'], '300001.00')
+
+        lines = '\n'.join(json.dumps(row) for row in csv.DictReader(io.StringIO(body)))
+        _, content = self.stream(lines, content_type='application/x-ndjson')
+        results = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(results[0], {'error': 'Converted amount has more than 20 digits'})
+        self.assertEqual(len(results), 3)
+
+    def test_rates_are_pinned_for_the_whole_stream(self):
+        body = 'from_currency,to_currency,amount\n' + 'USD,EUR,1\n' * 5
+        with mock.patch.object(
+            CurrencyService, 'get_exchange_rates', wraps=CurrencyService.get_exchange_rates
+        ) as get_rates:
+            _, content = self.stream(body, content_type='text/csv')
+
+        self.assertEqual(len(list(csv.DictReader(io.StringIO(content)))), 5)
+        # Three chunks, but the pair is only resolved by the first
+        self.assertEqual(get_rates.call_count, 1)
+
+    def test_unknown_format_is_refused(self):
+        response = self.client.post('/conversions/stream/', '{}', content_type='application/json')
+        self.assertEqual(response.status_code, 415)
+
+
+class AsyncViewParityTests(StubRatesTestCase):
+    """The async views are only routed under ASYNC_VIEWS, so they are called directly"""
+
+    def setUp(self):
+        super().setUp()
+        self.factory = AsyncRequestFactory()
+
+    async def call(self, view, method, path, data=None):
+        if method == 'post':
+            request = self.factory.post(path, json.dumps(data), content_type='application/json')
+        else:
+            request = self.factory.get(path, data)
+        return await view.as_view()(request)
+
+    async def test_conversion_matches_sync_view(self):
+        for body in (
+            {'from_currency': 'usd', 'to_currency': 'BDT', 'amount': '250.00'},
+            {'from_currency': 'USD', 'to_currency': 'BDT', 'amount': 'abc'},
+        ):
+            expected = await sync_to_async(self.client.post)('/conversions/', body, format='json')
+            response = await self.call(views.AsyncConversionView, 'post', '/conversions/', body)
+
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(json.loads(response.content), expected.json())
+
+    async def test_global_rates_match_sync_view(self):
+        for base in ('USD', 'ZZZ'):
+            expected = await sync_to_async(self.client.get)('/rates/global/', {'base': base})
+            response = await self.call(views.AsyncGlobalRatesView, 'get', '/rates/global/', {'base': base})
+
+            self.assertEqual(response.status_code, expected.status_code)
+            self.assertEqual(json.loads(response.content), json.loads(expected.content))
+
+    async def test_refresh_matches_sync_view(self):
+        with mock.patch.object(refresh_jobs, '_start'), mock.patch.object(refresh_jobs, '_pending', 0):
+            expected = await sync_to_async(self.client.post)(
+                '/rates/refresh/', {'base_currency': 'USD'}, format='json'
+            )
+            response = await self.call(
+                views.AsyncRatesRefreshView, 'post', '/rates/refresh/', {'base_currency': 'USD'}
+            )
+
+        self.assertEqual(response.status_code, 202)
+        # Both join the same deduplicated job
+        self.assertEqual(json.loads(response.content)['id'], expected.json()['id'])
+        self.assertEqual(response['Location'], expected['Location'])
+
+        for base in ('', 'ZZZ'):
+            response = await self.call(
+                views.AsyncRatesRefreshView, 'post', '/rates/refresh/', {'base_currency': base}
+            )
+            self.assertEqual(response.status_code, 400)
+
+
+class StartupCommandTests(StubRatesTestCase):
+    seed_rates = False
+
+    def setUp(self):
+        super().setUp()
+        # initialize_currencies reports progress with print()
+        patcher = mock.patch('builtins.print')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_init_currencies_if_empty_is_idempotent(self):
+        out = io.StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('init_currencies', '--if-empty', stdout=out)
+        self.assertIn(f'{len(STUB_CODES)} currencies available', out.getvalue())
+        self.assertEqual(Currency.objects.count(), len(STUB_CODES))
+
+        out = io.StringIO()
+        with mock.patch.object(CurrencyService, 'fetch_exchange_rates') as fetch:
+            call_command('init_currencies', '--if-empty', stdout=out)
+        fetch.assert_not_called()
+        self.assertIn('skipping', out.getvalue())
+
+        # Without the flag it runs again without duplicating anything
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('init_currencies', stdout=io.StringIO())
+        self.assertEqual(Currency.objects.count(), len(STUB_CODES))
+
+    def test_benchmark_startup_reports_and_enforces_budget(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'startup.json')
+            call_command('benchmark_startup', runs=1, json_path=path, stdout=io.StringIO())
+            with open(path) as f:
+                results = json.load(f)
+
+        self.assertEqual(results['entrypoint'], 'currency_converter.wsgi')
+        self.assertEqual(results['runs'], 1)
+        self.assertGreater(results['boot_ms_median'], results['settings_ms'])
+
+        with self.assertRaisesMessage(CommandError, 'exceeds budget'):
+            call_command('benchmark_startup', runs=1, budget_ms=0.001, stdout=io.StringIO())
+
+
+class RateEngineTests(StubRatesTestCase):
+    def setUp(self):
+        super().setUp()
+        # Start each test with the matrix unloaded
+        rate_engine.invalidate()
+
+    def test_matrix_is_loaded_once(self):
+        # All rates and all refresh times, in one query each
+        with self.assertNumQueries(2):
+            rate, refreshed_at = rate_engine.lookup('USD', 'EUR')
+        self.assertEqual(rate, Decimal(str(STUB_RATES['USD']['EUR'])))
+        self.assertEqual(refreshed_at, RateTable.objects.get(base_currency='USD').refreshed_at)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(CurrencyService.get_exchange_rate('USD', 'EUR')[0], rate)
+            self.assertIsNone(rate_engine.lookup('USD', 'XYZ'))
+
+    @override_settings(RATE_ENGINE_RELOAD_INTERVAL=60)
+    def test_matrix_is_reloaded_after_the_interval(self):
+        loaded = rate_engine.snapshot()
+
+        with mock.patch('converter.engine.time.monotonic', return_value=loaded.loaded_at + 30):
+            with self.assertNumQueries(0):
+                self.assertIs(rate_engine.snapshot(), loaded)
+        with mock.patch('converter.engine.time.monotonic', return_value=loaded.loaded_at + 61):
+            with self.assertNumQueries(2):
+                self.assertIsNot(rate_engine.snapshot(), loaded)
+
+    def test_refresh_patches_the_loaded_matrix(self):
+        rate_engine.snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyService.store_exchange_rates('USD', dict(STUB_RATES['USD'], EUR=3))
+
+        with self.assertNumQueries(0):
+            self.assertEqual(rate_engine.lookup('USD', 'EUR')[0], Decimal('3.000000'))
+
+    def test_refresh_with_new_currencies_reloads_the_matrix(self):
+        rate_engine.snapshot()
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyService.store_exchange_rates('USD', dict(STUB_RATES['USD'], XYZ=4))
+
+        with self.assertNumQueries(2):
+            self.assertEqual(rate_engine.lookup('USD', 'XYZ')[0], Decimal('4.000000'))
+
+
+class BulkUpsertTests(StubRatesTestCase):
+    seed_rates = False
+
+    def store(self, rates):
+        with self.captureOnCommitCallbacks(execute=True):
+            return CurrencyService.store_exchange_rates('USD', rates)
+
+    def transaction_queries(self, rates):
+        """Store rates and return the SQL run inside store_exchange_rates' transaction"""
+        with CaptureQueriesContext(connection) as queries:
+            stats = self.store(rates)
+        sql = [query['sql'] for query in queries.captured_queries]
+        # Inside the test's own transaction atomic() is a savepoint
+        self.assertTrue(sql[0].startswith('SAVEPOINT'))
+        release = next(i for i, statement in enumerate(sql) if statement.startswith('RELEASE SAVEPOINT'))
+        return stats, sql[1:release]
+
+    def test_table_is_stored_in_one_transaction_of_bulk_queries(self):
+        stats, sql = self.transaction_queries(STUB_RATES['USD'])
+
+        # Currencies read and created, rates read and upserted, RateTable upserted
+        self.assertEqual(len(sql), 5, sql)
+        self.assertEqual(sum(statement.startswith('INSERT') for statement in sql), 3)
+        self.assertEqual(stats['created_currencies'], len(STUB_CODES))
+        self.assertEqual(ExchangeRate.objects.filter(base_currency='USD').count(), len(STUB_CODES))
+
+    def test_existing_rows_are_updated_in_place(self):
+        self.store(STUB_RATES['USD'])
+        ids = dict(ExchangeRate.objects.filter(base_currency='USD').values_list('target_currency', 'id'))
+
+        stats, sql = self.transaction_queries(dict(STUB_RATES['USD'], EUR=5, GBP=6))
+
+        self.assertEqual(len(sql), 4, sql)
+        self.assertEqual(stats['changed'], 2)
+        self.assertEqual(
+            dict(ExchangeRate.objects.filter(base_currency='USD').values_list('target_currency', 'id')), ids
+        )
+        self.assertEqual(ExchangeRate.objects.get(base_currency='USD', target_currency='EUR').rate, Decimal('5'))
+
+    def test_failure_rolls_back_the_whole_table(self):
+        with mock.patch.object(RateTable.objects, 'bulk_create', side_effect=OperationalError('lost')):
+            with self.assertRaises(OperationalError):
+                self.store(STUB_RATES['USD'])
+
+        self.assertFalse(Currency.objects.exists())
+        self.assertFalse(ExchangeRate.objects.exists())
+
+
+class PrecomputedPayloadTests(StubRatesTestCase):
+    def test_refresh_precomputes_the_payload(self):
+        self.assertIsNotNone(cache.get(global_rates_key(get_rate_version('USD'))))
+
+        with self.assertNumQueries(0):
+            response = self.client.get('/rates/global/', {'base': 'USD'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        self.assertEqual(json.loads(response.content)['total_currencies'], len(STUB_CODES))
+
+    def test_conditional_gets(self):
+        response = self.client.get('/rates/global/', {'base': 'USD'})
+        etag, last_modified = response['ETag'], response['Last-Modified']
+
+        response = self.client.get('/rates/global/', {'base': 'USD'}, HTTP_IF_MODIFIED_SINCE=last_modified)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        response = self.client.get('/rates/global/', {'base': 'USD'}, HTTP_IF_NONE_MATCH=f'"other", {etag}')
+        self.assertEqual(response.status_code, 304)
+
+        # A refresh that changes nothing keeps the version; one that changes a rate moves it
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyService.store_exchange_rates('USD', STUB_RATES['USD'])
+        response = self.client.get('/rates/global/', {'base': 'USD'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CurrencyService.store_exchange_rates('USD', dict(STUB_RATES['USD'], EUR=7))
+        response = self.client.get('/rates/global/', {'base': 'USD'}, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+
+@override_settings(
+    ALLOWED_HOSTS=['testserver'],
+    # Pages are rendered without collectstatic's manifest
+    STATICFILES_STORAGE='django.contrib.staticfiles.storage.StaticFilesStorage',
+)
+class CurrencyCatalogTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        Currency.objects.create(code='USD', name='US Dollar', symbol='$')
+
+    def catalog(self):
+        return json.loads(self.client.get('/currencies/').content)
+
+    def test_catalog_is_cached_until_a_currency_is_saved(self):
+        self.assertEqual([row['code'] for row in self.catalog()], ['USD'])
+        with self.assertNumQueries(0):
+            response = self.client.get('/currencies/')
+        self.assertEqual(
+            self.client.get('/currencies/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304
+        )
+
+        Currency.objects.create(code='EUR', name='Euro', symbol='€')
+        self.assertEqual(sorted(row['code'] for row in self.catalog()), ['EUR', 'USD'])
+
+        currency = Currency.objects.get(code='EUR')
+        currency.name = 'Euro (EUR)'
+        currency.save()
+        self.assertIn('Euro (EUR)', [row['name'] for row in self.catalog()])
+
+    def test_catalog_is_invalidated_by_currencies_changed(self):
+        self.catalog()
+        # bulk_create sends no post_save, so the writer announces it instead
+        Currency.objects.bulk_create([Currency(code='JPY', name='Japanese Yen', symbol='¥')])
+        self.assertEqual(len(self.catalog()), 1)
+
+        currencies_changed.send(sender=CurrencyService)
+        self.assertEqual(sorted(row['code'] for row in self.catalog()), ['JPY', 'USD'])
+
+    @override_settings(INLINE_CURRENCY_CATALOG=True)
+    def test_index_inlines_the_catalog(self):
+        Currency.objects.create(code='XSS', name='</script><b>', symbol='')
+        response = self.client.get('/')
+
+        self.assertEqual(response.status_code, 200)
+        content = response.content.decode()
+        start = content.index('<script id="currency-catalog" type="application/json">')
+        script = content[start:content.index('</script>', start)]
+        # The name cannot close the script element early
+        self.assertNotIn('</script><b>', script)
+        catalog = json.loads(script.split('>', 1)[1])
+        self.assertEqual(
+            {row['code']: row['name'] for row in catalog},
+            {'USD': 'US Dollar', 'XSS': '</script><b>'}
+        )
+
+    @override_settings(INLINE_CURRENCY_CATALOG=False)
+    def test_index_without_inlined_catalog(self):
+        self.assertNotContains(self.client.get('/'), 'id="currency-catalog"')
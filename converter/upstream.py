@@ -0,0 +1,196 @@
+import asyncio
+import logging
+import random
+import threading
+import time
+import weakref
+import httpx
+import requests
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Statuses worth retrying; anything else in 4xx is the caller's fault
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamError(Exception):
+    """The exchange rate provider could not be reached or returned bad data"""
+
+
+class CircuitOpenError(UpstreamError):
+    """The provider has been failing, so calls are rejected without trying"""
+
+
+class CircuitBreaker:
+    """
+    Fail fast once upstream is unhealthy.
+
+    After failure_threshold consecutive failures the circuit opens and every
+    call is rejected for reset_timeout seconds. Then a single trial call is
+    let through (half-open): success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return 'closed'
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return 'half-open'
+        return 'open'
+
+    def before_call(self):
+        """Raise CircuitOpenError unless a call may go ahead"""
+        with self._lock:
+            state = self.state
+            if state == 'closed':
+                return
+            if state == 'half-open' and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return
+        raise CircuitOpenError("Exchange rate provider circuit is open")
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self._trial_in_flight = False
+
+    def release(self):
+        """End a call that says nothing about upstream health, counting neither way"""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self._trial_in_flight = False
+            if self.opened_at is not None or self.failures >= self.failure_threshold:
+                self.opened_at = time.monotonic()
+
+
+def _backoff(attempt):
+    """Full-jitter exponential backoff delay before retry number `attempt`"""
+    cap = settings.EXCHANGE_RATE_API_BACKOFF * (2 ** attempt)
+    return random.uniform(0, cap)
+
+
+def _parse_rates(payload):
+    rates = payload.get('rates') if isinstance(payload, dict) else None
+    if not rates:
+        raise UpstreamError("Exchange rate provider returned no rates")
+    return rates
+
+
+class UpstreamClient:
+    """Pooled, retrying client for one exchange rate provider URL"""
+
+    def __init__(self, url):
+        # The base currency code is appended to url for each fetch
+        self.url = url
+        self.breaker = CircuitBreaker(
+            failure_threshold=settings.EXCHANGE_RATE_API_FAILURE_THRESHOLD,
+            reset_timeout=settings.EXCHANGE_RATE_API_RESET_TIMEOUT,
+        )
+        self._session = None
+        self._session_lock = threading.Lock()
+        self._async_clients = weakref.WeakKeyDictionary()
+
+    @property
+    def session(self):
+        """Persistent keep-alive session shared by every thread in the process"""
+        if self._session is None:
+            with self._session_lock:
+                if self._session is None:
+                    session = requests.Session()
+                    adapter = HTTPAdapter(
+                        pool_connections=1,
+                        pool_maxsize=settings.EXCHANGE_RATE_API_MAX_CONNECTIONS,
+                    )
+                    session.mount('http://', adapter)
+                    session.mount('https://', adapter)
+                    self._session = session
+        return self._session
+
+    def get_async_client(self):
+        """
+        Return the shared, connection-pooled async HTTP client for this event loop.
+
+        httpx clients are bound to the loop they were created on, so one client is
+        kept per running loop (normally exactly one per ASGI worker).
+        """
+        loop = asyncio.get_running_loop()
+        client = self._async_clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=settings.EXCHANGE_RATE_API_TIMEOUT,
+                limits=httpx.Limits(
+                    max_connections=settings.EXCHANGE_RATE_API_MAX_CONNECTIONS,
+                    max_keepalive_connections=settings.EXCHANGE_RATE_API_MAX_CONNECTIONS,
+                ),
+            )
+            self._async_clients[loop] = client
+        return client
+
+    def fetch_rates(self, base_currency):
+        """Fetch the rate table for base_currency, retrying transient failures"""
+        url = f"{self.url}{base_currency}"
+        retries = settings.EXCHANGE_RATE_API_RETRIES
+
+        for attempt in range(retries + 1):
+            self.breaker.before_call()
+            try:
+                response = self.session.get(url, timeout=settings.EXCHANGE_RATE_API_TIMEOUT)
+                if response.status_code in RETRYABLE_STATUSES:
+                    raise UpstreamError(f"Exchange rate provider returned {response.status_code}")
+                response.raise_for_status()
+                rates = _parse_rates(response.json())
+            except requests.HTTPError as e:
+                # Any other 4xx (e.g. an unknown base code) is the caller's fault, not
+                # a sign upstream is down; counting it would let bad input open the circuit
+                self.breaker.release()
+                raise UpstreamError(str(e)) from e
+            except (requests.RequestException, ValueError, UpstreamError) as e:
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise UpstreamError(str(e)) from e
+                logger.info("Retrying %s rates after error: %s", base_currency, e)
+                time.sleep(_backoff(attempt))
+            else:
+                self.breaker.record_success()
+                return rates
+
+    async def afetch_rates(self, base_currency):
+        """Async counterpart of fetch_rates"""
+        url = f"{self.url}{base_currency}"
+        retries = settings.EXCHANGE_RATE_API_RETRIES
+
+        for attempt in range(retries + 1):
+            self.breaker.before_call()
+            try:
+                response = await self.get_async_client().get(url)
+                if response.status_code in RETRYABLE_STATUSES:
+                    raise UpstreamError(f"Exchange rate provider returned {response.status_code}")
+                response.raise_for_status()
+                rates = _parse_rates(response.json())
+            except httpx.HTTPStatusError as e:
+                self.breaker.release()
+                raise UpstreamError(str(e)) from e
+            except (httpx.HTTPError, ValueError, UpstreamError) as e:
+                self.breaker.record_failure()
+                if attempt == retries:
+                    raise UpstreamError(str(e)) from e
+                logger.info("Retrying %s rates after error: %s", base_currency, e)
+                await asyncio.sleep(_backoff(attempt))
+            else:
+                self.breaker.record_success()
+                return rates
@@ -1,6 +1,16 @@
+from django.conf import settings
 from django.urls import path
 from . import views
 
+if settings.ASYNC_VIEWS:
+    conversion_view = views.AsyncConversionView
+    rates_refresh_view = views.AsyncRatesRefreshView
+    global_rates_view = views.AsyncGlobalRatesView
+else:
+    conversion_view = views.ConversionView
+    rates_refresh_view = views.RatesRefreshView
+    global_rates_view = views.GlobalRatesView
+
 urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
     path('rates/', views.GlobalRatesPageView.as_view(), name='global_rates_page'),
@@ -8,7 +18,13 @@ urlpatterns = [
     path('info/currencies/', views.InfoCurrenciesView.as_view(), name='info_currencies'),
     path('info/secure-free/', views.InfoSecureFreeView.as_view(), name='info_secure_free'),
     path('currencies/', views.CurrenciesView.as_view(), name='get_currencies'),
-    path('conversions/', views.ConversionView.as_view(), name='convert_currency'),
-    path('rates/refresh/', views.RatesRefreshView.as_view(), name='update_rates'),
-    path('rates/global/', views.GlobalRatesView.as_view(), name='global_rates'),
+    path('conversions/', conversion_view.as_view(), name='convert_currency'),
+    path('conversions/batch/', views.BatchConversionView.as_view(), name='convert_batch'),
+    path('conversions/stream/', views.ConversionStreamView.as_view(), name='convert_stream'),
+    path('rates/refresh/', rates_refresh_view.as_view(), name='update_rates'),
+    path('rates/refresh/<str:job_id>/', views.RefreshJobView.as_view(), name='refresh_job'),
+    path('rates/global/', global_rates_view.as_view(), name='global_rates'),
+    path('rates/history/', views.RateHistoryView.as_view(), name='rate_history'),
+    path('rates/stream/', views.RatesStreamView.as_view(), name='rates_stream'),
+    path('metrics', views.MetricsView.as_view(), name='metrics'),
 ]
@@ -0,0 +1,142 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+from django.db.models import Max
+from django.dispatch import receiver
+from .models import ExchangeRate, RateTable
+from .routers import pin_primary
+from .signals import rates_refreshed
+
+
+class RateVersion:
+    """Identifies one committed rate table for a base currency"""
+
+    def __init__(self, base_currency, updated_at, refreshed_at=None):
+        self.base_currency = base_currency
+        self.updated_at = updated_at
+        # When the table was last confirmed; refreshes that change nothing
+        # move this forward without creating a new version
+        self.refreshed_at = refreshed_at or updated_at
+        # Microseconds since the epoch, unique per change of a base
+        self.token = format(int(updated_at.timestamp() * 1_000_000), 'x')
+
+    def __eq__(self, other):
+        return (
+            isinstance(other, RateVersion)
+            and (self.base_currency, self.token) == (other.base_currency, other.token)
+        )
+
+    def __hash__(self):
+        return hash((self.base_currency, self.token))
+
+    def __repr__(self):
+        return f"<RateVersion {self.base_currency}:{self.token}>"
+
+
+def _version_key(base_currency):
+    return f'rates:version:{base_currency}'
+
+
+def _changes_key(base_currency, token):
+    return f'rates:changes:{base_currency}:{token}'
+
+
+def set_rate_version(base_currency, updated_at, refreshed_at=None):
+    """Record the current rate version of a base currency in the shared cache"""
+    version = RateVersion(base_currency, updated_at, refreshed_at)
+    cache.set(
+        _version_key(base_currency),
+        (version.updated_at, version.refreshed_at),
+        settings.RATE_VERSION_CACHE_TIMEOUT
+    )
+    return version
+
+
+def get_rate_version(base_currency):
+    """
+    Return the current RateVersion of a base currency, or None if it has no rates.
+
+    Served from the shared cache; on a miss it is read from the base's
+    RateTable row with a single query.
+    """
+    cached = cache.get(_version_key(base_currency))
+    if cached is not None:
+        return _observed(RateVersion(base_currency, *cached))
+
+    # Versions are what every cached rate is keyed by, so read them from the
+    # primary; a lagging replica could publish an old one as current
+    state = RateTable.objects.using(DEFAULT_DB_ALIAS).filter(
+        base_currency_id=base_currency
+    ).values_list('changed_at', 'refreshed_at').first()
+    if state is None:
+        latest = ExchangeRate.objects.using(DEFAULT_DB_ALIAS).filter(
+            base_currency_id=base_currency
+        ).aggregate(latest=Max('last_updated'))['latest']
+        if latest is None:
+            return None
+        # Tables stored before RateTable existed rewrote every row per refresh
+        state = (latest, latest)
+    return _observed(set_rate_version(base_currency, *state))
+
+
+async def aget_rate_version(base_currency):
+    """Async counterpart of get_rate_version"""
+    cached = await cache.aget(_version_key(base_currency))
+    if cached is not None:
+        return _observed(RateVersion(base_currency, *cached))
+
+    state = await RateTable.objects.using(DEFAULT_DB_ALIAS).filter(
+        base_currency_id=base_currency
+    ).values_list('changed_at', 'refreshed_at').afirst()
+    if state is None:
+        latest = (await ExchangeRate.objects.using(DEFAULT_DB_ALIAS).filter(
+            base_currency_id=base_currency
+        ).aaggregate(latest=Max('last_updated')))['latest']
+        if latest is None:
+            return None
+        state = (latest, latest)
+    version = RateVersion(base_currency, *state)
+    await cache.aset(
+        _version_key(base_currency),
+        (version.updated_at, version.refreshed_at),
+        settings.RATE_VERSION_CACHE_TIMEOUT
+    )
+    return _observed(version)
+
+
+def _observed(version):
+    # A table refreshed moments ago may not have reached the replicas yet
+    pin_primary(version.refreshed_at)
+    return version
+
+
+def get_rate_changes(version):
+    """
+    Return (previous token, {code: Decimal}) for the refresh that produced
+    version, or None once it has expired from the shared change log.
+    """
+    return cache.get(_changes_key(version.base_currency, version.token))
+
+
+async def aget_rate_changes(version):
+    """Async counterpart of get_rate_changes"""
+    return await cache.aget(_changes_key(version.base_currency, version.token))
+
+
+@receiver(rates_refreshed)
+def bump_rate_version(sender, base_currency, updated_at, refreshed_at, changes=None,
+                      previous_updated_at=None, **kwargs):
+    if changes:
+        # The change log goes first so nobody sees the new version without it
+        log_rate_changes(base_currency, updated_at, previous_updated_at, changes)
+    set_rate_version(base_currency, updated_at, refreshed_at)
+
+
+def log_rate_changes(base_currency, updated_at, previous_updated_at, changes):
+    """Keep each refresh's change set so other processes can apply it incrementally"""
+    previous = RateVersion(base_currency, previous_updated_at) if previous_updated_at else None
+    cache.set(
+        _changes_key(base_currency, RateVersion(base_currency, updated_at).token),
+        (previous.token if previous else None, changes),
+        settings.RATE_CHANGE_LOG_TIMEOUT
+    )
@@ -1,21 +1,55 @@
-from rest_framework import status
+import asyncio
+import json
+from datetime import datetime, time, timezone as dt_timezone
+from django.conf import settings
+from rest_framework import serializers, status
 from rest_framework.views import APIView
 from rest_framework.response import Response
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIRequest
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+from django.http import HttpResponse, HttpResponseNotModified, JsonResponse, StreamingHttpResponse
 from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from django.utils.decorators import method_decorator
+from django.utils.cache import patch_vary_headers
 from django.shortcuts import render
-from .models import Currency, ExchangeRate
+from django.urls import reverse
+from . import metrics
+from .broadcast import rate_broadcaster
+from .crossrates import pivot_for
+from .history import rate_as_of, rate_series
+from .jobs import refresh_jobs
+from .models import Currency
+from .renderers import FastJSONRenderer
 from .serializers import (
-    CurrencySerializer, 
-    ConversionRequestSerializer, 
-    ConversionResponseSerializer
+    represent_conversions,
+    validate_conversion_item
+)
+from .payloads import (
+    build_global_rates,
+    format_global_rates,
+    get_currency_catalog,
+    get_global_rates,
+    global_rates_key,
+    not_modified,
+    rates_queryset
 )
 from .services import CurrencyService
+from .streaming import StreamConverter
+from .versions import aget_rate_version
 
 
 class IndexView(View):
     """Render the main currency converter page"""
     def get(self, request):
-        return render(request, 'index.html')
+        context = {}
+        if settings.INLINE_CURRENCY_CATALOG:
+            # Saves the page an extra /currencies/ round-trip on first load
+            context['currency_catalog'] = get_currency_catalog().inline
+        return render(request, 'index.html', context)
 
 
 class GlobalRatesPageView(View):
@@ -45,28 +79,28 @@ class InfoSecureFreeView(View):
 class CurrenciesView(APIView):
     """Get list of all available currencies"""
     def get(self, request):
-        currencies = Currency.objects.all()
-        serializer = CurrencySerializer(currencies, many=True)
-        return Response(serializer.data)
+        return payload_response(
+            request,
+            get_currency_catalog(),
+            cache_control=f'public, max-age={settings.CURRENCY_CATALOG_MAX_AGE}'
+        )
 
 
 class ConversionView(APIView):
     """Convert currency from one to another"""
     def post(self, request):
-        serializer = ConversionRequestSerializer(data=request.data)
-        
-        if not serializer.is_valid():
-            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        # Same rules and output as the Conversion*Serializers, without their per-field overhead
+        try:
+            from_currency, to_currency, amount = validate_conversion_item(request.data)
+        except serializers.ValidationError as e:
+            return Response(e.detail, status=status.HTTP_400_BAD_REQUEST)
         
         try:
-            result = CurrencyService.convert_currency(
-                from_currency=serializer.validated_data['from_currency'],
-                to_currency=serializer.validated_data['to_currency'],
-                amount=serializer.validated_data['amount']
-            )
-            
-            response_serializer = ConversionResponseSerializer(result)
-            return Response(response_serializer.data)
+            result = CurrencyService.convert_currency(from_currency, to_currency, amount)
+            rendered = represent_conversions([result])[0]
+            if 'error' in rendered:
+                return Response(rendered, status=status.HTTP_400_BAD_REQUEST)
+            return Response(rendered)
             
         except ValueError as e:
             return Response(
@@ -80,25 +114,214 @@ class ConversionView(APIView):
             )
 
 
+class BatchConversionView(APIView):
+    """Convert many amounts in one request, reporting errors per item"""
+    def post(self, request):
+        items = request.data
+        if isinstance(items, dict):
+            items = items.get('conversions')
+        
+        if not isinstance(items, list):
+            return Response(
+                {'error': 'Expected a list of conversions'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        max_items = settings.CONVERSION_BATCH_MAX_ITEMS
+        if len(items) > max_items:
+            return Response(
+                {'error': f'A batch may contain at most {max_items} conversions'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Validate every item up front, keeping the positions of the valid ones
+        results = [None] * len(items)
+        valid = []
+        positions = []
+        for index, item in enumerate(items):
+            try:
+                valid.append(validate_conversion_item(item))
+                positions.append(index)
+            except serializers.ValidationError as e:
+                results[index] = {'error': e.detail}
+        
+        try:
+            converted = represent_conversions(CurrencyService.convert_batch(valid))
+        except Exception as e:
+            return Response(
+                {'error': 'An error occurred during conversion'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+        
+        for index, result in zip(positions, converted):
+            results[index] = result
+        
+        return Response({
+            'results': results,
+            'total': len(results),
+            'errors': sum(1 for result in results if 'error' in result)
+        })
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class ConversionStreamView(View):
+    """Convert an uploaded CSV or NDJSON ledger, streaming the results back"""
+    content_types = {
+        'csv': 'text/csv; charset=utf-8',
+        'ndjson': 'application/x-ndjson; charset=utf-8',
+    }
+    
+    def post(self, request):
+        # Multipart uploads are spooled to disk by Django; raw bodies are read as they arrive
+        upload = request.FILES.get('file') if request.content_type == 'multipart/form-data' else None
+        input_format = self.detect_format(request, upload)
+        
+        if input_format is None:
+            return JsonResponse(
+                {'error': 'Upload CSV (text/csv) or NDJSON (application/x-ndjson) data'}, 
+                status=status.HTTP_415_UNSUPPORTED_MEDIA_TYPE
+            )
+        
+        lines = upload if upload is not None else request
+        return StreamingHttpResponse(
+            StreamConverter(lines, input_format),
+            content_type=self.content_types[input_format]
+        )
+    
+    @staticmethod
+    def detect_format(request, upload):
+        """Work out the input format from ?input=, the upload name or the content type"""
+        requested = request.GET.get('input', '').lower()
+        if requested in ('csv', 'ndjson'):
+            return requested
+        
+        if upload is not None:
+            name = upload.name.lower()
+            if name.endswith('.csv'):
+                return 'csv'
+            if name.endswith(('.ndjson', '.jsonl')):
+                return 'ndjson'
+        
+        content_type = (upload.content_type if upload is not None else request.content_type) or ''
+        if content_type in ('text/csv', 'application/csv'):
+            return 'csv'
+        if content_type in ('application/x-ndjson', 'application/ndjson', 'application/jsonl'):
+            return 'ndjson'
+        return None
+
+
 class RatesRefreshView(APIView):
-    """Manually trigger exchange rate update"""
+    """Queue a refresh of a base currency's exchange rates"""
     def post(self, request):
         base_currency = request.data.get('base_currency', 'USD')
+        if not isinstance(base_currency, str) or not base_currency.strip():
+            return Response(
+                {'error': 'base_currency must be a currency code'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        base_currency = base_currency.strip().upper()
+        # Unknown codes would only fail upstream, after taking a job slot
+        if not Currency.objects.filter(code=base_currency).exists():
+            return Response(
+                {'error': f'Currency {base_currency} not found'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        job, created = refresh_jobs.submit(base_currency)
+        if job is None:
+            return Response(
+                {'error': 'Too many refresh jobs queued, try again later'}, 
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        return Response(
+            job, 
+            status=status.HTTP_202_ACCEPTED,
+            headers={'Location': reverse('refresh_job', args=[job['id']])}
+        )
+
+
+class RefreshJobView(APIView):
+    """Status of a refresh job queued by RatesRefreshView"""
+    def get(self, request, job_id):
+        job = refresh_jobs.get(job_id)
+        if job is None:
+            return Response({'error': 'Refresh job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(job)
+
+
+def parse_timestamp(value, end_of_day=False):
+    """
+    Parse an ISO 8601 date or datetime query parameter into an aware datetime.
+    
+    A bare date means the start of that day, or its last moment with end_of_day.
+    """
+    # Dates first: parse_datetime also accepts them, as midnight
+    try:
+        day = parse_date(value)
+    except ValueError:
+        day = None
+    if day is not None:
+        parsed = datetime.combine(day, time.max if end_of_day else time.min)
+    else:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            raise ValueError(f"Invalid date or datetime: {value}")
+    if timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, dt_timezone.utc)
+    return parsed
+
+
+class RateHistoryView(APIView):
+    """Historical exchange rates: a single as-of lookup, or a range for charts"""
+    def get(self, request):
+        base_currency = request.query_params.get('base', 'USD').upper()
+        target_currency = request.query_params.get('target', '').upper()
+        
+        if not target_currency:
+            return Response(
+                {'error': 'target is required'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         try:
-            success = CurrencyService.update_exchange_rates(base_currency)
+            if 'at' in request.query_params:
+                at = parse_timestamp(request.query_params['at'], end_of_day=True)
+                found = rate_as_of(base_currency, target_currency, at)
+                if found is None:
+                    return Response(
+                        {'error': f'No {base_currency} to {target_currency} rate recorded before {at}'}, 
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                rate, captured_at = found
+                return Response({
+                    'base_currency': base_currency,
+                    'target_currency': target_currency,
+                    'rate': '{:f}'.format(rate),
+                    'captured_at': captured_at
+                })
             
-            if success:
-                return Response({'message': 'Exchange rates updated successfully'})
-            else:
-                return Response(
-                    {'error': 'Failed to update exchange rates'}, 
-                    status=status.HTTP_500_INTERNAL_SERVER_ERROR
-                )
-        except Exception as e:
+            start = request.query_params.get('start')
+            end = request.query_params.get('end')
+            series = rate_series(
+                base_currency,
+                target_currency,
+                start=parse_timestamp(start) if start else None,
+                end=parse_timestamp(end, end_of_day=True) if end else None
+            )
+            return Response({
+                'base_currency': base_currency,
+                'target_currency': target_currency,
+                'points': [
+                    {'captured_at': captured_at, 'rate': '{:f}'.format(rate)}
+                    for captured_at, rate in series
+                ]
+            })
+            
+        except ValueError as e:
             return Response(
                 {'error': str(e)}, 
-                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+                status=status.HTTP_400_BAD_REQUEST
             )
 
 
@@ -109,38 +332,11 @@ class GlobalRatesView(APIView):
         base_currency = request.query_params.get('base', 'BDT').upper()
         
         try:
-            # Get or create base currency
-            base_curr = Currency.objects.get(code=base_currency)
-            
-            # Get all exchange rates from the base currency
-            rates = ExchangeRate.objects.filter(
-                base_currency__code=base_currency
-            ).select_related('target_currency').order_by('target_currency__code')
-            
-            # If no rates found, update them
-            if not rates.exists():
-                CurrencyService.update_exchange_rates(base_currency)
-                rates = ExchangeRate.objects.filter(
-                    base_currency__code=base_currency
-                ).select_related('target_currency').order_by('target_currency__code')
-            
-            # Format data for table display
-            rates_data = [
-                {
-                    'currency_code': rate.target_currency.code,
-                    'currency_name': rate.target_currency.name,
-                    'symbol': rate.target_currency.symbol,
-                    'rate': float(rate.rate),
-                    'last_updated': rate.last_updated
-                }
-                for rate in rates
-            ]
-            
-            return Response({
-                'base_currency': base_currency,
-                'rates': rates_data,
-                'total_currencies': len(rates_data)
-            })
+            # Serialized once per rate version; unchanged tables cost no DB work
+            payload = get_global_rates(base_currency)
+            if payload is None:
+                return Response(format_global_rates(base_currency, []))
+            return payload_response(request, payload)
             
         except Currency.DoesNotExist:
             return Response(
@@ -152,3 +348,212 @@ class GlobalRatesView(APIView):
                 {'error': str(e)}, 
                 status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
+
+
+def payload_response(request, payload, cache_control='no-cache'):
+    """
+    Serve a precomputed payload, honouring conditional GET headers.
+    
+    Clients that accept it get the body precompressed with brotli or gzip,
+    so nothing is compressed per request.
+    """
+    encoding, body = payload.negotiate(request.headers.get('Accept-Encoding', ''))
+    if not_modified(request, payload, encoding):
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(body, content_type='application/json')
+        if encoding is not None:
+            response['Content-Encoding'] = encoding
+    
+    response['ETag'] = payload.etag_for(encoding)
+    if payload.last_modified:
+        response['Last-Modified'] = payload.last_modified
+    response['Cache-Control'] = cache_control
+    patch_vary_headers(response, ['Accept-Encoding'])
+    return response
+
+
+# Async variants of the API views for ASGI deployments (see ASYNC_VIEWS).
+# They use the async ORM and the shared async upstream client, so a worker
+# keeps serving other requests while a refresh is in flight.
+
+def _json_body(request):
+    """Decode a JSON request body, returning None if it is not valid JSON"""
+    try:
+        return json.loads(request.body or b'{}')
+    except ValueError:
+        return None
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncConversionView(View):
+    """Async counterpart of ConversionView"""
+    async def post(self, request):
+        data = _json_body(request)
+        
+        try:
+            from_currency, to_currency, amount = validate_conversion_item(data)
+        except serializers.ValidationError as e:
+            return JsonResponse(e.detail, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            result = await CurrencyService.aconvert_currency(from_currency, to_currency, amount)
+            rendered = represent_conversions([result])[0]
+            if 'error' in rendered:
+                return JsonResponse(rendered, status=status.HTTP_400_BAD_REQUEST)
+            return HttpResponse(
+                FastJSONRenderer().render(rendered),
+                content_type='application/json'
+            )
+            
+        except ValueError as e:
+            return JsonResponse(
+                {'error': str(e)}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        except Exception as e:
+            return JsonResponse(
+                {'error': 'An error occurred during conversion'}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+@method_decorator(csrf_exempt, name='dispatch')
+class AsyncRatesRefreshView(View):
+    """Async counterpart of RatesRefreshView"""
+    async def post(self, request):
+        data = _json_body(request) or {}
+        base_currency = data.get('base_currency', 'USD') if isinstance(data, dict) else 'USD'
+        if not isinstance(base_currency, str) or not base_currency.strip():
+            return JsonResponse(
+                {'error': 'base_currency must be a currency code'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        base_currency = base_currency.strip().upper()
+        if not await Currency.objects.filter(code=base_currency).aexists():
+            return JsonResponse(
+                {'error': f'Currency {base_currency} not found'}, 
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        job, created = await sync_to_async(refresh_jobs.submit)(base_currency)
+        if job is None:
+            return JsonResponse(
+                {'error': 'Too many refresh jobs queued, try again later'}, 
+                status=status.HTTP_503_SERVICE_UNAVAILABLE
+            )
+        response = JsonResponse(job, status=status.HTTP_202_ACCEPTED)
+        response['Location'] = reverse('refresh_job', args=[job['id']])
+        return response
+
+
+class AsyncGlobalRatesView(View):
+    """Async counterpart of GlobalRatesView"""
+    async def get(self, request):
+        base_currency = request.GET.get('base', 'BDT').upper()
+        
+        if pivot_for(base_currency) is not None:
+            # Derived tables are built from the pivot's; share the sync path
+            return await sync_to_async(GlobalRatesView.as_view())(request)
+        
+        try:
+            # Conditional GETs for the current version are answered from the cache alone
+            version = await aget_rate_version(base_currency)
+            payload = await cache.aget(global_rates_key(version)) if version else None
+            metrics.payload_cache_lookups.inc('global_rates', 'miss' if payload is None else 'hit')
+            
+            if payload is None:
+                if not await Currency.objects.filter(code=base_currency).aexists():
+                    return JsonResponse(
+                        {'error': f'Currency {base_currency} not found'}, 
+                        status=status.HTTP_404_NOT_FOUND
+                    )
+                
+                if version is None:
+                    await CurrencyService.arefresh_exchange_rates(base_currency)
+                
+                rates = [rate async for rate in rates_queryset(base_currency)]
+                payload = await sync_to_async(build_global_rates)(base_currency, rates)
+                if payload is None:
+                    return JsonResponse(format_global_rates(base_currency, []))
+            
+            return payload_response(request, payload)
+            
+        except Exception as e:
+            return JsonResponse(
+                {'error': str(e)}, 
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
+            )
+
+
+class RatesStreamView(View):
+    """
+    Server-Sent Events stream of one base currency's rate changes.
+    
+    Sends the full table on connect, then only the pairs that changed on each
+    refresh. Reconnecting clients (Last-Event-ID, or ?since= with a version
+    token) get just the changes they missed when they are still known.
+    """
+    async def get(self, request):
+        if not isinstance(request, ASGIRequest):
+            # Under WSGI a never-ending response would hold a worker per client
+            return JsonResponse(
+                {'error': 'Rate streaming is only available when served over ASGI'}, 
+                status=status.HTTP_501_NOT_IMPLEMENTED
+            )
+        
+        base_currency = request.GET.get('base', 'BDT').upper()
+        if not await Currency.objects.filter(code=base_currency).aexists():
+            return JsonResponse(
+                {'error': f'Currency {base_currency} not found'}, 
+                status=status.HTTP_404_NOT_FOUND
+            )
+        
+        last_event_id = request.headers.get('Last-Event-ID') or request.GET.get('since')
+        response = StreamingHttpResponse(
+            self.events(base_currency, last_event_id),
+            content_type='text/event-stream'
+        )
+        response['Cache-Control'] = 'no-cache'
+        response['X-Accel-Buffering'] = 'no'
+        return response
+    
+    @staticmethod
+    async def events(base_currency, last_event_id):
+        # Subscribe before catching up so no change can slip in between
+        queue = rate_broadcaster.subscribe(base_currency)
+        try:
+            sent = last_event_id
+            caught_up = await rate_broadcaster.catch_up(base_currency, last_event_id)
+            if caught_up is not None:
+                sent, event = caught_up
+                yield event
+            
+            while True:
+                try:
+                    item = await asyncio.wait_for(
+                        queue.get(), timeout=settings.RATE_STREAM_HEARTBEAT
+                    )
+                except asyncio.TimeoutError:
+                    # Comment line that keeps proxies from closing an idle stream
+                    yield b': keepalive\n\n'
+                    continue
+                
+                if item is None:
+                    return
+                version, event = item
+                if version != sent:
+                    sent = version
+                    yield event
+        finally:
+            rate_broadcaster.unsubscribe(base_currency, queue)
+
+
+class MetricsView(View):
+    """Expose request, database, upstream and cache metrics in Prometheus text format"""
+    def get(self, request):
+        return HttpResponse(
+            metrics.render(),
+            content_type='text/plain; version=0.0.4; charset=utf-8'
+        )
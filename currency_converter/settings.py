@@ -45,6 +45,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "converter.metrics.MetricsMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "whitenoise.middleware.WhiteNoiseMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -81,10 +82,18 @@ WSGI_APPLICATION = "currency_converter.wsgi.application"
 # https://docs.djangoproject.com/en/5.1/ref/settings/#databases
 
 # Database configuration
+# Seconds a connection is kept open for reuse by later requests (0 closes it
+# after each request). Health checks replace connections that died while idle.
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', '60'))
+
 if os.environ.get('DATABASE_URL'):
     # Production: Use DATABASE_URL from Render
     DATABASES = {
-        'default': dj_database_url.parse(os.environ.get('DATABASE_URL'))
+        'default': dj_database_url.parse(
+            os.environ.get('DATABASE_URL'),
+            conn_max_age=DB_CONN_MAX_AGE,
+            conn_health_checks=True
+        )
     }
 else:
     # Development: Use local PostgreSQL
@@ -96,6 +105,47 @@ else:
             "PASSWORD": os.environ.get('DB_PASSWORD', 'postgres123'),
             "HOST": os.environ.get('DB_HOST', 'localhost'),
             "PORT": os.environ.get('DB_PORT', '5432'),
+            "CONN_MAX_AGE": DB_CONN_MAX_AGE,
+            "CONN_HEALTH_CHECKS": True,
+        }
+    }
+
+# Read replicas, as comma-separated database URLs. They become the aliases
+# replica1, replica2, ...; reads are spread across them and writes go to
+# default. To try the routing locally, list the primary's own URL here.
+DATABASE_REPLICAS = []
+for number, replica_url in enumerate(
+    [url.strip() for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url.strip()], 1
+):
+    DATABASES[f'replica{number}'] = dj_database_url.parse(
+        replica_url,
+        conn_max_age=DB_CONN_MAX_AGE,
+        conn_health_checks=True,
+        # Tests run everything against the primary's test database
+        test_options={'MIRROR': 'default'}
+    )
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['converter.routers.PrimaryReplicaRouter']
+
+# Seconds reads stay on the primary after this process writes, or after it
+# sees a rate table refreshed elsewhere. Keep it above the replicas' worst lag.
+DATABASE_REPLICATION_LAG = float(os.environ.get('DATABASE_REPLICATION_LAG', '5'))
+
+# Cache
+# Shared across worker processes via Redis in production; refresh locks and
+# rate versions rely on it being shared.
+if os.environ.get('REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get('REDIS_URL'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         }
     }
 
@@ -152,9 +202,11 @@ DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 # REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_RENDERER_CLASSES': [
-        'rest_framework.renderers.JSONRenderer',
-        'rest_framework.renderers.BrowsableAPIRenderer',
-    ],
+        'converter.renderers.FastJSONRenderer',
+    ] + (
+        # The browsable API is a development aid; rendering it is costly
+        ['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []
+    ),
     'DEFAULT_PARSER_CLASSES': [
         'rest_framework.parsers.JSONParser',
     ],
@@ -166,3 +218,166 @@ CORS_ALLOW_ALL_ORIGINS = True
 # Exchange Rate API
 EXCHANGE_RATE_API_KEY = os.environ.get('EXCHANGE_RATE_API_KEY', '')
 EXCHANGE_RATE_API_URL = 'https://api.exchangerate-api.com/v4/latest/'
+
+# Rate providers tried by CurrencyService.fetch_exchange_rates. Each entry names
+# a RateProvider subclass and its constructor options; a second provider is
+# only called when the first is slow (hedging) or failing.
+EXCHANGE_RATE_PROVIDERS = [
+    {
+        'NAME': 'exchangerate-api',
+        'BACKEND': 'converter.services.HTTPRateProvider',
+        'OPTIONS': {'url': EXCHANGE_RATE_API_URL},
+    },
+]
+if os.environ.get('EXCHANGE_RATE_SECONDARY_API_URL'):
+    EXCHANGE_RATE_PROVIDERS.append({
+        'NAME': 'secondary',
+        'BACKEND': 'converter.services.HTTPRateProvider',
+        'OPTIONS': {'url': os.environ.get('EXCHANGE_RATE_SECONDARY_API_URL')},
+    })
+
+# Seconds to wait on a provider before hedging with the next one, used until
+# enough latency samples exist to use its p95 instead
+EXCHANGE_RATE_HEDGE_DELAY = float(os.environ.get('EXCHANGE_RATE_HEDGE_DELAY', '1.0'))
+
+EXCHANGE_RATE_API_TIMEOUT = float(os.environ.get('EXCHANGE_RATE_API_TIMEOUT', '10'))
+EXCHANGE_RATE_API_MAX_CONNECTIONS = int(os.environ.get('EXCHANGE_RATE_API_MAX_CONNECTIONS', '20'))
+EXCHANGE_RATE_API_RETRIES = int(os.environ.get('EXCHANGE_RATE_API_RETRIES', '2'))
+# Base delay in seconds for jittered exponential backoff between retries
+EXCHANGE_RATE_API_BACKOFF = float(os.environ.get('EXCHANGE_RATE_API_BACKOFF', '0.2'))
+# Consecutive failures that open the circuit, and seconds before it is retried
+EXCHANGE_RATE_API_FAILURE_THRESHOLD = int(os.environ.get('EXCHANGE_RATE_API_FAILURE_THRESHOLD', '5'))
+EXCHANGE_RATE_API_RESET_TIMEOUT = float(os.environ.get('EXCHANGE_RATE_API_RESET_TIMEOUT', '30'))
+
+# Seconds a process keeps its in-memory rate matrix before reloading it
+RATE_ENGINE_RELOAD_INTERVAL = int(os.environ.get('RATE_ENGINE_RELOAD_INTERVAL', '60'))
+
+# Seconds an exchange rate is considered fresh
+EXCHANGE_RATE_MAX_AGE = int(os.environ.get('EXCHANGE_RATE_MAX_AGE', str(24 * 60 * 60)))
+
+# Seconds past EXCHANGE_RATE_MAX_AGE during which a stale rate is still served
+# without refreshing inline. Set this when run_rate_refresher keeps rates fresh
+# so the request path only ever reads.
+EXCHANGE_RATE_STALE_TTL = int(os.environ.get('EXCHANGE_RATE_STALE_TTL', '0'))
+
+# Seconds past the stale-serve window during which the last good rate is
+# returned instantly while a background refresh fetches a new one. Older
+# rates block on the refresh.
+EXCHANGE_RATE_STALE_WHILE_REVALIDATE = int(
+    os.environ.get('EXCHANGE_RATE_STALE_WHILE_REVALIDATE', str(24 * 60 * 60))
+)
+
+# Base currencies kept fresh by run_rate_refresher, as "CODE:seconds" pairs
+RATE_REFRESH_SCHEDULE = {
+    code.strip().upper(): int(interval)
+    for code, interval in (
+        entry.split(':')
+        for entry in os.environ.get('RATE_REFRESH_SCHEDULE', 'USD:3600').split(',')
+        if entry.strip()
+    )
+}
+
+# Seconds a cluster-wide single-flight lock (e.g. a rate refresh) may be held
+SINGLE_FLIGHT_LOCK_TIMEOUT = int(os.environ.get('SINGLE_FLIGHT_LOCK_TIMEOUT', '60'))
+
+# Seconds callers wait for an in-flight refresh before serving what they have
+SINGLE_FLIGHT_WAIT_TIMEOUT = int(os.environ.get('SINGLE_FLIGHT_WAIT_TIMEOUT', '15'))
+
+# Largest number of items accepted by /conversions/batch/
+CONVERSION_BATCH_MAX_ITEMS = int(os.environ.get('CONVERSION_BATCH_MAX_ITEMS', '50000'))
+
+# Rows converted per chunk by /conversions/stream/
+CONVERSION_STREAM_CHUNK_SIZE = int(os.environ.get('CONVERSION_STREAM_CHUNK_SIZE', '1000'))
+
+# Serve /conversions/, /rates/global/ and /rates/refresh/ from async views.
+# Only useful when running under ASGI (e.g. gunicorn -k uvicorn.workers.UvicornWorker).
+ASYNC_VIEWS = os.environ.get('ASYNC_VIEWS', 'False') == 'True'
+
+# Seconds a process trusts its cached rate version before re-reading it from
+# the database. Versions are bumped on refresh, so this only bounds staleness
+# when the cache is not shared between processes.
+RATE_VERSION_CACHE_TIMEOUT = int(os.environ.get('RATE_VERSION_CACHE_TIMEOUT', '60'))
+
+# Seconds a precomputed, version-keyed response payload is kept
+RATE_PAYLOAD_CACHE_TIMEOUT = int(os.environ.get('RATE_PAYLOAD_CACHE_TIMEOUT', str(24 * 60 * 60)))
+
+# Seconds the pre-rendered currency catalog is cached server-side (it is also
+# invalidated whenever currencies are added or changed) and by browsers
+CURRENCY_CATALOG_CACHE_TIMEOUT = int(os.environ.get('CURRENCY_CATALOG_CACHE_TIMEOUT', str(24 * 60 * 60)))
+CURRENCY_CATALOG_MAX_AGE = int(os.environ.get('CURRENCY_CATALOG_MAX_AGE', '3600'))
+
+# Embed the currency catalog in the index page so it needs no /currencies/ call
+INLINE_CURRENCY_CATALOG = os.environ.get('INLINE_CURRENCY_CATALOG', 'True') == 'True'
+
+# Append a packed snapshot of each refreshed rate table to RateHistory
+RATE_HISTORY_ENABLED = os.environ.get('RATE_HISTORY_ENABLED', 'True') == 'True'
+
+# Most points returned by /rates/history/ ranges; longer ranges are thinned
+RATE_HISTORY_MAX_POINTS = int(os.environ.get('RATE_HISTORY_MAX_POINTS', '1000'))
+
+# Directory shared by every worker process where each one writes its metrics,
+# so /metrics reports totals for the whole server rather than one worker.
+# Leave empty for a single process. Clear it when the server starts.
+METRICS_DIR = os.environ.get('METRICS_DIR', '')
+
+# Seconds between a process writing its metrics to METRICS_DIR
+METRICS_FLUSH_INTERVAL = float(os.environ.get('METRICS_FLUSH_INTERVAL', '5'))
+
+# Per-process cache of the hottest currency pairs: how many are kept and for
+# how many seconds. Refreshes in this process drop entries immediately; the TTL
+# bounds how long other processes may serve a pair from before a refresh.
+RATE_CACHE_L1_SIZE = int(os.environ.get('RATE_CACHE_L1_SIZE', '1024'))
+RATE_CACHE_L1_TTL = float(os.environ.get('RATE_CACHE_L1_TTL', '10'))
+
+# Seconds a pair is kept in the shared cache; keys change on every refresh
+RATE_CACHE_L2_TIMEOUT = int(os.environ.get('RATE_CACHE_L2_TIMEOUT', str(24 * 60 * 60)))
+
+# /rates/stream/: seconds between checks of the shared rate version (one per
+# subscribed base per process, however many clients), seconds between
+# keepalive comments, changes buffered per slow client before it is dropped,
+# and how many past refreshes reconnecting clients can catch up from
+RATE_STREAM_POLL_INTERVAL = float(os.environ.get('RATE_STREAM_POLL_INTERVAL', '1'))
+RATE_STREAM_HEARTBEAT = float(os.environ.get('RATE_STREAM_HEARTBEAT', '15'))
+RATE_STREAM_QUEUE_SIZE = int(os.environ.get('RATE_STREAM_QUEUE_SIZE', '16'))
+RATE_STREAM_DELTA_HISTORY = int(os.environ.get('RATE_STREAM_DELTA_HISTORY', '32'))
+
+# Seconds each refresh's change set is kept in the shared cache, where other
+# processes apply it instead of re-reading the whole table
+RATE_CHANGE_LOG_TIMEOUT = int(os.environ.get('RATE_CHANGE_LOG_TIMEOUT', str(24 * 60 * 60)))
+
+# Triangulation: when set, only this currency's table (plus any listed in
+# RATE_EXACT_QUOTE_BASES) is fetched and stored, and every other pair A->B is
+# derived as rate(pivot->B) / rate(pivot->A). Leave empty to fetch each base.
+RATE_PIVOT_CURRENCY = os.environ.get('RATE_PIVOT_CURRENCY', '').strip().upper()
+RATE_EXACT_QUOTE_BASES = {
+    code.strip().upper()
+    for code in os.environ.get('RATE_EXACT_QUOTE_BASES', '').split(',')
+    if code.strip()
+}
+
+# Significant digits used when dividing pivot rates; results are then rounded
+# to the six decimal places stored rates have
+RATE_CROSS_PRECISION = int(os.environ.get('RATE_CROSS_PRECISION', '28'))
+
+# Path of the rate snapshot file shared by every worker on the host. When set,
+# refreshes publish the whole rate matrix there and workers memory-map it
+# instead of each keeping its own copy; put it on a local disk or tmpfs that
+# the refresher process can write too (containers do not share /dev/shm).
+# Workers check for a newer file every RATE_SNAPSHOT_CHECK_INTERVAL seconds.
+RATE_SNAPSHOT_PATH = os.environ.get('RATE_SNAPSHOT_PATH', '')
+RATE_SNAPSHOT_CHECK_INTERVAL = float(os.environ.get('RATE_SNAPSHOT_CHECK_INTERVAL', '1'))
+
+# POST /rates/refresh/ queues a job instead of refreshing inline. Repeated
+# requests for a base within REFRESH_JOB_DEDUP_WINDOW seconds share one job;
+# each process runs jobs on REFRESH_JOB_WORKERS threads and refuses new ones
+# while REFRESH_JOB_QUEUE_SIZE are queued or running. Job status is kept for
+# REFRESH_JOB_TTL seconds.
+REFRESH_JOB_DEDUP_WINDOW = int(os.environ.get('REFRESH_JOB_DEDUP_WINDOW', '60'))
+REFRESH_JOB_WORKERS = int(os.environ.get('REFRESH_JOB_WORKERS', '2'))
+REFRESH_JOB_QUEUE_SIZE = int(os.environ.get('REFRESH_JOB_QUEUE_SIZE', '16'))
+REFRESH_JOB_TTL = int(os.environ.get('REFRESH_JOB_TTL', str(60 * 60)))
+
+# Cached API payloads (/rates/global/, /currencies/) at least this many bytes
+# long are precompressed once per version with gzip, and brotli when it is
+# installed, and served to clients that accept them
+PAYLOAD_COMPRESS_MIN_SIZE = int(os.environ.get('PAYLOAD_COMPRESS_MIN_SIZE', '512'))